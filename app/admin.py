@@ -3,28 +3,47 @@ from .models import (
     Budget, BudgetFile, Department, 
     Bill, BillFile, Currency, CategoryBill,
     TypeTransaction, StatusTransaction ,ActivityLog,
-    CustomUser
+    CustomUser, DepartmentBalance, BillMonthlyRollup, ActivityCounter, FileBlob
 )
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from .utils import search as search_index
+
+class IndexedSearchMixin:
+    """
+    Admin search through the FTS5 index. With more than search_limit matches
+    the ids would not fit a pk__in filter, the ORM search over search_fields
+    returns all of them instead.
+    """
+    search_kind = None
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search_index.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        hits = search_index.search(search_term, kind=self.search_kind, limit=self.search_limit + 1)
+        if len(hits) > self.search_limit:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=[pk for _, pk in hits]), False
 
 class BudgetFileInLine(admin.TabularInline):
     model = BudgetFile
     extra = 1
 
 @admin.register(Budget)
-class BudgetAdmin(admin.ModelAdmin):
+class BudgetAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = (
         'title', 'total_mount', 'edit',
         'currency', 'created_at', 
          'due_date','type', 'department',
         )
-    search_fields = ('title', 'department')
+    search_fields = ('title', 'description', 'department__name')
+    search_kind = 'budget'
     inlines = [BudgetFileInLine]
 
 @admin.register(BudgetFile)
 class BudgetFileAdmin(admin.ModelAdmin):
-    list_display= ('budget', 'file')
+    list_display= ('budget', 'filename', 'file')
 
 @admin.register(StatusTransaction)
 class StatusTransactionAdmin(admin.ModelAdmin):
@@ -36,13 +55,14 @@ class BillFileInLine(admin.TabularInline):
     extra = 1
 
 @admin.register(Bill)
-class BillAdmin(admin.ModelAdmin):
+class BillAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = (
         'title', 'total_mount', 
         'currency', 'created_at', 
          'due_date','type', 'department'
         )
-    search_fields = ('title', 'department')
+    search_fields = ('title', 'description', 'department__name')
+    search_kind = 'bill'
     inlines = [BillFileInLine]
     
 @admin.register(Currency)
@@ -58,12 +78,36 @@ class DepartmentsAdmin(admin.ModelAdmin):
     list_display = ('name', 'description', 'phone', 'location')
     search_fields = ('name', 'phone', 'location')
 
+@admin.register(DepartmentBalance)
+class DepartmentBalanceAdmin(admin.ModelAdmin):
+    list_display = ('department', 'currency', 'total_budgets', 'total_bills', 'budgets_count', 'bills_count', 'updated')
+    list_filter = ('currency',)
+
+@admin.register(BillMonthlyRollup)
+class BillMonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('month', 'department', 'category', 'type', 'status', 'currency', 'total', 'count')
+    list_filter = ('month', 'department')
+
 @admin.register(ActivityLog)
 class ActivityLogAdmin(admin.ModelAdmin):
     list_display = ("timestamp", "level", "action", "method", "path", "ip_address") #"user",)
     list_filter = ("level", "timestamp")#"user",)
     search_fields = ("action", "path",) #"user__username")
     ordering = ("-timestamp",)
+    show_full_result_count = False # Skip the unfiltered COUNT(*), older rows live in the archives
+
+@admin.register(ActivityCounter)
+class ActivityCounterAdmin(admin.ModelAdmin):
+    list_display = ("minute", "view_name", "method", "status", "count", "average_latency")
+    list_filter = ("method", "status")
+    search_fields = ("view_name",)
+    show_full_result_count = False
+
+@admin.register(FileBlob)
+class FileBlobAdmin(admin.ModelAdmin):
+    list_display = ("name", "size", "references", "created_at")
+    search_fields = ("name",)
+    readonly_fields = ("name", "size", "references", "created_at")
 
 @admin.register(CategoryBill)
 class CategoryBillAdmin(admin.ModelAdmin):
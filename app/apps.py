@@ -7,6 +7,8 @@ class AppConfig(AppConfig):
 
     def ready(self):
         import app.signals
+        from app.utils.log_handlers import start_log_listeners
+        start_log_listeners()
 
 
 # Conectando las señales de signals.py al eliminar un presupuesto de departamento y sus archivos
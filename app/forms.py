@@ -132,10 +132,12 @@ class BillForm(forms.ModelForm):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         
+        # Budget.__str__ of every option reads department and currency
+        budgets = Budget.objects.select_related('department', 'currency')
         if user.is_superuser:
-            self.fields['budget'].queryset = Budget.objects.filter(is_closed=False)
+            self.fields['budget'].queryset = budgets.filter(is_closed=False)
         else:
-            self.fields['budget'].queryset = Budget.objects.filter(
+            self.fields['budget'].queryset = budgets.filter(
                 department__in = user.departments.all(),
                 is_closed=False
             )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from app.utils.log_archive import archive_activity_logs, cutoff_for
+
+"""
+execute: python manage.py archive_activity_logs [--days 90] [--chunk-size 5000] [--dry-run]
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Move ActivityLog rows older than the retention window to monthly gzipped JSONL archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Retention in days (default ACTIVITY_LOG_RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows to archive')
+
+    def handle(self, *args, **options):
+        totals = archive_activity_logs(
+            days=options['days'], chunk_size=options['chunk_size'], dry_run=options['dry_run']
+        )
+        for month, count in sorted(totals.items()):
+            self.stdout.write(f'{month}: {count}')
+        verb = 'to archive' if options['dry_run'] else 'archived'
+        self.stdout.write(
+            self.style.SUCCESS(f'ACTIVITY LOGS {verb}: {sum(totals.values())} rows before {cutoff_for(options["days"]):%Y-%m-%d}')
+        )
@@ -0,0 +1,199 @@
+import json
+import os
+import timeit
+import tracemalloc
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from app.forms import BillForm
+from app.models import Budget, Bill, CategoryBill, CustomUser, Department, returning_title_to_bill_and_budget
+from app import views
+
+"""
+execute: python manage.py bench [--prefix seed] [--save] [--baseline bench_baseline.json]
+
+Microbenchmarks of the hot building blocks over the seed_load dataset, without
+HTTP nor middleware. Each one reports ops/sec (best of --repeat timeit rounds),
+queries per op and the memory allocated per op (tracemalloc peak). --save
+writes the results as baseline, later runs compare against it and flag the
+ones slower or allocating more than --tolerance.
+"""
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'bench_baseline.json')
+
+LIST_VIEWS = (
+    ('render_budget_list', views.BudgetListView, 'app:list_budget'),
+    ('render_bills_list', views.BillListView, 'app:list_bills'),
+    ('render_categories_list', views.CategoryBillsList, 'app:categories_bills'),
+    ('render_departments_list', views.DepartmentListView, 'app:list_departments'),
+)
+
+
+class Command(BaseCommand):
+
+    help = 'Time the expensive model, form and template building blocks, compare against a saved baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed', help='Dataset of manage.py seed_load to use')
+        parser.add_argument('--repeat', type=int, default=5, help='timeit rounds, the best one is reported')
+        parser.add_argument('--only', nargs='*', default=None, help='Run only these benchmarks')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown or extra allocation, 0.25 is 25%%')
+        parser.add_argument('--fail', action='store_true', help='Exit with error when a benchmark regressed')
+
+    def handle(self, *args, **options):
+        self.options = options
+        user = (
+            CustomUser.objects.filter(email__startswith=f"{options['prefix']}-", is_superuser=False, departments__isnull=False)
+            .order_by('id').first()
+        )
+        if user is None:
+            raise CommandError(f"No users for prefix '{options['prefix']}', run manage.py seed_load first")
+
+        benchmarks = self.benchmarks(user)
+        if options['only']:
+            unknown = set(options['only']) - set(benchmarks)
+            if unknown:
+                raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Available: {', '.join(benchmarks)}")
+            benchmarks = {name: benchmarks[name] for name in options['only']}
+
+        results = {name: self.measure(function) for name, function in benchmarks.items()}
+        baseline = self.load_baseline()
+        regressions = self.print_results(results, baseline)
+
+        if options['save']:
+            with open(options['baseline'], 'w') as output:
+                json.dump(dict(baseline, **results), output, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline saved in {options['baseline']}")
+        if regressions and options['fail']:
+            raise CommandError(f"Regressions: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS(f'BENCH done: {len(results)} benchmarks, {len(regressions)} regressions'))
+
+    def benchmarks(self, user):
+        """name -> callable, the setup (fixtures, warm caches) is done here and not timed."""
+        departments = list(user.departments.order_by('id'))
+        department = max(departments, key=lambda item: item.budgets.count())
+        root = (
+            CategoryBill.objects.filter(parent__isnull=True, subcategories__isnull=False)
+            .order_by('id').first() or CategoryBill.objects.order_by('id').first()
+        )
+        budgets = list(Budget.objects.filter(department__in=departments).select_related('department', 'currency')[:100])
+        bills = list(Bill.objects.filter(department__in=departments).select_related('department', 'currency')[:100])
+        if not budgets or root is None:
+            raise CommandError(f"Dataset '{self.options['prefix']}' has no budgets or categories for {user}")
+
+        def department_balance():
+            # ledger_totals is cached per instance, a new request reads it again
+            department.__dict__.pop('ledger_totals', None)
+            return department.balance
+
+        def budget_str():
+            return [str(budget) for budget in budgets]
+
+        def bill_str():
+            return [str(bill) for bill in bills]
+
+        def title_function():
+            budget = budgets[0]
+            return returning_title_to_bill_and_budget(
+                budget.set_date, budget.due_date, budget.department, budget.title, budget.total_mount, budget.currency
+            )
+
+        def bill_form():
+            return BillForm(user=user)
+
+        def bill_form_budget_select():
+            # Construction plus the options of the budget select (Budget.__str__ per option)
+            return str(BillForm(user=user)['budget'])
+
+        benchmarks = {
+            'department_balance': department_balance,
+            'category_subcategories': lambda: root.get_all_subcategories,
+            'returning_title': title_function,
+            'budget_str_x100': budget_str,
+            'bill_str_x100': bill_str,
+            'bill_form_init': bill_form,
+            'bill_form_budget_select': bill_form_budget_select,
+        }
+        for name, view, url in LIST_VIEWS:
+            benchmarks[name] = self.template_render(view, url, user)
+        return benchmarks
+
+    def template_render(self, view, url, user):
+        """Only the template rendering, the page of the view is built and evaluated once beforehand."""
+        request = RequestFactory().get(reverse(url), HTTP_HOST='localhost')
+        request.user = user
+        request.session = {}
+        response = view.as_view()(request)
+        template = response.resolve_template(response.template_name)
+        context = response.context_data
+        template.render(context, request)
+
+        def render():
+            return template.render(context, request)
+        return render
+
+    def measure(self, function):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=self.options['repeat'], number=number))
+
+        with CaptureQueriesContext(connection) as queries:
+            function()
+
+        tracemalloc.start()
+        try:
+            function()
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'ops_per_sec': round(number / best, 1),
+            'us_per_op': round(best / number * 1e6, 2),
+            'queries': len(queries),
+            'alloc_kb': round((peak - before) / 1024, 2),
+        }
+
+    def load_baseline(self):
+        if not os.path.exists(self.options['baseline']):
+            return {}
+        try:
+            with open(self.options['baseline']) as source:
+                return json.load(source)
+        except ValueError as e:
+            raise CommandError(f"Invalid baseline {self.options['baseline']}: {e}")
+
+    def print_results(self, results, baseline):
+        """Prints the table, returns the names of the regressed benchmarks."""
+        tolerance = self.options['tolerance']
+        header = f"{'benchmark':<26}{'ops/sec':>12}{'us/op':>11}{'queries':>9}{'alloc KB':>10}{'vs baseline':>24}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        regressions = []
+        for name, result in results.items():
+            line = (
+                f"{name:<26}{result['ops_per_sec']:>12.1f}{result['us_per_op']:>11.2f}"
+                f"{result['queries']:>9}{result['alloc_kb']:>10.2f}"
+            )
+            previous = baseline.get(name)
+            if previous is None:
+                self.stdout.write(line + f"{'(new)':>24}")
+                continue
+            speed = result['ops_per_sec'] / previous['ops_per_sec'] - 1 if previous['ops_per_sec'] else 0.0
+            alloc = result['alloc_kb'] / previous['alloc_kb'] - 1 if previous['alloc_kb'] else 0.0
+            line += f"{speed * 100:>+11.1f}% ops{alloc * 100:>+8.1f}% KB"
+            # Mas consultas por operacion siempre es regresion
+            if speed < -tolerance or alloc > tolerance or result['queries'] > previous['queries']:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        return regressions
@@ -0,0 +1,69 @@
+import logging
+import logging.handlers
+import queue
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from app.utils.log_handlers import QueueLogHandler, JsonFormatter, GzipRotatingFileHandler
+
+"""
+execute: python manage.py bench_logging [--records 20000]
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Per call overhead of the synchronous FileHandler against the queued JSON pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=20000)
+
+    def run(self, logger, records):
+        """Per call durations in microseconds, sorted."""
+        user, path = 'bench@kashet.cl', '/budgets/list/'
+        timings = []
+        for i in range(records):
+            started = time.perf_counter()
+            logger.info(f"User {user} access budget list", extra={"path": path, "method": "GET"})
+            timings.append((time.perf_counter() - started) * 1e6)
+        return sorted(timings)
+
+    def handle(self, *args, **options):
+        records = options['records']
+        with tempfile.TemporaryDirectory() as directory:
+            # Before: FileHandler written from the calling thread
+            file_handler = logging.FileHandler(f'{directory}/sync.log')
+            file_handler.setFormatter(logging.Formatter("[{asctime}] {levelname} {name} ({lineno}): {message}", style="{"))
+            sync_logger = self.make_logger('bench.sync', file_handler)
+            sync_elapsed = self.run(sync_logger, records)
+            file_handler.close()
+
+            # After: the caller only enqueues, the listener formats JSON and rotates
+            target = GzipRotatingFileHandler(f'{directory}/queued.log', maxBytes=1024 * 1024, backupCount=3)
+            target.setFormatter(JsonFormatter())
+            queue_handler = QueueLogHandler(queue.Queue(maxsize=records))
+            listener = logging.handlers.QueueListener(queue_handler.queue, target)
+            listener.start()
+            queued_logger = self.make_logger('bench.queued', queue_handler)
+            queued_elapsed = self.run(queued_logger, records)
+            drain_started = time.perf_counter()
+            listener.stop()
+            drain_elapsed = time.perf_counter() - drain_started
+            target.close()
+
+        self.stdout.write(f'{"us per call":<18} {"mean":>8} {"p50":>8} {"p99":>8} {"max":>9}')
+        for label, timings in (('sync FileHandler', sync_elapsed), ('queued JSON', queued_elapsed)):
+            self.stdout.write(
+                f'{label:<18} {sum(timings) / records:8.2f} {timings[records // 2]:8.2f} '
+                f'{timings[int(records * 0.99)]:8.2f} {timings[-1]:9.2f}'
+            )
+        self.stdout.write(f'{"listener drain":<18} {drain_elapsed:8.3f} s after the last call')
+        self.stdout.write(self.style.SUCCESS(f'LOGGING benchmark done: {records} records per pipeline'))
+
+    @staticmethod
+    def make_logger(name, handler):
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        return logger
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from app.utils.db_tuning import apply_sqlite_pragmas, sqlite_pragmas
+
+"""
+execute: python manage.py bench_sqlite [--readers 4 --writers 2 --seconds 5]
+
+Concurrent readers and writers on a scratch SQLite file, as the WSGI workers
+do: once with the defaults (rollback journal, deferred transactions, a
+connection per request) and once with SQLITE_PRAGMAS, IMMEDIATE transactions
+and persistent connections.
+"""
+
+SCHEMA = """
+CREATE TABLE bill (
+    id INTEGER PRIMARY KEY,
+    department_id INTEGER NOT NULL,
+    total_mount INTEGER NOT NULL,
+    title TEXT NOT NULL
+);
+CREATE INDEX bill_department_idx ON bill (department_id);
+"""
+DEPARTMENTS = 20
+
+
+class Command(BaseCommand):
+
+    help = 'Concurrent read/write throughput of SQLite with and without the connection tuning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--rows', type=int, default=20000, help='Initial rows')
+
+    def handle(self, *args, **options):
+        modes = (
+            ('default', {}, 'DEFERRED', False),
+            ('tuned', sqlite_pragmas(), 'IMMEDIATE', True),
+        )
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            for label, pragmas, transaction_mode, persistent in modes:
+                path = os.path.join(directory, f'{label}.sqlite3')
+                self.create(path, options['rows'])
+                results.append((label, self.run(path, pragmas, transaction_mode, persistent, options)))
+
+        self.stdout.write(f'{"mode":<10}{"reads/s":>10}{"writes/s":>10}{"locked":>8}{"read p99 ms":>13}{"write p99 ms":>14}')
+        for label, result in results:
+            self.stdout.write(
+                f'{label:<10}{result["reads"] / options["seconds"]:>10.1f}{result["writes"] / options["seconds"]:>10.1f}'
+                f'{result["locked"]:>8}{result["read_p99"]:>13.2f}{result["write_p99"]:>14.2f}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'SQLITE benchmark done: {options["readers"]} readers, {options["writers"]} writers, {options["seconds"]} s per mode'
+        ))
+
+    @staticmethod
+    def create(path, rows):
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+        connection.executemany(
+            'INSERT INTO bill (department_id, total_mount, title) VALUES (?, ?, ?)',
+            ((i % DEPARTMENTS, i, f'bill {i}') for i in range(rows)),
+        )
+        connection.commit()
+        connection.close()
+
+    def run(self, path, pragmas, transaction_mode, persistent, options):
+        deadline = time.perf_counter() + options['seconds']
+        lock = threading.Lock()
+        result = {'reads': 0, 'writes': 0, 'locked': 0}
+        timings = {'read': [], 'write': []}
+
+        def connect():
+            # isolation_level=None: the transactions are opened explicitly, as Django does
+            connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            cursor = connection.cursor()
+            apply_sqlite_pragmas(cursor, pragmas)
+            cursor.close()
+            return connection
+
+        def read(connection, i):
+            connection.execute(
+                'SELECT department_id, COUNT(*), SUM(total_mount) FROM bill WHERE department_id = ? GROUP BY department_id',
+                (i % DEPARTMENTS,),
+            ).fetchall()
+            connection.execute('SELECT * FROM bill ORDER BY id DESC LIMIT 10').fetchall()
+
+        def write(connection, i):
+            # Read then write in one transaction, like a form save
+            connection.execute(f'BEGIN {transaction_mode}')
+            try:
+                connection.execute('SELECT COUNT(*) FROM bill WHERE department_id = ?', (i % DEPARTMENTS,)).fetchone()
+                connection.execute(
+                    'INSERT INTO bill (department_id, total_mount, title) VALUES (?, ?, ?)',
+                    (i % DEPARTMENTS, i, f'new bill {i}'),
+                )
+                connection.execute('COMMIT')
+            except sqlite3.OperationalError:
+                connection.execute('ROLLBACK')
+                raise
+
+        def worker(kind, operation):
+            connection = connect() if persistent else None
+            i = 0
+            while time.perf_counter() < deadline:
+                i += 1
+                started = time.perf_counter()
+                # Without CONN_MAX_AGE every request opens its own connection
+                current = connection or connect()
+                try:
+                    operation(current, i)
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    with lock:
+                        result['locked'] += 1
+                    continue
+                finally:
+                    if connection is None:
+                        current.close()
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    result[f'{kind}s'] += 1
+                    timings[kind].append(elapsed)
+            if connection is not None:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=('read', read)) for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=('write', write)) for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for kind in ('read', 'write'):
+            values = sorted(timings[kind])
+            result[f'{kind}_p99'] = values[int(len(values) * 0.99)] if values else 0.0
+        return result
@@ -0,0 +1,303 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from app.models import Budget, Bill, CustomUser, TypeTransaction, StatusTransaction
+
+"""
+execute: python manage.py load_test --users 20 --concurrency 8 --requests 2000 --seed 7
+
+Replays a weighted mix of requests with the Django test client (in process,
+full middleware stack) from a thread pool. Users, targets and the request
+plan only depend on --seed, so runs over the same dataset (manage.py
+seed_load) are comparable, --output saves a report and --compare prints the
+deltas against a previous one.
+"""
+
+DEFAULT_MIX = 'dashboard=30,list_budget=15,list_bills=15,detail_budget=10,detail_bill=15,add_bill=10,update_bill=5'
+ACTIONS = ('dashboard', 'list_budget', 'list_bills', 'detail_budget', 'detail_bill', 'add_bill', 'update_bill')
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise CommandError(f"Unknown action '{action}', expected one of {', '.join(ACTIONS)}")
+        try:
+            mix[action] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight for '{action}': '{weight}'")
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError('--mix needs at least one positive weight')
+    return mix
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, errors):
+    latencies = sorted(latencies)
+    summary = {'count': len(latencies), 'errors': errors}
+    for pct in PERCENTILES:
+        summary[f'p{pct}_ms'] = round(percentile(latencies, pct), 2)
+    summary['mean_ms'] = round(statistics.fmean(latencies), 2) if latencies else 0.0
+    summary['max_ms'] = round(latencies[-1], 2) if latencies else 0.0
+    return summary
+
+
+class SimulatedUser:
+
+    """One logged in client and the budgets and bills of its departments."""
+    def __init__(self, user, host):
+        self.user = user
+        self.client = Client(HTTP_HOST=host, raise_request_exception=False)
+        self.client.force_login(user)
+        departments = list(user.departments.values_list('id', flat=True))
+        self.budgets = list(
+            Budget.objects.filter(department__in=departments, is_closed=False)
+            .order_by('id').values_list('identifier', 'id', 'department_id', 'currency_id')[:200]
+        )
+        self.bills = list(
+            Bill.objects.filter(department__in=departments, edit=True, budget__is_closed=False)
+            .order_by('id').values('identifier', 'title', 'description', 'total_mount', 'currency_id',
+                                   'budget_id', 'type_id', 'status_id', 'department_id', 'category_id')[:200]
+        )
+
+
+class Command(BaseCommand):
+
+    help = 'Concurrent load test over the main pages, prints p50/p95/p99 latency and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed', help='Users created by manage.py seed_load with this prefix')
+        parser.add_argument('--users', type=int, default=10, help='Simulated users, each one with its own departments')
+        parser.add_argument('--concurrency', type=int, default=4, help='Worker threads')
+        parser.add_argument('--requests', type=int, default=500, help='Measured requests')
+        parser.add_argument('--warmup', type=int, default=50, help='Requests before measuring (caches, connections)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f'Weights per action, default {DEFAULT_MIX}')
+        parser.add_argument('--host', default='localhost', help='HTTP_HOST, must be in ALLOWED_HOSTS')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Previous JSON report, prints the deltas')
+
+    def handle(self, *args, **options):
+        if isinstance(options['mix'], str):
+            options['mix'] = parse_mix(options['mix'])
+        if options['users'] <= 0 or options['concurrency'] <= 0 or options['requests'] <= 0:
+            raise CommandError('--users, --concurrency and --requests must be positive')
+        self.options = options
+        rng = random.Random(f"{options['seed']}:{options['prefix']}")
+
+        users = self.login_users(rng)
+        self.types = list(TypeTransaction.objects.order_by('id').values_list('id', flat=True))
+        self.statuses = list(
+            StatusTransaction.objects.filter(enable=False).order_by('id').values_list('id', flat=True)
+        ) or list(StatusTransaction.objects.order_by('id').values_list('id', flat=True))
+        self.counter = 0
+        self.counter_lock = threading.Lock()
+
+        actions, weights = zip(*options['mix'].items())
+        plan = [
+            (rng.randrange(len(users)), rng.choices(actions, weights)[0], rng.random())
+            for _ in range(options['warmup'] + options['requests'])
+        ]
+        self.run(users, plan[:options['warmup']])
+        results, elapsed = self.run(users, plan[options['warmup']:])
+
+        report = self.report(results, elapsed)
+        self.print_report(report)
+        if options['compare']:
+            self.print_compare(report, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Report saved in {options['output']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"LOAD TEST done: {report['total']['count']} requests, {report['throughput_rps']} req/s"
+        ))
+
+    def login_users(self, rng):
+        candidates = list(
+            CustomUser.objects.filter(email__startswith=f"{self.options['prefix']}-", departments__isnull=False)
+            .distinct().order_by('id')
+        )
+        if not candidates:
+            raise CommandError(
+                f"No users with departments for prefix '{self.options['prefix']}', run manage.py seed_load first"
+            )
+        # Distintos usuarios, distintos departamentos
+        chosen = rng.sample(candidates, min(self.options['users'], len(candidates)))
+        return [SimulatedUser(user, self.options['host']) for user in chosen]
+
+    def run(self, users, plan):
+        # A user (client, session) is only used by one thread at a time
+        locks = [threading.Lock() for _ in users]
+        results = []
+        results_lock = threading.Lock()
+
+        def work(step):
+            index, action, point = step
+            with locks[index]:
+                status, latency = self.request(users[index], action, point)
+            with results_lock:
+                results.append((action, status, latency))
+
+        def worker(steps):
+            try:
+                for step in steps:
+                    work(step)
+            finally:
+                connections.close_all()
+
+        chunks = [plan[i::self.options['concurrency']] for i in range(self.options['concurrency'])]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options['concurrency'], thread_name_prefix='load-test') as pool:
+            for future in [pool.submit(worker, chunk) for chunk in chunks]:
+                future.result()
+        return results, time.perf_counter() - start
+
+    def request(self, simulated, action, point):
+        """Returns (status code, latency in ms), status None when the user has no target for the action."""
+        method, url, data = self.build(simulated, action, point)
+        if url is None:
+            return None, 0.0
+        start = time.perf_counter()
+        response = getattr(simulated.client, method)(url, data)
+        return response.status_code, (time.perf_counter() - start) * 1000
+
+    def build(self, simulated, action, point):
+        if action == 'dashboard':
+            return 'get', reverse('app:index'), None
+        if action in ('list_budget', 'list_bills'):
+            return 'get', reverse(f'app:{action}'), None
+        if action == 'detail_budget':
+            if not simulated.budgets:
+                return None, None, None
+            identifier = simulated.budgets[int(point * len(simulated.budgets))][0]
+            return 'get', reverse('app:detail_budget', kwargs={'identifier': identifier}), None
+        if action == 'detail_bill':
+            if not simulated.bills:
+                return None, None, None
+            identifier = simulated.bills[int(point * len(simulated.bills))]['identifier']
+            return 'get', reverse('app:detail_bill', kwargs={'identifier': identifier}), None
+        if action == 'add_bill':
+            if not simulated.budgets:
+                return None, None, None
+            _, budget_id, department_id, currency_id = simulated.budgets[int(point * len(simulated.budgets))]
+            with self.counter_lock:
+                self.counter += 1
+                number = self.counter
+            return 'post', reverse('app:add_bill'), {
+                'title': f"{self.options['prefix']} load bill {number}",
+                'description': 'Load test bill',
+                'total_mount': 1 + int(point * 1000),
+                'currency': currency_id,
+                'due_date': datetime.date.today().strftime('%Y-%m-%d'),
+                'budget': budget_id,
+                'type': self.types[int(point * len(self.types))],
+                'status': self.statuses[int(point * len(self.statuses))],
+                'department': department_id,
+            }
+        if action == 'update_bill':
+            if not simulated.bills:
+                return None, None, None
+            bill = simulated.bills[int(point * len(simulated.bills))]
+            data = {
+                'title': bill['title'],
+                'description': bill['description'],
+                'total_mount': int(bill['total_mount']),
+                'currency': bill['currency_id'],
+                'due_date': datetime.date.today().strftime('%Y-%m-%d'),
+                'budget': bill['budget_id'],
+                'type': bill['type_id'],
+                # Sin cerrar el gasto, debe seguir editable en la siguiente vuelta
+                'status': self.statuses[0],
+                'department': bill['department_id'],
+                'category': bill['category_id'] or '',
+            }
+            return 'post', reverse('app:update_bill', kwargs={'identifier': bill['identifier']}), data
+        raise CommandError(f"Unknown action '{action}'")
+
+    def report(self, results, elapsed):
+        by_action = {}
+        for action, status, latency in results:
+            if status is None:
+                continue
+            entry = by_action.setdefault(action, {'latencies': [], 'errors': 0})
+            entry['latencies'].append(latency)
+            # Redirects are the expected answer of create and update
+            if status >= 400:
+                entry['errors'] += 1
+        skipped = sum(1 for _, status, _ in results if status is None)
+        total = summarize(
+            [latency for entry in by_action.values() for latency in entry['latencies']],
+            sum(entry['errors'] for entry in by_action.values()),
+        )
+        return {
+            'config': {
+                key: self.options[key] for key in ('prefix', 'users', 'concurrency', 'requests', 'warmup', 'seed', 'mix')
+            },
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(total['count'] / elapsed, 2) if elapsed else 0.0,
+            'skipped': skipped,
+            'total': total,
+            'actions': {
+                action: summarize(entry['latencies'], entry['errors'])
+                for action, entry in sorted(by_action.items())
+            },
+        }
+
+    def print_report(self, report):
+        header = f"{'action':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        rows = list(report['actions'].items()) + [('TOTAL', report['total'])]
+        for action, summary in rows:
+            self.stdout.write(
+                f"{action:<14}{summary['count']:>7}{summary['errors']:>8}{summary['p50_ms']:>10.2f}"
+                f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['max_ms']:>10.2f}"
+            )
+        self.stdout.write(
+            f"{report['elapsed_s']} s, {report['throughput_rps']} req/s, "
+            f"{report['config']['concurrency']} threads, {report['skipped']} skipped (no target)"
+        )
+
+    def print_compare(self, report, path):
+        try:
+            with open(path) as source:
+                previous = json.load(source)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read the report {path}: {e}')
+        if previous.get('config') != report['config']:
+            self.stdout.write(self.style.WARNING('Different configuration, the comparison is only indicative'))
+
+        def delta(new, old):
+            return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+        self.stdout.write(f"throughput {report['throughput_rps']} req/s ({delta(report['throughput_rps'], previous['throughput_rps'])})")
+        rows = list(report['actions'].items()) + [('TOTAL', report['total'])]
+        for action, summary in rows:
+            old = previous['total'] if action == 'TOTAL' else previous.get('actions', {}).get(action)
+            if not old:
+                continue
+            self.stdout.write(
+                f"{action:<14}" + ''.join(
+                    f"  p{pct} {delta(summary[f'p{pct}_ms'], old[f'p{pct}_ms']):>7}" for pct in PERCENTILES
+                )
+            )
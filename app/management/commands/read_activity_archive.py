@@ -0,0 +1,61 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from app.utils.log_archive import available_months, read_archive
+
+"""
+execute: python manage.py read_activity_archive 2025-01 [--level ERROR] [--path /budgets/] [--search BudgetCreateView]
+         python manage.py read_activity_archive --list
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Query the archived ActivityLog months'
+
+    def add_arguments(self, parser):
+        parser.add_argument('months', nargs='*', help='YYYY-MM, every archived month when empty')
+        parser.add_argument('--list', action='store_true', help='List the archived months')
+        parser.add_argument('--level')
+        parser.add_argument('--path', help='Path prefix')
+        parser.add_argument('--search', help='Text contained in the action')
+        parser.add_argument('--since', help='ISO datetime')
+        parser.add_argument('--until', help='ISO datetime')
+        parser.add_argument('--limit', type=int, default=100, help='0 for no limit')
+        parser.add_argument('--count', action='store_true', help='Only print the number of matches')
+
+    def parse_datetime(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None or parsed.tzinfo is None:
+            raise CommandError(f'Invalid datetime with timezone: {value}')
+        return parsed
+
+    def handle(self, *args, **options):
+        archived = available_months()
+        if options['list']:
+            for month in archived:
+                self.stdout.write(month)
+            return
+
+        months = options['months'] or archived
+        missing = [month for month in months if month not in archived]
+        if missing:
+            raise CommandError(f'No archive for: {", ".join(missing)}')
+
+        filters = dict(
+            level=options['level'], path=options['path'], search=options['search'],
+            since=self.parse_datetime(options['since']), until=self.parse_datetime(options['until']),
+        )
+        limit = options['limit']
+        matches = 0
+        for month in months:
+            for row in read_archive(month, **filters):
+                matches += 1
+                if not options['count']:
+                    self.stdout.write(json.dumps(row, ensure_ascii=False))
+                    if limit and matches >= limit:
+                        return
+        if options['count']:
+            self.stdout.write(str(matches))
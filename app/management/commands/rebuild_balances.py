@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.models import DepartmentBalance
+
+"""
+execute: python manage.py rebuild_balances
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuild the department balance ledger from budgets and bills'
+
+    def handle(self, *args, **kwargs):
+        rows = DepartmentBalance.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'DEPARTMENT BALANCES rebuilt: {rows} rows')
+        )
@@ -0,0 +1,20 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from app.models import FileBlob
+
+"""
+execute: python manage.py rebuild_file_references
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Recount the references of every stored attachment from BudgetFile and BillFile'
+
+    def handle(self, *args, **kwargs):
+        rows, missing = FileBlob.rebuild(default_storage)
+        for name in missing:
+            self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+        self.stdout.write(
+            self.style.SUCCESS(f'FILE REFERENCES rebuilt: {rows} files, {len(missing)} missing')
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app.models import BillMonthlyRollup
+
+"""
+execute: python manage.py rebuild_rollups
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Backfill the monthly bill rollups used by bills_reports'
+
+    def handle(self, *args, **kwargs):
+        rows = BillMonthlyRollup.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'BILL ROLLUPS rebuilt: {rows} monthly buckets')
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import Budget, Bill
+from app.utils import search as search_index
+
+"""
+execute: python manage.py rebuild_search_index
+"""
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuild the full text search index of budgets and bills'
+
+    def handle(self, *args, **kwargs):
+        if not search_index.is_available():
+            self.stdout.write(
+                self.style.WARNING('SEARCH INDEX needs SQLite FTS5 or PostgreSQL, searches use LIKE on this database')
+            )
+            return
+
+        search_index.create_index()
+        with transaction.atomic():
+            search_index.clear_index()
+            budgets = search_index.reindex_queryset(Budget.objects.all())
+            bills = search_index.reindex_queryset(Bill.objects.all())
+
+        self.stdout.write(
+            self.style.SUCCESS(f'SEARCH INDEX rebuilt: {budgets} budgets, {bills} bills')
+        )
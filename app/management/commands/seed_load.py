@@ -0,0 +1,285 @@
+import bisect
+import datetime
+import itertools
+import math
+import random
+import uuid
+from contextlib import contextmanager
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.utils import timezone
+from app.models import (
+    Budget, BudgetFile, Bill, BillFile, CategoryBill, Department, Currency,
+    TypeTransaction, StatusTransaction, CustomUser, ActivityLog
+)
+from app.utils import dashboard_cache
+
+"""
+execute: python manage.py seed_load --departments 50 --users 200 --budgets 20000 --bills 1000000 --seed 7
+
+Synthetic, deterministic dataset (same --seed and --prefix, same rows) for load
+tests. Rows are bulk inserted in batches, so signals do not run; balances,
+rollups, the search index and the file references are rebuilt at the end.
+"""
+
+VIEWS = (
+    'app.views.BudgetCreateView', 'app.views.BudgetUpdateView', 'app.views.BudgetDeleteView',
+    'app.views.BillCreateView', 'app.views.BillUpdateView', 'app.views.BillDeleteView',
+    'app.views.login_view', 'app.views.logout_view',
+)
+LEVELS = (('INFO', 90), ('WARNING', 8), ('ERROR', 2))
+
+
+@contextmanager
+def keep_created_at(*models):
+    """bulk_create keeps the generated created_at instead of auto_now_add."""
+    fields = [model._meta.get_field(name) for model in models for name in ('created_at', 'uploaded_at') if hasattr(model, name)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+
+    help = 'Generate a deterministic synthetic dataset with batched inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='seed', help='Names and emails prefix, one dataset per prefix')
+        parser.add_argument('--departments', type=int, default=20)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--memberships', type=int, default=2, help='Departments per user')
+        parser.add_argument('--categories', type=int, default=10, help='Root categories')
+        parser.add_argument('--subcategories', type=int, default=3, help='Children per root category')
+        parser.add_argument('--budgets', type=int, default=2000)
+        parser.add_argument('--bills', type=int, default=20000)
+        parser.add_argument('--activity-logs', type=int, default=10000)
+        parser.add_argument('--file-ratio', type=float, default=0.02, help='Share of budgets and bills with one attachment')
+        parser.add_argument('--uncategorized-ratio', type=float, default=0.1)
+        parser.add_argument('--amount-min', type=int, default=10000)
+        parser.add_argument('--amount-max', type=int, default=50000000)
+        parser.add_argument('--bill-share', type=float, default=0.3, help='Max bill amount as a share of its budget')
+        parser.add_argument('--months', type=int, default=24, help='Dates spread over the N months before --end-date')
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=None, help='YYYY-MM-DD, default today')
+        parser.add_argument('--recency', type=float, default=1.5, help='>1 concentrates dates in recent months, 1 is uniform')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of rows per department, 0 is uniform')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-rebuild', action='store_true', help='Do not rebuild balances, rollups, search index and file references')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(f"{options['seed']}:{options['prefix']}")
+        self.batch_size = options['batch_size']
+        # Midnight anchor, dates only depend on the seed and --end-date
+        end_date = options['end_date'] or timezone.localdate()
+        self.now = timezone.make_aware(datetime.datetime.combine(end_date, datetime.time.min))
+        if options['amount_min'] <= 0 or options['amount_max'] < options['amount_min']:
+            raise CommandError('--amount-min must be positive and not greater than --amount-max')
+        if CustomUser.objects.filter(email__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Dataset '{options['prefix']}' already exists, use another --prefix")
+
+        self.load_catalogs()
+        with keep_created_at(Budget, Bill, BudgetFile, BillFile):
+            departments = self.create_departments()
+            self.create_users(departments)
+            categories = self.create_categories()
+            budgets = self.create_budgets(departments)
+            self.create_bills(budgets, categories)
+        self.create_activity_logs()
+
+        if not options['skip_rebuild']:
+            for command in ('rebuild_balances', 'rebuild_rollups', 'rebuild_search_index', 'rebuild_file_references'):
+                call_command(command, stdout=self.stdout)
+        dashboard_cache.invalidate(*[department.id for department in departments])
+        dashboard_cache.invalidate_catalogs()
+        self.stdout.write(self.style.SUCCESS(f"SEED LOAD '{options['prefix']}' done (seed {options['seed']})"))
+
+    # -- distributions --
+    def load_catalogs(self):
+        if not (Currency.objects.exists() and TypeTransaction.objects.exists() and StatusTransaction.objects.exists()):
+            call_command('init_all', stdout=self.stdout)
+        self.currencies = list(Currency.objects.order_by('id').values_list('id', flat=True))
+        self.types = list(TypeTransaction.objects.order_by('id').values_list('id', flat=True))
+        self.statuses = list(StatusTransaction.objects.order_by('id').values_list('id', flat=True))
+        if not (self.currencies and self.types and self.statuses):
+            raise CommandError('Currencies, transaction types and statuses are required (manage.py init_all)')
+
+    def amount(self, low, high):
+        """Log uniform, small amounts are more frequent."""
+        return int(math.exp(self.rng.uniform(math.log(low), math.log(high))))
+
+    def moment(self, start=None):
+        """Date in the window (after start if given), biased to recent ones with --recency."""
+        oldest = self.now - datetime.timedelta(days=30 * self.options['months'])
+        start = max(start or oldest, oldest)
+        span = (self.now - start).total_seconds()
+        return start + datetime.timedelta(seconds=span * (1 - self.rng.random() ** self.options['recency']))
+
+    def identifier(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def batched(self, rows):
+        iterator = iter(rows)
+        while batch := list(itertools.islice(iterator, self.batch_size)):
+            yield batch
+
+    def insert(self, model, rows, label):
+        created = []
+        total = 0
+        for batch in self.batched(rows):
+            with transaction.atomic(using=router.db_for_write(model)):
+                created.extend(model.objects.bulk_create(batch, batch_size=self.batch_size))
+            total += len(batch)
+            self.stdout.write(f'{label}: {total}', ending='\r')
+        self.stdout.write(f'{label}: {total}')
+        return created
+
+    def attach(self, model, owner_field, owners, folder):
+        rows = []
+        for owner in owners:
+            if self.rng.random() >= self.options['file_ratio']:
+                continue
+            filename = f'{self.options["prefix"]}-{owner.id}.txt'
+            name = default_storage.save(
+                f'{folder}/{owner.identifier}/{filename}',
+                ContentFile(f'{owner.title}\n{owner.total_mount}\n'.encode()),
+            )
+            rows.append(model(**{owner_field: owner, 'file': name, 'filename': filename, 'uploaded_at': owner.created_at}))
+        if rows:
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+        return len(rows)
+
+    # -- rows --
+    def create_departments(self):
+        prefix = self.options['prefix']
+        departments = self.insert(Department, (
+            Department(name=f'{prefix} {i}'[:32], description=f'Synthetic department {i}')
+            for i in range(self.options['departments'])
+        ), 'departments')
+        # Zipf weights, the first departments hold most of the rows
+        weights = [1 / (rank + 1) ** self.options['skew'] for rank in range(len(departments))]
+        self.department_weights = list(itertools.accumulate(weights))
+        return departments
+
+    def pick_department(self, departments):
+        point = self.rng.random() * self.department_weights[-1]
+        return departments[bisect.bisect_left(self.department_weights, point)]
+
+    def create_users(self, departments):
+        prefix = self.options['prefix']
+        password = make_password(prefix)
+        users = self.insert(CustomUser, (
+            CustomUser(
+                email=f'{prefix}-{i}@kashet.load', username=f'{prefix}{i}',
+                first_name='Seed', last_name=f'User {i}', password=password,
+            )
+            for i in range(self.options['users'])
+        ), 'users')
+        Membership = CustomUser.departments.through
+        memberships = []
+        for user in users:
+            chosen = {self.pick_department(departments).id for _ in range(self.options['memberships'])}
+            memberships.extend(Membership(customuser_id=user.id, department_id=department_id) for department_id in chosen)
+        self.insert(Membership, memberships, 'memberships')
+
+    def create_categories(self):
+        prefix = self.options['prefix']
+        roots = self.insert(CategoryBill, (
+            CategoryBill(name=f'{prefix} cat {i}'[:32]) for i in range(self.options['categories'])
+        ), 'categories')
+        children = self.insert(CategoryBill, (
+            CategoryBill(name=f'{prefix} cat {i}.{j}'[:32], parent=root)
+            for i, root in enumerate(roots) for j in range(self.options['subcategories'])
+        ), 'subcategories')
+        return roots + children
+
+    def create_budgets(self, departments):
+        options = self.options
+
+        def rows():
+            for i in range(options['budgets']):
+                created_at = self.moment()
+                yield Budget(
+                    title=f'{options["prefix"]} budget {i}',
+                    description='Synthetic budget',
+                    total_mount=self.amount(options['amount_min'], options['amount_max']),
+                    identifier=self.identifier(),
+                    set_date=created_at,
+                    due_date=created_at + datetime.timedelta(days=self.rng.randint(7, 180)),
+                    created_at=created_at,
+                    is_closed=self.rng.random() < 0.2,
+                    status_id=self.rng.choice(self.statuses),
+                    type_id=self.rng.choice(self.types),
+                    currency_id=self.rng.choice(self.currencies),
+                    department=self.pick_department(departments),
+                )
+
+        budgets = self.insert(Budget, rows(), 'budgets')
+        self.stdout.write(f'budget files: {self.attach(BudgetFile, "budget", budgets, "budgets")}')
+        return budgets
+
+    def create_bills(self, budgets, categories):
+        options = self.options
+        if not budgets:
+            return
+
+        def rows():
+            for i in range(options['bills']):
+                budget = self.rng.choice(budgets)
+                created_at = self.moment(budget.created_at)
+                limit = max(1, int(budget.total_mount * options['bill_share']))
+                uncategorized = not categories or self.rng.random() < options['uncategorized_ratio']
+                yield Bill(
+                    title=f'{options["prefix"]} bill {i}',
+                    description='Synthetic bill',
+                    total_mount=self.amount(1, limit),
+                    identifier=self.identifier(),
+                    due_date=created_at + datetime.timedelta(days=self.rng.randint(0, 60)),
+                    created_at=created_at,
+                    budget=budget,
+                    department_id=budget.department_id,
+                    currency_id=budget.currency_id,
+                    status_id=self.rng.choice(self.statuses),
+                    type_id=self.rng.choice(self.types),
+                    category=None if uncategorized else self.rng.choice(categories),
+                )
+
+        files = 0
+        total = 0
+        # Bills are not kept in memory, only one batch at a time
+        for batch in self.batched(rows()):
+            with transaction.atomic():
+                created = Bill.objects.bulk_create(batch, batch_size=self.batch_size)
+                files += self.attach(BillFile, 'bill', created, 'bills')
+            total += len(batch)
+            self.stdout.write(f'bills: {total}', ending='\r')
+        self.stdout.write(f'bills: {total}')
+        self.stdout.write(f'bill files: {files}')
+
+    def create_activity_logs(self):
+        levels, weights = zip(*LEVELS)
+        prefix = self.options['prefix']
+
+        def rows():
+            for i in range(self.options['activity_logs']):
+                action = self.rng.choice(VIEWS)
+                level = self.rng.choices(levels, weights)[0]
+                yield ActivityLog(
+                    level=level,
+                    action=action if level == 'INFO' else level,
+                    method='POST',
+                    path=f'/{action.rsplit(".", 1)[-1].lower()}/',
+                    ip_address=f'10.0.{self.rng.randint(0, 255)}.{self.rng.randint(1, 254)}',
+                    extra_data={'seed': prefix},
+                    timestamp=self.moment(),
+                )
+
+        self.insert(ActivityLog, rows(), 'activity logs')
@@ -1,28 +1,43 @@
-from app.models import ActivityLog
+import random
+import time
+from django.conf import settings
+from app.utils.log_writer import activity_log_writer
 from django.utils.deprecation import MiddlewareMixin
 
 
+def view_name_for(view_func):
+    if hasattr(view_func, "view_class"):
+        return f"{view_func.view_class.__module__}.{view_func.view_class.__name__}"
+    return f"{view_func.__module__}.{view_func.__name__}"
+
+
 class ActivityLogMiddleware(MiddlewareMixin):
 
     """
     Middleware to registry logs of users or anonymous activities in app application.
+    Every request is added to the per minute ActivityCounter of its view, only
+    a sample (ACTIVITY_LOG_SAMPLE_RATE) of the writes keeps its ActivityLog row.
     """
 
+    def process_request(self, request):
+        request._activity_started = time.perf_counter()
+
     def process_view(self, request, view_func, view_args, view_kwargs):
-        
+
+        view_name = view_name_for(view_func)
+        request._activity_view = view_name
+
         if request.method in ('GET', 'HEAD', 'OPTIONS'):
 
             return None
         
-        #user = request.user if request.user.is_authenticated else None
+        if random.random() >= getattr(settings, 'ACTIVITY_LOG_SAMPLE_RATE', 1.0):
+            return None
 
-        if hasattr(view_func, "view_class"):
-            view_name = f"{view_func.view_class.__module__}.{view_func.view_class.__name__}"
-        else:
-            view_name = f"{view_func.__module__}.{view_func.__name__}"
+        #user = request.user if request.user.is_authenticated else None
         ip = request.META.get("REMOTE_ADDR")
 
-        ActivityLog.objects.create(
+        activity_log_writer.enqueue(
             #user = user,
             level = 'INFO',
             action = view_name,
@@ -30,4 +45,14 @@ class ActivityLogMiddleware(MiddlewareMixin):
             path = request.path,
             ip_address = ip,
         )
-        return None
\ No newline at end of file
+        return None
+
+    def process_response(self, request, response):
+        view_name = getattr(request, '_activity_view', None)
+        started = getattr(request, '_activity_started', None)
+        if view_name and started is not None:
+            activity_log_writer.count_request(
+                view_name, request.method, response.status_code,
+                (time.perf_counter() - started) * 1000,
+            )
+        return response
@@ -0,0 +1,47 @@
+import time
+from contextlib import ExitStack
+from django.db import connections
+from app.middleware.activity_log import view_name_for
+from app.utils import metrics
+
+
+class MetricsMiddleware:
+
+    """
+    Latency, database queries and time, template render time and response size
+    per resolved view, aggregated in app.utils.metrics.registry.
+    Goes first in MIDDLEWARE so the latency covers the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'queries': 0, 'db_time': 0.0}
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['db_time'] += time.perf_counter() - started
+
+        metrics.start_template_timer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count_query))
+            response = self.get_response(request)
+        latency = time.perf_counter() - started
+
+        size = None if response.streaming else len(response.content)
+        metrics.registry.record(
+            getattr(request, '_metrics_view', 'unresolved'), request.method, response.status_code,
+            latency, stats['queries'], stats['db_time'], metrics.template_time(), size,
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_name_for(view_func)
+        return None
@@ -0,0 +1,33 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from app.middleware.activity_log import view_name_for
+from app.utils.nplusone import QueryRepetitionTracker
+
+
+class NPlusOneMiddleware:
+
+    """
+    Flags the queries repeated more than NPLUSONE_THRESHOLD times in a request,
+    warns or raises depending on NPLUSONE_MODE, see app/utils/nplusone.py.
+    """
+
+    def __init__(self, get_response):
+        if getattr(settings, 'NPLUSONE_MODE', None) not in ('warn', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tracker = QueryRepetitionTracker()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(tracker))
+            response = self.get_response(request)
+        where = getattr(request, '_nplusone_view', request.path)
+        tracker.check(f'{request.method} {request.path} ({where})', settings.NPLUSONE_MODE)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._nplusone_view = view_name_for(view_func)
+        return None
@@ -0,0 +1,64 @@
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.utils.functional import LazyObject, empty
+from app.middleware.activity_log import view_name_for
+from app.utils.db_router import replica_aliases, replica_reads
+
+STICKY_COOKIE = 'kashet_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def load_user(request):
+    """Evaluates the lazy request.user of AuthenticationMiddleware right away."""
+    user = getattr(request, 'user', None)
+    if isinstance(user, LazyObject):
+        if user._wrapped is empty:
+            user._setup()
+        request.user = user._wrapped
+
+
+class ReplicaMiddleware:
+
+    """
+    Runs the GET requests of DATABASE_REPLICA_VIEWS inside replica_reads(),
+    see app/utils/db_router.py. Any other method marks the browser with a
+    cookie that keeps its reads on the primary for DATABASE_REPLICA_STICKY_SECONDS.
+    Goes after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_aliases():
+            return self.get_response(request)
+
+        with ExitStack() as stack:
+            if self.is_sticky(request):
+                stack.enter_context(replica_reads(sticky=True))
+            else:
+                request._replica_stack = stack
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            seconds = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+        return response
+
+    @staticmethod
+    def is_sticky(request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stack = getattr(request, '_replica_stack', None)
+        if stack is None or request.method not in SAFE_METHODS:
+            return None
+        if view_name_for(view_func) in getattr(settings, 'DATABASE_REPLICA_VIEWS', ()):
+            # Session and user are read from the primary before switching
+            load_user(request)
+            stack.enter_context(replica_reads())
+        return None
@@ -0,0 +1,30 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from app.middleware.activity_log import view_name_for
+from app.utils.slow_queries import slow_query_wrapper
+
+
+class SlowQueryMiddleware:
+
+    """
+    Logs the queries slower than SLOW_QUERY_THRESHOLD_MS, see app/utils/slow_queries.py.
+    Only loaded with SLOW_QUERY_LOG = True.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SLOW_QUERY_LOG', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wrapper = slow_query_wrapper(lambda: getattr(request, '_slow_query_view', request.path))
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(wrapper))
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._slow_query_view = view_name_for(view_func)
+        return None
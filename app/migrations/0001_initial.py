@@ -0,0 +1,361 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:11
+
+import app.models
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128)),
+                ('description', models.TextField(blank=True)),
+                ('total_mount', models.DecimalField(decimal_places=0, max_digits=24, validators=[django.core.validators.MinValueValidator(0.01, message='Monto debe ser positivo.')])),
+                ('identifier', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('due_date', models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('edit', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'bill',
+                'verbose_name_plural': 'bills',
+                'ordering': ['-created_at'],
+            },
+            bases=(app.models.BalanceTrackedMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128)),
+                ('description', models.TextField(blank=True)),
+                ('total_mount', models.DecimalField(decimal_places=0, max_digits=24, validators=[django.core.validators.MinValueValidator(0.01, message='Monto debe ser positivo.')])),
+                ('identifier', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('set_date', models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True)),
+                ('due_date', models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('edit', models.BooleanField(default=True)),
+                ('is_closed', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'budget',
+                'verbose_name_plural': 'budgets',
+                'ordering': ['-created_at'],
+            },
+            bases=(app.models.BalanceTrackedMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='Currency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('code', models.CharField(max_length=3, unique=True)),
+                ('symbol', models.CharField(max_length=3)),
+            ],
+            options={
+                'verbose_name': 'currency',
+                'verbose_name_plural': 'currencies',
+            },
+        ),
+        migrations.CreateModel(
+            name='Department',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('description', models.TextField(blank=True)),
+                ('phone', models.CharField(blank=True, max_length=20, null=True)),
+                ('location', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'department',
+                'verbose_name_plural': 'departments',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'file_blob',
+                'verbose_name_plural': 'file_blobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='StatusTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('enable', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('update_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'status_transaction',
+                'verbose_name_plural': 'status_transactions',
+            },
+        ),
+        migrations.CreateModel(
+            name='TypeTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'type_transaction',
+                'verbose_name_plural': 'type_transactions',
+            },
+        ),
+        migrations.CreateModel(
+            name='ActivityCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('view_name', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total_latency', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'activity_counter',
+                'verbose_name_plural': 'activity_counters',
+                'ordering': ['-minute'],
+                'constraints': [models.UniqueConstraint(fields=('minute', 'view_name', 'method', 'status'), name='unique_activity_counter_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ActivityLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('INFO', 'Info'), ('WARNING', 'Warning'), ('ERROR', 'Error')], default='INFO', max_length=10)),
+                ('action', models.CharField(max_length=255)),
+                ('method', models.CharField(blank=True, max_length=10, null=True)),
+                ('path', models.CharField(blank=True, max_length=255, null=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('extra_data', models.JSONField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+            ],
+            options={
+                'verbose_name': 'activity_log',
+                'verbose_name_plural': 'activity_logs',
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['timestamp'], name='activity_timestamp_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BillFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to=app.models.bill_upload_path)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_folders', to='app.bill')),
+            ],
+            options={
+                'verbose_name': 'bill_file',
+                'verbose_name_plural': 'bill_files',
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='budget',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.budget'),
+        ),
+        migrations.CreateModel(
+            name='BudgetFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to=app.models.budget_upload_path)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('budget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_folders', to='app.budget')),
+            ],
+            options={
+                'verbose_name': 'budget_file',
+                'verbose_name_plural': 'budget_files',
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryBill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('description', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='subcategories', to='app.categorybill')),
+            ],
+            options={
+                'verbose_name': 'category_bill',
+                'verbose_name_plural': 'category_bills',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.categorybill'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='currency',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='budgets', to='app.currency'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='currency',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.currency'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='department',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='budgets', to='app.department'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='department',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.department'),
+        ),
+        migrations.CreateModel(
+            name='CustomUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('username', models.CharField(max_length=64)),
+                ('first_name', models.CharField(max_length=32)),
+                ('last_name', models.CharField(max_length=32)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_staff', models.BooleanField(default=False)),
+                ('data_joined', models.DateTimeField(default=django.utils.timezone.now)),
+                ('phone', models.CharField(blank=True, max_length=16)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+                ('departments', models.ManyToManyField(blank=True, related_name='users', to='app.department')),
+            ],
+            options={
+                'verbose_name': 'User',
+                'verbose_name_plural': 'Users',
+                'ordering': ['-data_joined'],
+            },
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='status',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='budgets', to='app.statustransaction'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='status',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.statustransaction'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='budgets', to='app.typetransaction'),
+        ),
+        migrations.CreateModel(
+            name='BillMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.DecimalField(decimal_places=0, default=0, max_digits=24)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bill_rollups', to='app.categorybill')),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_rollups', to='app.currency')),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_rollups', to='app.department')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_rollups', to='app.statustransaction')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bill_rollups', to='app.typetransaction')),
+            ],
+            options={
+                'verbose_name': 'bill_monthly_rollup',
+                'verbose_name_plural': 'bill_monthly_rollups',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='bills', to='app.typetransaction'),
+        ),
+        migrations.CreateModel(
+            name='DepartmentBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_budgets', models.DecimalField(decimal_places=0, default=0, max_digits=24)),
+                ('total_bills', models.DecimalField(decimal_places=0, default=0, max_digits=24)),
+                ('budgets_count', models.PositiveIntegerField(default=0)),
+                ('bills_count', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='app.currency')),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='app.department')),
+            ],
+            options={
+                'verbose_name': 'department_balance',
+                'verbose_name_plural': 'department_balances',
+                'constraints': [models.UniqueConstraint(fields=('department', 'currency'), name='unique_department_currency_balance')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['-created_at', '-id'], name='budget_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['department', '-created_at', '-id'], name='budget_dept_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['is_closed', 'department'], name='budget_closed_dept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='billmonthlyrollup',
+            index=models.Index(fields=['department', 'month'], name='rollup_department_month_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='billmonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('month', 'department', 'category', 'type', 'status', 'currency'), name='unique_bill_monthly_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='billmonthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('month', 'department', 'type', 'status', 'currency'), name='unique_bill_monthly_rollup_uncategorized'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['-created_at', '-id'], name='bill_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['department', '-created_at', '-id'], name='bill_dept_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='bill_category_created_idx'),
+        ),
+    ]
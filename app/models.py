@@ -1,5 +1,7 @@
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction, connections, router
+from django.db.models import Sum, F, Q
+from django.db.models.functions import TruncMonth
+from django.utils.functional import cached_property
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as translate
@@ -12,6 +14,47 @@ import os
 
 """---------BUDGET---------"""
 
+class BalanceTrackedMixin:
+    """
+    Keeps the ledgers (DepartmentBalance, BillMonthlyRollup) in sync with every
+    save. An update moves the stored amount out of the ledgers and the new one
+    in, inside the same transaction as the write. The stored row is read under
+    a row lock, not taken from when the instance was loaded, so two copies of
+    the same row saved one after the other don't subtract the same old amount.
+    Deletes are handled by the pre_delete/post_delete receivers in signals.py.
+    """
+    ledger_kind = None
+    ledger_fields = ('department_id', 'currency_id', 'total_mount')
+
+    def ledger_state(self):
+        return {field: getattr(self, field) for field in self.ledger_fields}
+
+    def _previous_ledger_state(self):
+        """The stored ledger fields, locked until the transaction ends. None for a new row."""
+        if self._state.adding or self.pk is None:
+            return None
+        return (
+            type(self).objects.select_for_update()
+            .filter(pk=self.pk).values(*self.ledger_fields).first()
+        )
+
+    def apply_ledgers(self, state, sign=1):
+        DepartmentBalance.record(
+            self.ledger_kind, state['department_id'], state['currency_id'],
+            state['total_mount'], sign=sign
+        )
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._ledger_state = self._previous_ledger_state()
+            super().save(*args, **kwargs)
+            current = self.ledger_state()
+            if previous != current:
+                if previous is not None:
+                    self.apply_ledgers(previous, sign=-1)
+                self.apply_ledgers(current)
+            self._ledger_state = current
+
 def returning_title_to_bill_and_budget(set_date, due_date, department, title, total_mount, currency):
     MONTHS = [
         translate('Enero'), translate('Febrero'), translate('Marzo'),
@@ -27,7 +70,9 @@ def returning_title_to_bill_and_budget(set_date, due_date, department, title, to
 def budget_upload_path(instance, filename):
     return os.path.join('budgets', str(instance.budget.identifier), filename)
 
-class Budget(models.Model):
+class Budget(BalanceTrackedMixin, models.Model):
+    ledger_kind = 'budgets'
+
     title = models.CharField(max_length=128)
     description = models.TextField(blank=True)
     total_mount = models.DecimalField(max_digits=24, decimal_places=0, validators=[MinValueValidator(0.01, message="Monto debe ser positivo.")])
@@ -71,11 +116,20 @@ class Budget(models.Model):
         ordering = ['-created_at']
         verbose_name = translate("budget")
         verbose_name_plural = translate("budgets")
+        # Lists page on (created_at, id) newest first, scoped by department
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='budget_created_idx'),
+            models.Index(fields=['department', '-created_at', '-id'], name='budget_dept_created_idx'),
+            models.Index(fields=['is_closed', 'department'], name='budget_closed_dept_idx'),
+        ]
     
 
     
     @property
     def has_bills(self):
+        # List views annotate bills_exist to skip one EXISTS per row
+        if 'bills_exist' in self.__dict__:
+            return self.bills_exist
         return self.bills.exists()
     
     def __str__(self):
@@ -91,6 +145,8 @@ class Budget(models.Model):
 class BudgetFile(models.Model):
     budget = models.ForeignKey(Budget, related_name="upload_folders", on_delete=models.CASCADE)
     file = models.FileField(upload_to=budget_upload_path)
+    # Uploaded name, the stored one is the content hash (app.utils.storage)
+    filename = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -100,6 +156,13 @@ class BudgetFile(models.Model):
     def __str__(self):
         return self.file.name
 
+    def save(self, *args, **kwargs):
+        if not self.filename and self.file:
+            self.filename = os.path.basename(self.file.name)
+        # The storage counts the upload (FileBlob.acquire), a failed insert takes it back
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 """---------BUDGET---------"""
 
 
@@ -107,7 +170,11 @@ class BudgetFile(models.Model):
 def bill_upload_path(instance, filename):
     return os.path.join('bills', str(instance.bill.identifier), filename)
 
-class Bill(models.Model):
+class Bill(BalanceTrackedMixin, models.Model):
+    ledger_kind = 'bills'
+    ledger_fields = BalanceTrackedMixin.ledger_fields + (
+        'category_id', 'type_id', 'status_id', 'created_at'
+    )
 
     title = models.CharField(max_length=128)
     description = models.TextField(blank=True)
@@ -169,17 +236,32 @@ class Bill(models.Model):
         ordering = ['-created_at']
         verbose_name = translate("bill")
         verbose_name_plural = translate("bills")
+        # Lists page on (created_at, id) newest first, scoped by department and category
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='bill_created_idx'),
+            models.Index(fields=['department', '-created_at', '-id'], name='bill_dept_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='bill_category_created_idx'),
+        ]
     
     def __str__(self):
+        # Bill has no set_date, the due date is used for both months
         return returning_title_to_bill_and_budget(
-            self.set_date, self.due_date, self.department, 
+            self.due_date, self.due_date, self.department, 
             self.title,self.total_mount, self.currency
         )
 
+    def apply_ledgers(self, state, sign=1):
+        # With sign=-1 state is the stored row (read under lock), so a changed
+        # month or category leaves the bucket the bill is actually counted in
+        super().apply_ledgers(state, sign=sign)
+        BillMonthlyRollup.record(state, sign=sign)
+
     
 class BillFile(models.Model):
     bill = models.ForeignKey(Bill, related_name="upload_folders", on_delete=models.CASCADE)
     file = models.FileField(upload_to=bill_upload_path)
+    # Uploaded name, the stored one is the content hash (app.utils.storage)
+    filename = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -188,8 +270,100 @@ class BillFile(models.Model):
 
     def __str__(self):
         return self.file.name
+
+    def save(self, *args, **kwargs):
+        if not self.filename and self.file:
+            self.filename = os.path.basename(self.file.name)
+        # The storage counts the upload (FileBlob.acquire), a failed insert takes it back
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 """---------BILLS---------"""
 
+"""---------FILE_BLOB---------"""
+class FileBlob(models.Model):
+    """
+    References of each stored file from BudgetFile and BillFile, the same
+    content is stored once (app.utils.storage). Maintained from signals.py,
+    rebuild with: python manage.py rebuild_file_references
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = translate("file_blob")
+        verbose_name_plural = translate("file_blobs")
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+    @staticmethod
+    def referenced(name):
+        return BudgetFile.objects.filter(file=name).exists() or BillFile.objects.filter(file=name).exists()
+
+    @classmethod
+    def acquire(cls, name, size=0):
+        """
+        One more reference with a single INSERT .. ON CONFLICT DO UPDATE, the
+        row stays locked until the transaction ends.
+        """
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        columns = ', '.join(quote(name) for name in ('name', 'size', 'references', 'created_at'))
+        sql = (
+            f"INSERT INTO {table} ({columns}) VALUES (%s, %s, 1, %s) "
+            f"ON CONFLICT ({quote('name')}) DO UPDATE SET "
+            f"{quote('references')} = {table}.{quote('references')} + 1"
+        )
+        created_at = cls._meta.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, (name, size, created_at))
+
+    @classmethod
+    def release(cls, name):
+        """Drops one reference, True when none is left and the file can be collected."""
+        updated = cls.objects.filter(name=name, references__gt=0).update(references=F('references') - 1)
+        if not updated:
+            # Not counted (bulk inserted or saved before the counter), ask the rows
+            return not cls.referenced(name)
+        return cls.objects.filter(name=name, references=0).exists()
+
+    @classmethod
+    def collect(cls, name, storage):
+        """
+        Removes the file of a released name unless it was acquired again since,
+        checked under the same row lock acquire takes. Returns True if removed.
+        """
+        with transaction.atomic(using=router.db_for_write(cls)):
+            blob = cls.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                if blob.references:
+                    return False
+                blob.delete()
+            storage.delete(name)
+        return True
+
+    @classmethod
+    def rebuild(cls, storage):
+        """Recount every stored name from BudgetFile and BillFile, returns (rows, missing files)."""
+        counts = {}
+        for model in (BudgetFile, BillFile):
+            for row in model.objects.exclude(file='').order_by().values('file').annotate(count=models.Count('id')):
+                counts[row['file']] = counts.get(row['file'], 0) + row['count']
+        missing = [name for name in counts if not storage.exists(name)]
+        rows = [
+            cls(name=name, references=count, size=0 if name in missing else storage.size(name))
+            for name, count in counts.items()
+        ]
+        with transaction.atomic(using=router.db_for_write(cls)):
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=500)
+        return len(rows), missing
+"""---------FILE_BLOB---------"""
+
 """---------CATEGORIES BILLS---------"""
 class CategoryBill(models.Model):
     name = models.CharField(max_length=32)
@@ -230,16 +404,23 @@ class CategoryBill(models.Model):
         
         return sub_categories
     
+    # CategoryBillsList annotates the counts to avoid one query per row
     @property
     def get_bills_count(self):
+        if 'bills_total' in self.__dict__:
+            return self.bills_total
         return self.bills.count()
     
     @property
     def has_bills(self):
+        if 'bills_total' in self.__dict__:
+            return self.bills_total > 0
         return self.bills.exists()
     
     @property
     def has_children(self):
+        if 'subcategories_total' in self.__dict__:
+            return self.subcategories_total > 0
         return self.subcategories.exists()
     
 
@@ -254,6 +435,21 @@ class CategoryBill(models.Model):
 """---------CATEGORIES BILLS---------"""
 
 """---------DEPARTMENTS---------"""
+LEDGER_TOTALS = {
+    'budgets': 'total_budgets',
+    'bills': 'total_bills',
+    'budgets_count': 'budgets_count',
+    'bills_count': 'bills_count',
+}
+
+class DepartmentQuerySet(models.QuerySet):
+
+    def with_ledger_totals(self):
+        """Totals and counts of every department in one grouped query."""
+        return self.annotate(**{
+            f'ledger_{key}': Sum(f'balances__{field}') for key, field in LEDGER_TOTALS.items()
+        })
+
 class Department(models.Model):
 
     name = models.CharField(max_length=32)
@@ -263,6 +459,8 @@ class Department(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    objects = DepartmentQuerySet.as_manager()
+
     class Meta:
         verbose_name = translate("department")
         verbose_name_plural = translate("departments")        
@@ -270,15 +468,28 @@ class Department(models.Model):
     def __str__(self):
         return self.name
     
+    # Totals come from the DepartmentBalance ledger, one row per currency.
+    # Read once per instance since templates access them several times.
+    @cached_property
+    def ledger_totals(self):
+        # Lists annotate them with Department.objects.with_ledger_totals()
+        if 'ledger_budgets' in self.__dict__:
+            totals = {key: getattr(self, f'ledger_{key}') for key in LEDGER_TOTALS}
+        else:
+            totals = self.balances.aggregate(**{
+                key: Sum(field) for key, field in LEDGER_TOTALS.items()
+            })
+        return {key: value or 0 for key, value in totals.items()}
+
     # Method to attribute of just reading.
     # ca access with department.objects.get(id=1).get_total_budgets
     @property
     def get_total_budgets(self):
-        return self.budgets.aggregate(total = Sum('total_mount'))['total'] or 0
+        return self.ledger_totals['budgets']
 
     @property
     def get_total_bills(self):
-        return self.bills.aggregate(total = Sum('total_mount'))['total'] or 0
+        return self.ledger_totals['bills']
     
     @property
     def balance(self):
@@ -294,11 +505,11 @@ class Department(models.Model):
 
     @property
     def get_budget_count(self):
-        return self.budgets.count()
+        return self.ledger_totals['budgets_count']
     
     @property
     def get_bills_count(self):
-        return self.bills.count()
+        return self.ledger_totals['bills_count']
     
     def delete(self, *args, **kwargs):
         if self.has_bills or self.has_budget:
@@ -309,6 +520,162 @@ class Department(models.Model):
         return self.name
 """---------DEPARTMENTS---------"""
 
+"""---------DEPARTMENT_BALANCE---------"""
+class DepartmentBalance(models.Model):
+    """
+    Materialized totals per department and currency, maintained on every
+    Budget/Bill write. Rebuild with: python manage.py rebuild_balances
+    """
+    department = models.ForeignKey(
+        'Department',
+        on_delete=models.CASCADE,
+        related_name='balances'
+    )
+    currency = models.ForeignKey(
+        'Currency',
+        on_delete=models.CASCADE,
+        related_name='balances'
+    )
+    total_budgets = models.DecimalField(max_digits=24, decimal_places=0, default=0)
+    total_bills = models.DecimalField(max_digits=24, decimal_places=0, default=0)
+    budgets_count = models.PositiveIntegerField(default=0)
+    bills_count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = translate("department_balance")
+        verbose_name_plural = translate("department_balances")
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'currency'], name='unique_department_currency_balance'),
+        ]
+
+    def __str__(self):
+        return f"{self.department_id} - {self.currency_id}: {self.balance}"
+
+    @property
+    def balance(self):
+        return self.total_budgets - self.total_bills
+
+    @classmethod
+    def record(cls, kind, department_id, currency_id, total_mount, sign=1):
+        """Add (sign=1) or remove (sign=-1) one budget/bill from the ledger."""
+        if department_id is None or currency_id is None:
+            return
+        balance, _ = cls.objects.get_or_create(department_id=department_id, currency_id=currency_id)
+        cls.objects.filter(pk=balance.pk).update(**{
+            f'total_{kind}': F(f'total_{kind}') + sign * (total_mount or 0),
+            f'{kind}_count': F(f'{kind}_count') + sign,
+        })
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every row from Budget and Bill in a single transaction."""
+        rows = {}
+        for kind, model in (('budgets', Budget), ('bills', Bill)):
+            grouped = (
+                model.objects.order_by()
+                .values('department_id', 'currency_id')
+                .annotate(total=Sum('total_mount'), count=models.Count('id'))
+            )
+            for row in grouped:
+                key = (row['department_id'], row['currency_id'])
+                balance = rows.setdefault(key, cls(department_id=key[0], currency_id=key[1]))
+                setattr(balance, f'total_{kind}', row['total'] or 0)
+                setattr(balance, f'{kind}_count', row['count'])
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows.values(), batch_size=500)
+        return len(rows)
+"""---------DEPARTMENT_BALANCE---------"""
+
+"""---------BILL_MONTHLY_ROLLUP---------"""
+class BillMonthlyRollup(models.Model):
+    """
+    Bill totals and counts per month (by created_at, local time) and per
+    department, category, type, status and currency. Maintained on every Bill
+    write, backfill with: python manage.py rebuild_rollups
+    """
+    month = models.DateField()
+    department = models.ForeignKey('Department', on_delete=models.CASCADE, related_name='bill_rollups')
+    category = models.ForeignKey('CategoryBill', on_delete=models.CASCADE, null=True, blank=True, related_name='bill_rollups')
+    type = models.ForeignKey('TypeTransaction', on_delete=models.CASCADE, related_name='bill_rollups')
+    status = models.ForeignKey('StatusTransaction', on_delete=models.CASCADE, related_name='bill_rollups')
+    currency = models.ForeignKey('Currency', on_delete=models.CASCADE, related_name='bill_rollups')
+    total = models.DecimalField(max_digits=24, decimal_places=0, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-month']
+        verbose_name = translate("bill_monthly_rollup")
+        verbose_name_plural = translate("bill_monthly_rollups")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['month', 'department', 'category', 'type', 'status', 'currency'],
+                name='unique_bill_monthly_rollup',
+            ),
+            # NULLs are distinct in the constraint above, uncategorized buckets need their own
+            # (nulls_distinct=False is PostgreSQL 15+ only)
+            models.UniqueConstraint(
+                fields=['month', 'department', 'type', 'status', 'currency'],
+                condition=Q(category__isnull=True),
+                name='unique_bill_monthly_rollup_uncategorized',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['department', 'month'], name='rollup_department_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} - {self.department_id}: {self.total} ({self.count})"
+
+    @staticmethod
+    def month_of(value):
+        return timezone.localtime(value).date().replace(day=1)
+
+    @classmethod
+    def record(cls, state, sign=1):
+        """Add (sign=1) or remove (sign=-1) one bill from its monthly bucket."""
+        if state['created_at'] is None or state['department_id'] is None:
+            return
+        rollup, _ = cls.objects.get_or_create(
+            month=cls.month_of(state['created_at']),
+            department_id=state['department_id'],
+            category_id=state['category_id'],
+            type_id=state['type_id'],
+            status_id=state['status_id'],
+            currency_id=state['currency_id'],
+        )
+        cls.objects.filter(pk=rollup.pk).update(
+            total=F('total') + sign * (state['total_mount'] or 0),
+            count=F('count') + sign,
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every bucket from Bill in a single transaction."""
+        dimensions = ['department_id', 'category_id', 'type_id', 'status_id', 'currency_id']
+        grouped = (
+            Bill.objects.order_by()
+            .annotate(bucket=TruncMonth('created_at', output_field=models.DateField()))
+            .values('bucket', *dimensions)
+            .annotate(bucket_total=Sum('total_mount'), bucket_count=models.Count('id'))
+        )
+        rows = [
+            cls(
+                month=row['bucket'],
+                total=row['bucket_total'] or 0,
+                count=row['bucket_count'],
+                **{field: row[field] for field in dimensions}
+            )
+            for row in grouped.iterator()
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+"""---------BILL_MONTHLY_ROLLUP---------"""
+
 """---------CURRENCY---------"""
 class Currency(models.Model):
     name = models.CharField(max_length=32)
@@ -367,10 +734,15 @@ class ActivityLog(models.Model):
     path = models.CharField(max_length=255, null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     extra_data = models.JSONField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Default instead of auto_now_add so buffered rows keep the time they were queued
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Admin ordering and the retention cutoff of archive_activity_logs
+            models.Index(fields=['timestamp'], name='activity_timestamp_idx'),
+        ]
         verbose_name = translate("activity_log")
         verbose_name_plural = translate("activity_logs")    
 
@@ -378,6 +750,65 @@ class ActivityLog(models.Model):
         #return f'[{self.timestamp: %Y-%m-%d %H:%M}] {self.user or "System"} - self.action'
         return f'[{self.timestamp: %Y-%m-%d %H:%M}] {"System"} - self.action'
 
+class ActivityCounter(models.Model):
+    """
+    Requests per view, method and status in one minute buckets, upserted in
+    batches by app.utils.log_writer instead of one ActivityLog row per request.
+    """
+    minute = models.DateTimeField()
+    view_name = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    status = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    total_latency = models.FloatField(default=0) # milliseconds
+
+    class Meta:
+        ordering = ['-minute']
+        verbose_name = translate("activity_counter")
+        verbose_name_plural = translate("activity_counters")
+        constraints = [
+            models.UniqueConstraint(fields=['minute', 'view_name', 'method', 'status'], name='unique_activity_counter_bucket'),
+        ]
+
+    def __str__(self):
+        return f'[{self.minute: %Y-%m-%d %H:%M}] {self.method} {self.view_name} {self.status}: {self.count}'
+
+    @property
+    def average_latency(self):
+        return self.total_latency / self.count if self.count else 0
+
+    @staticmethod
+    def minute_of(timestamp):
+        return timestamp.replace(second=0, microsecond=0)
+
+    @classmethod
+    def upsert(cls, counters):
+        """
+        counters: {(minute, view_name, method, status): (count, total_latency)}
+        One INSERT .. ON CONFLICT DO UPDATE adding to the existing bucket.
+        """
+        if not counters:
+            return
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(name) for name in ('minute', 'view_name', 'method', 'status', 'count', 'total_latency'))
+        keys = ', '.join(quote(name) for name in ('minute', 'view_name', 'method', 'status'))
+        table = quote(cls._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT ({keys}) DO UPDATE SET "
+            f"{quote('count')} = {table}.{quote('count')} + EXCLUDED.{quote('count')}, "
+            f"{quote('total_latency')} = {table}.{quote('total_latency')} + EXCLUDED.{quote('total_latency')}"
+        )
+        field = cls._meta.get_field('minute')
+        rows = [
+            (field.get_db_prep_value(minute, connection), view_name, method, status, count, latency)
+            for (minute, view_name, method, status), (count, latency) in counters.items()
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
 """---------ACTIVITY_LOG---------"""
 
 """---------USER & SESSIONS---------"""
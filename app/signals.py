@@ -1,19 +1,152 @@
-import os
-from django.db.models.signals import post_delete
+import logging
+from django.db import connections, router, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, post_migrate, pre_delete, pre_save
 from django.dispatch import receiver
-from app.models import BudgetFile, BillFile
+from app.models import (
+    BudgetFile, BillFile, Budget, Bill, FileBlob,
+    Department, TypeTransaction, StatusTransaction, CategoryBill
+)
+from app.utils import dashboard_cache
+from app.utils import search as search_index
+from app.utils.db_tuning import configure_connection
+
+logger = logging.getLogger("app")
+
+# Archivos adjuntos: el mismo contenido se guarda una sola vez (app/utils/storage.py),
+# FileBlob cuenta sus referencias y el archivo se borra con la ultima.
+@receiver(pre_save, sender=BudgetFile)
+@receiver(pre_save, sender=BillFile)
+def remember_stored_file(sender, instance, **kwargs):
+    instance._stored_file = (
+        sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first() if instance.pk else None
+    )
+    # Una subida nueva la cuenta el storage al guardarla
+    instance._counted_upload = bool(
+        instance.file and not instance.file._committed
+        and getattr(instance.file.storage, 'counts_references', False)
+    )
+
+@receiver(post_save, sender=BudgetFile)
+@receiver(post_save, sender=BillFile)
+def count_file_reference(sender, instance, **kwargs):
+    name = instance.file.name
+    previous = getattr(instance, '_stored_file', None)
+    if name == previous:
+        return
+    if name and not getattr(instance, '_counted_upload', False):
+        FileBlob.acquire(name, instance.file.size)
+    if previous:
+        release_stored_file(instance.file.storage, previous)
 
 @receiver(post_delete, sender=BudgetFile)
 @receiver(post_delete, sender=BillFile)
 def delete_file_from_storage(sender, instance, **kwargs):
+    if instance.file:
+        release_stored_file(instance.file.storage, instance.file.name)
 
-    if instance.file and os.path.isfile(instance.file.path):
-        path_to_delete = instance.file.path
-        folder_path_to_delete = os.path.dirname(path_to_delete)
+def release_stored_file(storage, name):
+    if not FileBlob.release(name):
+        return
 
+    def remove():
         try:
-            os.remove(instance.file.path)
-            os.rmdir(folder_path_to_delete)
+            # Vuelve a contar bajo el bloqueo, una subida igual pudo llegar antes
+            FileBlob.collect(name, storage)
+        except Exception:
+            logger.exception("No se pudo eliminar el archivo fisico %s", name)
+
+    # Solo si el borrado se confirma
+    transaction.on_commit(remove, using=router.db_for_write(FileBlob))
+
+
+# Sacando el presupuesto o gasto eliminado del balance de su departamento
+# y de los reportes mensuales.
+# pre_delete y post_delete corren dentro de la transaccion del borrado,
+# se resta lo guardado (leido con bloqueo), no lo que tenia la instancia.
+@receiver(pre_delete, sender=Budget)
+@receiver(pre_delete, sender=Bill)
+def lock_ledger_state(sender, instance, **kwargs):
+    instance._ledger_state = instance._previous_ledger_state()
+
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Bill)
+def remove_from_department_balance(sender, instance, **kwargs):
+    state = getattr(instance, '_ledger_state', None)
+    # Ya borrado por otra copia, no queda nada que restar
+    if state is not None:
+        instance.apply_ledgers(state, sign=-1)
+
+
+
+# Invalidando el resumen en cache de los departamentos afectados,
+# al confirmarse la transaccion
+@receiver(post_save, sender=Budget)
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Bill)
+def invalidate_dashboard_cache(sender, instance, using, **kwargs):
+    # En un update _ledger_state aun tiene el departamento anterior
+    state = getattr(instance, '_ledger_state', None)
+    previous_department = state['department_id'] if state else None
+    dashboard_cache.invalidate(instance.department_id, previous_department, using=using)
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_dashboard_department(sender, instance, using, **kwargs):
+    dashboard_cache.invalidate(instance.pk, using=using)
+
+@receiver(post_save, sender=TypeTransaction)
+@receiver(post_save, sender=StatusTransaction)
+@receiver(post_delete, sender=TypeTransaction)
+@receiver(post_delete, sender=StatusTransaction)
+def invalidate_dashboard_catalogs(sender, instance, using, **kwargs):
+    dashboard_cache.invalidate_catalogs(using=using)
+
+
+
+# PRAGMAs de SQLite (WAL, busy_timeout, ...) en cada conexion nueva
+@receiver(connection_created)
+def tune_database_connection(sender, connection, **kwargs):
+    configure_connection(connection)
+
+
+
+# Indice de busqueda FTS5 de presupuestos y gastos
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    # Solo en la base que guarda presupuestos y gastos (no en la de logs)
+    if sender.name == 'app' and router.allow_migrate_model(using, Budget):
+        search_index.create_index(connections[using])
+
+@receiver(post_save, sender=Budget)
+@receiver(post_save, sender=Bill)
+def index_budget_or_bill(sender, instance, **kwargs):
+    search_index.index_objects([instance])
+
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Bill)
+def unindex_budget_or_bill(sender, instance, **kwargs):
+    search_index.remove_object(instance)
+
+# Los nombres de departamento y categoria tambien se indexan, solo se
+# reindexa cuando el nombre cambia.
+@receiver(pre_save, sender=Department)
+@receiver(pre_save, sender=CategoryBill)
+def remember_indexed_name(sender, instance, **kwargs):
+    if instance.pk is None:
+        # Nuevo, aun no esta en el indice
+        instance._indexed_name = None
+        return
+    instance._indexed_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+@receiver(post_save, sender=Department)
+def reindex_department_name(sender, instance, created, **kwargs):
+    if not created and instance._indexed_name != instance.name:
+        search_index.reindex_queryset(instance.budgets.all(), department_name=instance.name)
+        search_index.reindex_queryset(instance.bills.all(), department_name=instance.name)
 
-        except Exception as e:
-            print(f"No se pudo eliminar el archivo fisico por: {e}")
+@receiver(post_save, sender=CategoryBill)
+def reindex_category_name(sender, instance, created, **kwargs):
+    if not created and instance._indexed_name != instance.name:
+        search_index.reindex_queryset(instance.bills.all(), category_name=instance.name)
@@ -1,13 +1,48 @@
-from django.test import TestCase, Client, override_settings
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from unittest import mock, skipUnless
 from django.urls import reverse
-from django.db.models import Q
+from . import urls as app_urls
+from django.db.models import Q, Sum
 from datetime import date, datetime, timezone
-from .models import (Budget, BudgetFile, Department)
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import (
+    Budget, BudgetFile, Bill, BillFile, Department, Currency,
+    TypeTransaction, StatusTransaction, CustomUser, DepartmentBalance,
+    BillMonthlyRollup, CategoryBill, ActivityLog, ActivityCounter, FileBlob
+)
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction, IntegrityError
+from django.core.cache import cache
+from .utils import dashboard_cache
+from .utils.pagination import partitioned_slice
+from .utils import search as search_index
+from .utils.log_writer import ActivityLogWriter
+from .utils import log_archive
+from .utils import metrics
+from .utils import slow_queries as slow_query_log
+from .utils.nplusone import NPlusOneError, QueryRepetitionTracker, NPlusOneTestMixin
+from django.template import Template, Context as TemplateContext
+from .utils.db_router import ActivityLogRouter, ReplicaRouter, read_only, reading_from_replica, replica_reads
+from .middleware.replica import STICKY_COOKIE
+from .admin import BudgetAdmin
+from .utils import db_tuning
+from .utils.log_handlers import QueueLogHandler, JsonFormatter, GzipRotatingFileHandler, start_log_listeners
+from .management.commands import load_test
+from io import StringIO
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
 from django.conf import settings
 import uuid
 import os
 import tempfile
+import time
+import logging
+import queue
+import json
+import gzip
+import sqlite3
 
 
 class BudgetModelTest(TestCase):
@@ -554,6 +589,1427 @@ class BudgetDeleteView(TestCase):
 
 
 
+# Session, user, page rows (+ ledger total, + categories for bills)
+BUDGET_LIST_QUERIES = 4
+BILL_LIST_QUERIES = 5
+# Session, user, count, page rows (+ ledger totals or prefetched subcategories)
+DEPARTMENT_LIST_QUERIES = 5
+CATEGORY_LIST_QUERIES = 5
+# ActivityCounter upsert of the middleware, inline because ACTIVITY_LOG_ASYNC is off under tests
+REQUEST_LOG_QUERIES = 1
+
+
+def create_catalogs():
+    """Reference rows required by Budget and Bill."""
+    return {
+        'currency': Currency.objects.create(name='Peso', code='CLP', symbol='$'),
+        'type': TypeTransaction.objects.create(name='Egreso'),
+        'other_type': TypeTransaction.objects.create(name='Ingreso'),
+        'status': StatusTransaction.objects.create(name='En Proceso'),
+        'closed': StatusTransaction.objects.create(name='Aprobado', enable=True),
+    }
+
+
+def create_budget(department, catalogs, total_mount=1000, **kwargs):
+    kwargs.setdefault('type', catalogs['type'])
+    kwargs.setdefault('status', catalogs['status'])
+    return Budget.objects.create(
+        title=kwargs.pop('title', f"Budget {department.name}"),
+        total_mount=total_mount,
+        currency=catalogs['currency'],
+        department=department,
+        **kwargs
+    )
+
+
+def create_bill(budget, catalogs, total_mount=100, **kwargs):
+    kwargs.setdefault('type', catalogs['type'])
+    kwargs.setdefault('status', catalogs['status'])
+    return Bill.objects.create(
+        title=kwargs.pop('title', f"Bill {budget.title}"),
+        total_mount=total_mount,
+        currency=catalogs['currency'],
+        department=budget.department,
+        budget=budget,
+        **kwargs
+    )
+
+
+class ResumeBudgetSummaryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('app:resume_budgets')
+
+    def _seed(self, departments):
+        for index in range(departments):
+            dept = Department.objects.create(name=f'DEPT {index}')
+            budget = create_budget(dept, self.catalogs, total_mount=1000)
+            create_bill(budget, self.catalogs, total_mount=300)
+            create_bill(budget, self.catalogs, total_mount=200, type=self.catalogs['other_type'])
+
+    def test_resume_budget_totals(self):
+        self._seed(2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_budgets'], 2000)
+        self.assertEqual(response.context['total_bills'], 1000)
+        self.assertEqual(response.context['balance_general'], 1000)
+        self.assertEqual(response.context['bills_count'], 4)
+        self.assertEqual(response.context['departments_count'], 2)
+
+        dept_summary = response.context['departments_summary'][0]
+        self.assertEqual(dept_summary['balance'], 500)
+        self.assertEqual(dept_summary['budgets_count'], 1)
+        self.assertEqual(dept_summary['bills_count'], 2)
+
+        types = {row['type'].name: row for row in response.context['types_summary']}
+        self.assertEqual(types['Egreso']['budgets'], 2000)
+        self.assertEqual(types['Ingreso']['bills'], 400)
+        status = response.context['status_summary'][0]
+        self.assertEqual(status['bills_count'], 4)
+
+    def test_resume_budget_query_count_is_constant(self):
+        self._seed(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._seed(10)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+        self.assertEqual(len(few), len(many))
+
+    def test_scoped_user_query_count_is_constant(self):
+        user = CustomUser.objects.create_user(
+            email='wom@kashet.cl', password='secret', username='wom',
+            first_name='Wom', last_name='User'
+        )
+        self.client.force_login(user)
+        urls = [self.url, reverse('app:list_budget'), reverse('app:list_bills')]
+        self._seed(2)
+        user.departments.set(Department.objects.all())
+        few = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            few[url] = len(queries)
+
+        # More departments than NPLUSONE_THRESHOLD, NPlusOneMiddleware raises under tests
+        self._seed(8)
+        user.departments.set(Department.objects.all())
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), few[url], url)
+
+        response = self.client.get(self.url)
+        newest = Budget.objects.order_by('-created_at', '-id')[:5]
+        self.assertEqual(list(response.context['recent_budgets']), list(newest))
+
+
+class DepartmentBalanceLedgerTest(TestCase):
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.other_dept = Department.objects.create(name='ENTEL')
+
+    def _department(self, dept):
+        # Fresh instance, ledger_totals is cached per instance
+        return Department.objects.get(pk=dept.pk)
+
+    def test_ledger_follows_create_update_delete(self):
+        budget = create_budget(self.dept, self.catalogs, total_mount=1000)
+        bill = create_bill(budget, self.catalogs, total_mount=250)
+
+        dept = self._department(self.dept)
+        self.assertEqual(dept.get_total_budgets, 1000)
+        self.assertEqual(dept.get_total_bills, 250)
+        self.assertEqual(dept.balance, 750)
+        self.assertEqual(dept.get_bills_count, 1)
+
+        bill = Bill.objects.get(pk=bill.pk)
+        bill.total_mount = 400
+        bill.save()
+        self.assertEqual(self._department(self.dept).get_total_bills, 400)
+
+        bill.department = self.other_dept
+        bill.save()
+        self.assertEqual(self._department(self.dept).get_total_bills, 0)
+        self.assertEqual(self._department(self.other_dept).get_total_bills, 400)
+
+        bill.delete()
+        other = self._department(self.other_dept)
+        self.assertEqual(other.get_total_bills, 0)
+        self.assertEqual(other.get_bills_count, 0)
+
+    def ledger_rows(self):
+        return list(DepartmentBalance.objects.order_by('department', 'currency').values(
+            'department', 'currency', 'total_budgets', 'total_bills', 'budgets_count', 'bills_count'
+        ))
+
+    def test_copies_saved_one_after_the_other(self):
+        budget = create_budget(self.dept, self.catalogs, total_mount=1000)
+        first, second = Budget.objects.get(pk=budget.pk), Budget.objects.get(pk=budget.pk)
+        first.total_mount = 2000
+        first.save()
+        second.total_mount = 3000
+        second.save()
+        self.assertEqual(self._department(self.dept).get_total_budgets, 3000)
+        ledger = self.ledger_rows()
+        DepartmentBalance.rebuild()
+        self.assertEqual(ledger, self.ledger_rows())
+
+        # The second delete finds no row left to subtract
+        first, second = Budget.objects.get(pk=budget.pk), Budget.objects.get(pk=budget.pk)
+        first.delete()
+        second.delete()
+        dept = self._department(self.dept)
+        self.assertEqual((dept.get_total_budgets, dept.get_budget_count), (0, 0))
+
+    def test_balance_reads_single_query(self):
+        create_budget(self.dept, self.catalogs, total_mount=1000)
+        dept = self._department(self.dept)
+        with self.assertNumQueries(1):
+            dept.get_total_budgets
+            dept.get_total_bills
+            dept.balance
+
+    def test_rebuild_balances_command(self):
+        budget = create_budget(self.dept, self.catalogs, total_mount=1000)
+        create_bill(budget, self.catalogs, total_mount=300)
+        DepartmentBalance.objects.update(total_budgets=0, total_bills=0)
+
+        call_command('rebuild_balances', stdout=StringIO())
+        balance = DepartmentBalance.objects.get(department=self.dept)
+        self.assertEqual(balance.total_budgets, 1000)
+        self.assertEqual(balance.total_bills, 300)
+        self.assertEqual(balance.budgets_count, 1)
+
+
+class DashboardCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.other_dept = Department.objects.create(name='ENTEL')
+        self.budget = create_budget(self.dept, self.catalogs, total_mount=1000)
+        self.other_budget = create_budget(self.other_dept, self.catalogs, total_mount=500)
+        self.user = CustomUser.objects.create_user(
+            email='wom@kashet.cl', password='secret', username='wom',
+            first_name='Wom', last_name='User'
+        )
+        self.user.departments.add(self.dept)
+        self.client.force_login(self.user)
+        self.url = reverse('app:resume_budgets')
+
+    def test_second_request_is_a_hit(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        stats = dashboard_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_write_in_scope_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_bill(self.budget, self.catalogs, total_mount=200)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['total_bills'], 200)
+        self.assertEqual(dashboard_cache.stats()['misses'], 2)
+
+    def test_invalidation_waits_for_commit(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_bill(self.budget, self.catalogs, total_mount=200)
+        # The cached summary stays until the write commits
+        self.assertEqual(self.client.get(self.url).context['total_bills'], 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.url).context['total_bills'], 200)
+
+    def test_write_out_of_scope_keeps_entry(self):
+        self.client.get(self.url)
+        create_bill(self.other_budget, self.catalogs, total_mount=200)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['total_bills'], 0)
+        self.assertEqual(dashboard_cache.stats()['hits'], 1)
+
+
+class BillMonthlyRollupTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.category = CategoryBill.objects.create(name='Oficina')
+        self.budget = create_budget(self.dept, self.catalogs, total_mount=5000)
+        self.user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.user)
+
+    def test_rollup_follows_writes(self):
+        bill = create_bill(self.budget, self.catalogs, total_mount=300, category=self.category)
+        create_bill(self.budget, self.catalogs, total_mount=200, category=self.category)
+        rollup = BillMonthlyRollup.objects.get(category=self.category, status=self.catalogs['status'])
+        self.assertEqual(rollup.total, 500)
+        self.assertEqual(rollup.count, 2)
+
+        bill = Bill.objects.get(pk=bill.pk)
+        bill.status = self.catalogs['closed']
+        bill.save()
+        rollup.refresh_from_db()
+        self.assertEqual(rollup.total, 200)
+        closed = BillMonthlyRollup.objects.get(status=self.catalogs['closed'])
+        self.assertEqual(closed.total, 300)
+
+        bill.delete()
+        closed.refresh_from_db()
+        self.assertEqual(closed.count, 0)
+
+    def rollup_rows(self):
+        return list(BillMonthlyRollup.objects.filter(count__gt=0).order_by(
+            'month', 'department', 'category', 'type', 'status', 'currency'
+        ).values('month', 'department', 'category', 'type', 'status', 'currency', 'total', 'count'))
+
+    def test_copies_change_amount_and_category(self):
+        bill = create_bill(self.budget, self.catalogs, total_mount=300)
+        first, second = Bill.objects.get(pk=bill.pk), Bill.objects.get(pk=bill.pk)
+        first.total_mount = 500
+        first.save()
+        # Moved out of the stored bucket (uncategorized, 500), not the loaded one
+        second.category = self.category
+        second.total_mount = 700
+        second.save()
+
+        rollups = self.rollup_rows()
+        self.assertEqual([(row['category'], row['total'], row['count']) for row in rollups], [(self.category.id, 700, 1)])
+        BillMonthlyRollup.rebuild()
+        self.assertEqual(rollups, self.rollup_rows())
+
+    def test_one_uncategorized_bucket(self):
+        create_bill(self.budget, self.catalogs, total_mount=300)
+        rollup = BillMonthlyRollup.objects.get(category__isnull=True)
+        duplicate = BillMonthlyRollup(
+            month=rollup.month, department=self.dept, type=rollup.type,
+            status=rollup.status, currency=rollup.currency
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            duplicate.save()
+        create_bill(self.budget, self.catalogs, total_mount=200)
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.total, rollup.count), (500, 2))
+
+    def test_rebuild_rollups_command(self):
+        create_bill(self.budget, self.catalogs, total_mount=300, category=self.category)
+        create_bill(self.budget, self.catalogs, total_mount=200)
+        BillMonthlyRollup.objects.all().delete()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(BillMonthlyRollup.objects.count(), 2)
+        self.assertEqual(BillMonthlyRollup.objects.aggregate(total=Sum('total'))['total'], 500)
+
+    def test_bills_reports_reads_rollups(self):
+        create_bill(self.budget, self.catalogs, total_mount=300, category=self.category)
+        create_bill(self.budget, self.catalogs, total_mount=200, status=self.catalogs['closed'])
+        response = self.client.get(reverse('app:bills_reports'), {'months': '12'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report_total'], 500)
+        self.assertEqual(response.context['report_pending'], 300)
+        self.assertEqual(response.context['remaining_capital'], 4500)
+        self.assertEqual(response.context['by_department'][0]['records'], 2)
+
+
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.budget = create_budget(self.dept, self.catalogs, total_mount=100000)
+        self.bills = [
+            create_bill(self.budget, self.catalogs, total_mount=10, title=f'Bill {index}')
+            for index in range(25)
+        ]
+        self.user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('app:list_bills')
+
+    def test_walk_pages_forward_and_back(self):
+        seen = []
+        params = {}
+        pages = []
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            pages.append(page)
+            seen.extend(bill.pk for bill in page)
+            if not page.has_next():
+                break
+            params = {'after': page.next_cursor}
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(seen, sorted((bill.pk for bill in self.bills), reverse=True))
+        self.assertEqual(response.context['total_count'], 25)
+
+        response = self.client.get(self.url, {'before': pages[-1].previous_cursor})
+        self.assertEqual([bill.pk for bill in response.context['page_obj']], [bill.pk for bill in pages[1]])
+
+    def test_partitioned_slice_keeps_the_caller_filters(self):
+        other_dept = Department.objects.create(name='ENTEL')
+        other_budget = create_budget(other_dept, self.catalogs, total_mount=100000)
+        other_bills = [create_bill(other_budget, self.catalogs, total_mount=10) for _ in range(3)]
+        scope = Bill.objects.filter(title__startswith='Bill 1')
+        where = str(scope.query)
+        ordering = ('-created_at', '-id')
+        for base in (None, Bill.objects.all()):
+            rows = partitioned_slice(scope, 'department', [self.dept.id, other_dept.id], ordering, 5, base=base)
+            expected = scope.filter(department__in=[self.dept, other_dept]).order_by(*ordering)[:5]
+            self.assertEqual(rows, list(expected))
+        self.assertEqual(str(scope.query), where)
+        self.assertNotIn(other_bills[0], rows)
+
+    def test_deep_page_costs_the_same(self):
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(self.url)
+        cursor = response.context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(self.url, {'after': cursor})
+        self.assertEqual(len(first), len(deep))
+        self.assertFalse(any('OFFSET' in query['sql'] for query in deep.captured_queries))
+
+    def test_exact_count_is_optional(self):
+        response = self.client.get(self.url, {'category': 'NULL'})
+        self.assertIsNone(response.context['total_count'])
+        response = self.client.get(self.url, {'category': 'NULL', 'count': '1'})
+        self.assertEqual(response.context['total_count'], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ListViewQueryCountTest(TestCase):
+    """Rendering a list page must not run one query per row."""
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.category = CategoryBill.objects.create(name='Oficina')
+        for index in range(3):
+            dept = Department.objects.create(name=f'DEPT {index}')
+            for _ in range(4):
+                budget = create_budget(dept, self.catalogs, total_mount=1000)
+                create_bill(budget, self.catalogs, total_mount=10, category=self.category)
+        self.user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.user)
+        # Warm up session and auth lookups
+        self.client.get(reverse('app:list_budget'))
+
+    def test_budget_list_queries(self):
+        with self.assertNumQueries(BUDGET_LIST_QUERIES + REQUEST_LOG_QUERIES):
+            response = self.client.get(reverse('app:list_budget'))
+        self.assertEqual(len(response.context['budgets']), 10)
+        self.assertTrue(all(budget.has_bills for budget in response.context['budgets']))
+
+    def test_bill_list_queries(self):
+        with self.assertNumQueries(BILL_LIST_QUERIES + REQUEST_LOG_QUERIES):
+            response = self.client.get(reverse('app:list_bills'))
+        self.assertEqual(len(response.context['bills']), 10)
+        self.assertIn('description', response.context['bills'][0].get_deferred_fields())
+
+    def test_department_list_queries(self):
+        with self.assertNumQueries(DEPARTMENT_LIST_QUERIES + REQUEST_LOG_QUERIES):
+            response = self.client.get(reverse('app:list_departments'))
+        department = response.context['departments'][0]
+        self.assertEqual(department.get_budget_count, 4)
+        self.assertEqual(department.get_bills_count, 4)
+        self.assertEqual(department.balance, 3960)
+        self.assertEqual(response.context['total_bills'], 12)
+
+    def test_category_list_queries(self):
+        CategoryBill.objects.create(name='Papeleria', parent=self.category)
+        with self.assertNumQueries(CATEGORY_LIST_QUERIES + REQUEST_LOG_QUERIES):
+            response = self.client.get(reverse('app:categories_bills'))
+        categories = {category.name: category for category in response.context['categories']}
+        self.assertEqual(categories['Oficina'].get_bills_count, 12)
+        self.assertTrue(categories['Oficina'].has_children)
+        self.assertFalse(categories['Papeleria'].has_bills)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite only')
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN QUERY PLAN of the budget/bill queries each view runs. A plain
+    table scan or a temporary B-tree to sort means an index is missing.
+    Grouped aggregates are left out, they read the whole scope by design.
+    """
+    TABLES = ('"app_budget"', '"app_bill"')
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.category = CategoryBill.objects.create(name='Oficina')
+        self.dept = Department.objects.create(name='WOM')
+        self.other_dept = Department.objects.create(name='ENTEL')
+        for dept in (self.dept, self.other_dept):
+            for _ in range(3):
+                budget = create_budget(dept, self.catalogs, total_mount=1000)
+                create_bill(budget, self.catalogs, total_mount=10, category=self.category)
+        self.budget = budget
+        self.superuser = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.user = CustomUser.objects.create_user(
+            email='wom@kashet.cl', password='secret', username='wom',
+            first_name='Wom', last_name='User'
+        )
+        self.user.departments.add(self.dept, self.other_dept)
+
+    def _plans(self, user, url, params=None):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or 'GROUP BY' in sql:
+                    continue
+                if not any(f'FROM {table}' in sql for table in self.TABLES):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        self.assertTrue(plans, f'No budget/bill queries captured for {url}')
+        return plans
+
+    def assertIndexedPlans(self, user, url, params=None):
+        for sql, plan in self._plans(user, url, params):
+            # partitioned_slice reads at most `limit` candidates per department
+            # by primary key, sorting those is bounded
+            candidates = any(step.startswith('MULTI-INDEX OR') for step in plan)
+            for step in plan:
+                full_scan = step.startswith('SCAN') and 'USING' not in step and 'CONSTANT ROW' not in step
+                self.assertFalse(full_scan, f'Full scan "{step}" in: {sql}')
+                if not candidates:
+                    self.assertNotIn('TEMP B-TREE', step, f'Sort without index in: {sql}')
+
+    def test_list_budget(self):
+        for user in (self.superuser, self.user):
+            self.assertIndexedPlans(user, reverse('app:list_budget'))
+
+    def test_list_bills(self):
+        for user in (self.superuser, self.user):
+            self.assertIndexedPlans(user, reverse('app:list_bills'))
+            self.assertIndexedPlans(user, reverse('app:list_bills'), {'category': self.category.id})
+
+    def test_resume_budget(self):
+        for user in (self.superuser, self.user):
+            self.assertIndexedPlans(user, reverse('app:resume_budgets'))
+
+    def test_department_details(self):
+        self.assertIndexedPlans(self.superuser, reverse('app:details_department', args=[self.dept.id]))
+
+
+class SearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.other_dept = Department.objects.create(name='ENTEL')
+        self.category = CategoryBill.objects.create(name='Papeleria')
+        self.budget = create_budget(self.dept, self.catalogs, title='Campaña redes sociales')
+        self.bill = create_bill(
+            self.budget, self.catalogs, title='Compra de lapices',
+            description='Insumos de oficina', category=self.category
+        )
+        self.other_budget = create_budget(self.other_dept, self.catalogs, title='Campaña television')
+        self.user = CustomUser.objects.create_user(
+            email='wom@kashet.cl', password='secret', username='wom',
+            first_name='Wom', last_name='User'
+        )
+        self.user.departments.add(self.dept)
+
+    def test_search_ranks_and_syncs(self):
+        self.assertEqual(search_index.search('lapic'), [('bill', self.bill.id)])
+        # Accents are ignored and every word must match
+        self.assertEqual(search_index.search('campana redes'), [('budget', self.budget.id)])
+        self.assertEqual(search_index.search('oficina papeleria'), [('bill', self.bill.id)])
+
+        self.bill.title = 'Compra de cuadernos'
+        self.bill.save()
+        self.assertEqual(search_index.search('lapices'), [])
+        self.assertEqual(search_index.search('cuadernos'), [('bill', self.bill.id)])
+
+        self.bill.delete()
+        self.assertEqual(search_index.search('cuadernos'), [])
+
+    def test_department_and_category_rename_reindex(self):
+        self.dept.name = 'WOM Chile'
+        self.dept.save()
+        self.assertEqual(len(search_index.search('chile')), 2)
+        self.category.name = 'Insumos'
+        self.category.save()
+        self.assertEqual(search_index.search('insumos'), [('bill', self.bill.id)])
+
+    def test_search_view_is_scoped(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('app:search'), {'q': 'campaña'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['object'] for result in response.context['results']], [self.budget])
+
+    def test_query_builders(self):
+        self.assertEqual(search_index.build_match('Campaña redes'), '"Campaña"* AND "redes"*')
+        self.assertEqual(search_index.build_tsquery('Campaña redes'), 'campana:* & redes:*')
+        self.assertEqual(search_index.build_tsquery('!!'), '')
+
+    def test_rebuild_search_index_command(self):
+        search_index.clear_index()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(search_index.search('campana')), 2)
+
+    def test_admin_search_uses_index(self):
+        admin_user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:app_bill_changelist'), {'q': 'papeleria'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.bill])
+
+        # Over the limit the ORM search returns every match
+        self.addCleanup(setattr, BudgetAdmin, 'search_limit', BudgetAdmin.search_limit)
+        BudgetAdmin.search_limit = 1
+        response = self.client.get(reverse('admin:app_budget_changelist'), {'q': 'Campaña'})
+        self.assertEqual(set(response.context['cl'].result_list), {self.budget, self.other_budget})
+
+    def test_new_department_skips_name_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            Department.objects.create(name='CLARO')
+        self.assertFalse(any('"name"' in query['sql'] and query['sql'].startswith('SELECT') for query in queries))
+
+
+class InlineActivityLogWriter(ActivityLogWriter):
+    # The flusher thread would not see the test transaction, flush() is called by hand
+    def _ensure_started(self):
+        pass
+
+
+@override_settings(ACTIVITY_LOG_ASYNC=True)
+class ActivityLogWriterTest(TestCase):
+
+    def test_rows_are_buffered_until_flush(self):
+        writer = InlineActivityLogWriter(max_size=10, batch_size=2)
+        for i in range(5):
+            writer.enqueue(level='INFO', action=f'action-{i}', method='POST', path='/')
+        self.assertEqual(ActivityLog.objects.count(), 0)
+
+        with self.assertNumQueries(3):
+            writer.flush()
+        self.assertEqual(ActivityLog.objects.count(), 5)
+        self.assertEqual(writer.stats(), {'queued': 0, 'flushed': 5, 'dropped': 0})
+
+    def test_overflow_is_counted_and_reported(self):
+        writer = InlineActivityLogWriter(max_size=2)
+        for i in range(5):
+            writer.enqueue(level='INFO', action=f'action-{i}')
+        with self.assertLogs('kashet.activity_log', level='WARNING') as logs:
+            writer.stop()
+        self.assertIn('3 rows dropped', logs.output[0])
+        self.assertEqual(writer.stats(), {'queued': 0, 'flushed': 2, 'dropped': 3})
+
+    def test_failed_insert_is_logged_and_counted(self):
+        writer = InlineActivityLogWriter()
+        writer.enqueue(level='INFO', action='kept')
+        writer.enqueue(level='INFO', unknown_field='breaks the batch')
+        with self.assertLogs('kashet.activity_log', level='ERROR') as logs:
+            writer.flush()
+        self.assertIn('2 rows dropped', logs.output[0])
+        self.assertIsNotNone(logs.records[0].exc_info)
+        self.assertEqual(writer.stats(), {'queued': 0, 'flushed': 0, 'dropped': 2})
+
+    def test_timestamp_is_enqueue_time(self):
+        writer = InlineActivityLogWriter()
+        writer.enqueue(level='INFO', action='queued')
+        queued_at = writer.queue.queue[0]['timestamp']
+        writer.flush()
+        self.assertEqual(ActivityLog.objects.get().timestamp, queued_at)
+
+    @override_settings(ACTIVITY_LOG_ASYNC=False)
+    def test_middleware_writes_inline_when_sync(self):
+        self.client.post(reverse('app:login'), {'username': 'nobody', 'password': 'x'})
+        self.assertEqual(ActivityLog.objects.filter(method='POST').count(), 1)
+
+
+
+class ActivityLogArchiveTest(TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(ACTIVITY_LOG_ARCHIVE_DIR=self.archive_dir, ACTIVITY_LOG_RETENTION_DAYS=30)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        for month, action in ((1, 'BudgetCreateView'), (1, 'BillCreateView'), (2, 'BudgetUpdateView')):
+            ActivityLog.objects.create(
+                level='INFO', action=action, method='POST', path='/budgets/',
+                timestamp=datetime(2024, month, 15, 12, tzinfo=timezone.utc),
+            )
+        self.recent = ActivityLog.objects.create(level='INFO', action='Recent', method='POST', path='/')
+
+    def test_old_rows_move_to_monthly_archives(self):
+        out = StringIO()
+        call_command('archive_activity_logs', '--chunk-size', '2', stdout=out)
+        self.assertIn('archived: 3 rows', out.getvalue())
+        self.assertEqual(list(ActivityLog.objects.all()), [self.recent])
+        self.assertEqual(log_archive.available_months(), ['2024-01', '2024-02'])
+        self.assertEqual(
+            [row['action'] for row in log_archive.read_archive('2024-01')],
+            ['BudgetCreateView', 'BillCreateView']
+        )
+        # A second run appends to the same month file
+        ActivityLog.objects.create(
+            level='ERROR', action='ERROR', path='/bills/', timestamp=datetime(2024, 1, 20, tzinfo=timezone.utc)
+        )
+        log_archive.archive_activity_logs()
+        self.assertEqual(len(list(log_archive.read_archive('2024-01'))), 3)
+        self.assertEqual([row['path'] for row in log_archive.read_archive('2024-01', level='ERROR')], ['/bills/'])
+
+    def test_dry_run_keeps_rows(self):
+        self.assertEqual(log_archive.archive_activity_logs(dry_run=True), {'2024-01': 2, '2024-02': 1})
+        self.assertEqual(ActivityLog.objects.count(), 4)
+
+    def test_read_activity_archive_command(self):
+        log_archive.archive_activity_logs()
+        out = StringIO()
+        call_command('read_activity_archive', '2024-01', '2024-02', '--search', 'budget', '--count', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '2')
+
+
+
+class ActivityLogRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = ActivityLogRouter()
+
+    @override_settings(ACTIVITY_LOG_DATABASE='logs')
+    def test_activity_log_lives_in_logs_database(self):
+        self.assertEqual(self.router.db_for_write(ActivityLog), 'logs')
+        self.assertEqual(self.router.db_for_read(ActivityLog), 'logs')
+        self.assertIsNone(self.router.db_for_write(Bill))
+        self.assertTrue(self.router.allow_migrate('logs', 'app', 'activitylog'))
+        self.assertFalse(self.router.allow_migrate('default', 'app', 'activitylog'))
+        self.assertFalse(self.router.allow_migrate('logs', 'app', 'bill'))
+        self.assertFalse(self.router.allow_migrate('logs', 'auth', 'group'))
+        self.assertIsNone(self.router.allow_migrate('default', 'app', 'bill'))
+
+    @override_settings(ACTIVITY_LOG_DATABASE='missing')
+    def test_unknown_alias_falls_back_to_default(self):
+        self.assertEqual(self.router.db_for_write(ActivityLog), 'default')
+        self.assertIsNone(self.router.allow_migrate('default', 'app', 'activitylog'))
+
+
+
+class ActivityCounterTest(TestCase):
+
+    def test_upsert_adds_to_existing_bucket(self):
+        minute = datetime(2024, 3, 1, 10, 5, tzinfo=timezone.utc)
+        key = (minute, 'app.views.BillListView', 'GET', 200)
+        ActivityCounter.upsert({key: (3, 30.0)})
+        ActivityCounter.upsert({key: (2, 20.0), (minute, 'app.views.BillListView', 'GET', 404): (1, 5.0)})
+        counter = ActivityCounter.objects.get(status=200)
+        self.assertEqual((counter.count, counter.total_latency, counter.average_latency), (5, 50.0, 10.0))
+        self.assertEqual(ActivityCounter.objects.count(), 2)
+
+    def test_writer_sums_requests_before_upsert(self):
+        writer = InlineActivityLogWriter()
+        with override_settings(ACTIVITY_LOG_ASYNC=True):
+            for latency in (10, 20, 30):
+                writer.count_request('app.views.login_view', 'POST', 302, latency)
+        self.assertEqual(ActivityCounter.objects.count(), 0)
+        with self.assertNumQueries(1):
+            writer.flush_counters()
+        counter = ActivityCounter.objects.get()
+        self.assertEqual((counter.count, counter.total_latency), (3, 60.0))
+
+    def test_failed_upsert_keeps_counters(self):
+        writer = InlineActivityLogWriter()
+        key = ('not a minute', 'app.views.login_view', 'POST', 302)
+        writer.counters = {key: (2, 20.0)}
+        with self.assertLogs('kashet.activity_log', level='ERROR'):
+            writer.flush_counters()
+        self.assertEqual(writer.counters, {key: (2, 20.0)})
+
+        # Past the cap the oldest minutes are dropped and counted
+        writer.max_pending_counters = 2
+        writer.counters = {
+            (f'minute {minute}', 'app.views.login_view', 'POST', 302): (minute, 10.0) for minute in (3, 1, 2, 4)
+        }
+        with self.assertLogs('kashet.activity_log', level='WARNING') as logs:
+            writer.flush_counters()
+        self.assertEqual(sorted(key[0] for key in writer.counters), ['minute 3', 'minute 4'])
+        self.assertEqual(writer.stats()['dropped'], 3)
+        self.assertIn('2 pending buckets over 2', logs.output[-1])
+
+    def test_middleware_counts_every_request_and_samples_rows(self):
+        with override_settings(ACTIVITY_LOG_SAMPLE_RATE=0):
+            self.client.get(reverse('app:login'))
+            self.client.post(reverse('app:login'), {'username': 'nobody', 'password': 'x'})
+        self.assertEqual(
+            sorted(ActivityCounter.objects.values_list('view_name', 'method', 'count')),
+            [('app.views.login_view', 'GET', 1), ('app.views.login_view', 'POST', 1)]
+        )
+        self.assertFalse(ActivityLog.objects.exists())
+
+
+
+class LoggingPipelineTest(TestCase):
+
+    def make_record(self, msg='User %s access', args=('wom',), **extra):
+        record = logging.LogRecord('app', logging.INFO, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_queue_handler_prepares_json_ready_records(self):
+        handler = QueueLogHandler(queue.Queue(maxsize=1))
+        handler.emit(self.make_record(path='/budgets/', user=CustomUser(email='wom@kashet.cl')))
+        handler.emit(self.make_record())
+        self.assertEqual(QueueLogHandler.dropped, 1)
+        QueueLogHandler.dropped = 0
+
+        line = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+        self.assertEqual(line['message'], 'User wom access')
+        self.assertEqual(line['path'], '/budgets/')
+        self.assertEqual(line['user'], 'wom@kashet.cl')
+
+    def test_listener_started_for_attached_handlers(self):
+        stream = StringIO()
+        target = logging.StreamHandler(stream)
+        handler = QueueLogHandler(handlers=[target], maxsize=10)
+        logger = logging.getLogger('kashet.tests.queue')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        start_log_listeners()
+        listener = handler.listener
+        start_log_listeners()
+        self.assertIs(handler.listener, listener)
+        logger.warning('queued %s', 1)
+        handler.queue.join()
+        self.assertEqual(stream.getvalue(), 'queued 1\n')
+
+    def test_rotated_files_are_gzipped(self):
+        directory = tempfile.mkdtemp()
+        handler = GzipRotatingFileHandler(os.path.join(directory, 'system.log'), maxBytes=200, backupCount=2)
+        handler.setFormatter(JsonFormatter())
+        for i in range(20):
+            handler.emit(self.make_record(args=(i,)))
+        handler._compressing.join()
+        handler.close()
+        self.assertEqual(sorted(os.listdir(directory)), ['system.log', 'system.log.1.gz', 'system.log.2.gz'])
+        with gzip.open(os.path.join(directory, 'system.log.1.gz'), 'rt') as archive:
+            self.assertTrue(all(json.loads(line)['logger'] == 'app' for line in archive))
+
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.user = CustomUser.objects.create_user(
+            email='wom@kashet.cl', password='secret', username='wom',
+            first_name='Wom', last_name='User'
+        )
+        self.staff = CustomUser.objects.create_user(
+            email='staff@kashet.cl', password='secret', username='staff',
+            first_name='Staff', last_name='User', is_staff=True
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 5, 10))
+        for value in (0, 1, 3, 7, 50):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 3), (10, 4)])
+        self.assertEqual((histogram.count, histogram.sum), (5, 61))
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('app:list_budget'))
+        self.client.get(reverse('app:list_budget'))
+
+        labels = metrics.format_labels((('view', 'app.views.BudgetListView'), ('method', 'GET')))
+        histogram = metrics.registry.histograms['kashet_db_queries_per_request'][
+            (('view', 'app.views.BudgetListView'), ('method', 'GET'))
+        ]
+        self.assertEqual(histogram.count, 2)
+        self.assertGreater(histogram.sum, 0)
+        self.assertGreater(
+            metrics.registry.counters['kashet_template_render_seconds_total'][
+                (('view', 'app.views.BudgetListView'), ('method', 'GET'))
+            ], 0
+        )
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE kashet_request_duration_seconds histogram', text)
+        self.assertIn(f'kashet_request_duration_seconds_count{labels} 2', text)
+        self.assertIn('kashet_requests_total{view="app.views.BudgetListView",method="GET",status="200"} 2', text)
+
+    def test_metrics_is_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='scrape-secret', METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_scraper_token_or_allowed_ip(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryLogTest(TestCase):
+
+    def setUp(self):
+        slow_query_log.stats.reset()
+
+    def test_fingerprint_and_params_shape(self):
+        self.assertEqual(
+            slow_query_log.fingerprint("SELECT * FROM t WHERE a = 'x' AND b IN (%s, %s, %s) LIMIT 21"),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?'
+        )
+        self.assertEqual(slow_query_log.params_shape((1, 'a'), False), '(int, str)')
+        self.assertEqual(slow_query_log.params_shape([(1,), (2,)], True), '2 x (int)')
+
+    def test_wrapper_captures_view_and_app_frame(self):
+        wrapper = slow_query_log.slow_query_wrapper(lambda: 'app.views.BudgetListView')
+        with self.assertLogs('kashet.slow_queries', level='WARNING'):
+            with connection.execute_wrapper(wrapper):
+                list(Department.objects.filter(id__in=[1, 2]))
+        entry, = slow_query_log.stats.summary()
+        self.assertEqual(entry['count'], 1)
+        self.assertIn('IN (...)', entry['fingerprint'])
+        self.assertEqual(list(entry['views']), ['app.views.BudgetListView'])
+        self.assertTrue(list(entry['frames'])[0].startswith('app/tests.py:'))
+
+    def test_log_file_is_outside_the_repo(self):
+        handler, = logging.getLogger('kashet.slow_queries').handlers
+        target, = handler.targets
+        self.assertFalse(target.baseFilename.startswith(str(settings.BASE_DIR)))
+
+    def test_staff_page_lists_captures(self):
+        slow_query_log.capture('SELECT 1', None, False, 0.5, 'app.views.resume_budget')
+        staff = CustomUser.objects.create_user(
+            email='staff@kashet.cl', password='secret', username='staff',
+            first_name='Staff', last_name='User', is_staff=True
+        )
+        self.client.force_login(staff)
+        response = self.client.get(reverse('app:slow_queries'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'app.views.resume_budget (1)')
+
+
+
+class NPlusOneDetectorTest(NPlusOneTestMixin, TestCase):
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        for i in range(8):
+            create_budget(self.dept, self.catalogs, title=f'Budget {i}')
+        self.user = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+
+    def test_repeated_select_is_reported_with_origin(self):
+        with self.assertRaises(NPlusOneError) as raised:
+            with self.assertNoNPlusOne():
+                [str(budget) for budget in Budget.objects.all()]
+        message = str(raised.exception)
+        self.assertIn('8x at app/models.py:', message)
+        self.assertIn('"app_department"', message)
+
+        with self.assertNoNPlusOne():
+            [str(budget) for budget in Budget.objects.select_related('department', 'currency')]
+
+    def test_template_line_is_the_origin(self):
+        tracker = QueryRepetitionTracker(threshold=1)
+        with connection.execute_wrapper(tracker):
+            Template('{% for budget in budgets %}{{ budget.department.name }}{% endfor %}').render(
+                TemplateContext({'budgets': Budget.objects.all()})
+            )
+        (key, count, origin), = tracker.repeated()
+        self.assertEqual(count, 8)
+        self.assertTrue(origin.endswith(':1'))
+
+    def test_bill_form_budget_choices(self):
+        self.client.force_login(self.user)
+        # NPlusOneMiddleware raises under tests
+        response = self.client.get(reverse('app:add_bill'))
+        self.assertEqual(response.status_code, 200)
+
+
+
+# Query and latency budget of every URL in app/urls.py, refresh on purpose with:
+# UPDATE_PERF_BASELINE=1 python manage.py test app.tests.PerformanceBudgetTest
+PERF_BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+# Latency ceiling written by the update: measured time x factor, never under the floor
+PERF_LATENCY_FACTOR = 5
+PERF_LATENCY_FLOOR_MS = 250
+# Requests that change the session or delete rows go last
+PERF_LAST_URLS = ('delete_file_budget', 'delete_file_bill', 'logout')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PerformanceBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        catalogs = create_catalogs()
+        parent = CategoryBill.objects.create(name='Oficina')
+        categories = [parent, CategoryBill.objects.create(name='Papeleria', parent=parent), None]
+        departments = [Department.objects.create(name=name) for name in ('WOM', 'ENTEL', 'CLARO')]
+        for dept in departments:
+            for i in range(10):
+                budget = create_budget(dept, catalogs, title=f'{dept.name} budget {i}')
+                for j in range(2):
+                    create_bill(budget, catalogs, title=f'{budget.title} bill {j}', category=categories[(i + j) % 3])
+
+        cls.budget = Budget.objects.filter(department=departments[0]).first()
+        cls.bill = cls.budget.bills.first()
+        cls.category = parent
+        cls.department = departments[0]
+        cls.user = CustomUser.objects.create_user(
+            email='perf@kashet.cl', password='secret', username='perf',
+            first_name='Perf', last_name='User', is_staff=True
+        )
+        cls.user.departments.add(*departments[:2])
+
+    def setUp(self):
+        self.budget_file = BudgetFile.objects.create(
+            budget=self.budget, file=SimpleUploadedFile('budget.pdf', b'budget', content_type='application/pdf')
+        )
+        self.bill_file = BillFile.objects.create(
+            bill=self.bill, file=SimpleUploadedFile('bill.pdf', b'bill', content_type='application/pdf')
+        )
+
+    def url_kwargs(self, pattern):
+        values = {
+            'identifier': self.bill.identifier if 'bill' in pattern.name else self.budget.identifier,
+            'file_id': self.bill_file.id if 'bill' in pattern.name else self.budget_file.id,
+            'id': self.category.id if 'categories' in pattern.name else self.department.id,
+        }
+        return {name: values[name] for name in pattern.pattern.converters}
+
+    def url_names(self):
+        names = [pattern.name for pattern in app_urls.urlpatterns]
+        return [name for name in names if name not in PERF_LAST_URLS] + list(PERF_LAST_URLS)
+
+    def measure(self, name):
+        pattern = next(pattern for pattern in app_urls.urlpatterns if pattern.name == name)
+        url = reverse(f'app:{name}', kwargs=self.url_kwargs(pattern))
+        cache.clear()
+        if name == 'login':
+            self.client.logout()
+        else:
+            self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.client.get(url)
+            elapsed = (time.perf_counter() - started) * 1000
+        self.assertLess(response.status_code, 400, f'{name}: {response.status_code}')
+        return len(queries), elapsed
+
+    def test_every_url_has_a_budget(self):
+        with open(PERF_BASELINE_FILE) as baseline:
+            budgets = json.load(baseline)
+        self.assertEqual(sorted(budgets), sorted(pattern.name for pattern in app_urls.urlpatterns))
+
+    def test_views_stay_within_budget(self):
+        # Templates are compiled once, the first page should not pay for it
+        self.client.force_login(self.user)
+        self.client.get(reverse('app:index'))
+
+        measured = {name: self.measure(name) for name in self.url_names()}
+        if os.environ.get('UPDATE_PERF_BASELINE'):
+            budgets = {
+                name: {'queries': queries, 'max_ms': max(PERF_LATENCY_FLOOR_MS, round(elapsed * PERF_LATENCY_FACTOR))}
+                for name, (queries, elapsed) in sorted(measured.items())
+            }
+            with open(PERF_BASELINE_FILE, 'w') as baseline:
+                json.dump(budgets, baseline, indent=2)
+                baseline.write('\n')
+            self.skipTest(f'{PERF_BASELINE_FILE} updated')
+
+        with open(PERF_BASELINE_FILE) as baseline:
+            budgets = json.load(baseline)
+        for name, (queries, elapsed) in measured.items():
+            with self.subTest(url=name):
+                self.assertLessEqual(queries, budgets[name]['queries'], f'{name}: {queries} queries')
+                self.assertLessEqual(elapsed, budgets[name]['max_ms'], f'{name}: {elapsed:.0f} ms')
+
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SeedLoadCommandTest(TestCase):
+
+    options = dict(
+        departments=3, users=4, budgets=20, bills=60, activity_logs=30,
+        categories=2, subcategories=2, file_ratio=0.2, batch_size=7, end_date=date(2025, 6, 30), stdout=StringIO(),
+    )
+
+    def generate(self, **options):
+        with transaction.atomic():
+            call_command('seed_load', **dict(self.options, **options))
+            rows = list(Bill.objects.order_by('title').values_list(
+                'title', 'total_mount', 'identifier', 'created_at', 'department__name', 'category__name'
+            ))
+            transaction.set_rollback(True)
+        return rows
+
+    def test_same_seed_same_dataset(self):
+        first = self.generate(seed=7)
+        self.assertEqual(len(first), 60)
+        self.assertEqual(first, self.generate(seed=7))
+        self.assertNotEqual(first, self.generate(seed=8))
+
+    def test_derived_tables_are_rebuilt(self):
+        call_command('seed_load', **self.options)
+        self.assertEqual(Budget.objects.count(), 20)
+        self.assertEqual(ActivityLog.objects.count(), 30)
+        self.assertEqual(CustomUser.departments.through.objects.filter(customuser__email__startswith='seed-').exists(), True)
+        self.assertEqual(
+            DepartmentBalance.objects.aggregate(total=Sum('bills_count'))['total'], 60
+        )
+        self.assertEqual(BillMonthlyRollup.objects.aggregate(total=Sum('count'))['total'], 60)
+        # created_at is spread over the window, not the insert time
+        self.assertGreater(Bill.objects.dates('created_at', 'month').count(), 1)
+        with self.assertRaises(CommandError):
+            call_command('seed_load', **self.options)
+
+
+class LoadTestCommandTest(TransactionTestCase):
+
+    # Los hilos del load test usan sus propias conexiones, los datos deben estar confirmados.
+    # Un solo hilo: la base en memoria de los tests bloquea tablas entre conexiones.
+    def setUp(self):
+        call_command('seed_load', departments=2, users=3, budgets=10, bills=20, activity_logs=0,
+                     file_ratio=0, end_date=date(2025, 6, 30), stdout=StringIO())
+
+    def test_percentiles_and_mix(self):
+        values = list(range(1, 101))
+        self.assertEqual(load_test.percentile(values, 50), 50)
+        self.assertEqual(load_test.percentile(values, 99), 99)
+        self.assertEqual(load_test.percentile([], 95), 0.0)
+        self.assertEqual(load_test.parse_mix('dashboard=2,add_bill=1'), {'dashboard': 2.0, 'add_bill': 1.0})
+        with self.assertRaises(CommandError):
+            load_test.parse_mix('unknown=1')
+
+    def test_report_and_compare(self):
+        bills = Bill.objects.count()
+        output = os.path.join(tempfile.mkdtemp(), 'load.json')
+        options = dict(users=3, concurrency=1, requests=40, warmup=5, seed=3, host='testserver', output=output)
+        call_command('load_test', stdout=StringIO(), **options)
+        with open(output) as source:
+            report = json.load(source)
+        self.assertEqual(report['total']['count'] + report['skipped'], 40)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertGreater(report['throughput_rps'], 0)
+        self.assertLessEqual(report['total']['p50_ms'], report['total']['p99_ms'])
+        # create requests really create bills (warmup ones too)
+        self.assertGreaterEqual(Bill.objects.count() - bills, report['actions']['add_bill']['count'])
+
+        stdout = StringIO()
+        call_command('load_test', stdout=stdout, compare=output, **dict(options, output=None))
+        self.assertIn('throughput', stdout.getvalue())
+
+
+class BenchCommandTest(TestCase):
+
+    def setUp(self):
+        call_command('seed_load', departments=2, users=2, budgets=10, bills=20, activity_logs=0,
+                     file_ratio=0, end_date=date(2025, 6, 30), stdout=StringIO())
+        self.baseline = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.options = dict(only=['returning_title', 'render_budget_list'], repeat=1, baseline=self.baseline)
+
+    def test_save_and_compare_baseline(self):
+        call_command('bench', save=True, stdout=StringIO(), **self.options)
+        with open(self.baseline) as source:
+            saved = json.load(source)
+        self.assertEqual(set(saved), {'returning_title', 'render_budget_list'})
+        self.assertGreater(saved['returning_title']['ops_per_sec'], 0)
+        # The page is evaluated before timing, rendering alone runs no query
+        self.assertEqual(saved['render_budget_list']['queries'], 0)
+
+        saved['returning_title']['ops_per_sec'] *= 100
+        with open(self.baseline, 'w') as output:
+            json.dump(saved, output)
+        stdout = StringIO()
+        call_command('bench', stdout=stdout, **self.options)
+        self.assertIn('REGRESSION', stdout.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('bench', fail=True, stdout=StringIO(), **self.options)
+
+
+class SQLiteTuningTest(TestCase):
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite PRAGMAs')
+    def test_pragmas_on_django_connection(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_wal_on_file_database(self):
+        path = os.path.join(tempfile.mkdtemp(), 'tuning.sqlite3')
+        raw = sqlite3.connect(path)
+        try:
+            applied = db_tuning.apply_sqlite_pragmas(raw.cursor())
+        finally:
+            raw.close()
+        self.assertEqual(applied['journal_mode'], 'wal')
+        with self.assertRaises(ValueError):
+            db_tuning.apply_sqlite_pragmas(sqlite3.connect(':memory:').cursor(), {'x; DROP TABLE y': 1})
+
+
+@override_settings(DATABASE_READ_REPLICAS=['default'])
+class ReplicaRoutingTest(TestCase):
+    # The primary stands in for the replica: the routing decisions run without a second database
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.budget = create_budget(self.dept, self.catalogs)
+        self.superuser = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.superuser)
+        self.opened = []
+
+        def record(sticky=False):
+            self.opened.append('primary' if sticky else 'replica')
+            return replica_reads(sticky=sticky)
+        patcher = mock.patch('app.middleware.replica.replica_reads', side_effect=record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, name, *args):
+        self.opened.clear()
+        response = self.client.get(reverse(name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return list(self.opened)
+
+    def test_designated_views_open_replica_reads(self):
+        self.assertEqual(self.get('app:resume_budgets'), ['replica'])
+        self.assertEqual(self.get('app:details_department', self.dept.id), ['replica'])
+        self.assertEqual(self.get('app:list_budget'), [])
+
+    def test_sticky_primary_after_own_write(self):
+        response = self.client.post(reverse('app:add_budget'), {
+            'title': 'Just created', 'description': '', 'type': self.catalogs['type'].id,
+            'status': self.catalogs['status'].id, 'department': self.dept.id, 'total_mount': 5000,
+            'currency': self.catalogs['currency'].id, 'due_date': '2025-12-31', 'set_date': '2025-01-01',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.get('app:resume_budgets'), ['primary'])
+
+        # Window over, back to the replica
+        self.client.cookies[STICKY_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.get('app:resume_budgets'), ['replica'])
+
+    def test_router_decisions(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Budget))
+        with replica_reads() as alias:
+            self.assertEqual(alias, 'default')
+            self.assertTrue(reading_from_replica())
+            self.assertEqual(router.db_for_read(Budget), 'default')
+        with replica_reads(sticky=True):
+            self.assertFalse(reading_from_replica())
+            self.assertIsNone(read_only(Budget.objects.all())._db)
+        self.assertEqual(read_only(Budget.objects.all())._db, 'default')
+        self.assertEqual(router.db_for_write(Budget, instance=self.budget), 'default')
+        self.assertTrue(router.allow_relation(self.budget, self.dept))
+
+    @override_settings(DATABASE_READ_REPLICAS=[])
+    def test_no_replicas_no_routing(self):
+        self.assertEqual(self.get('app:resume_budgets'), [])
+        self.assertEqual(read_only(Budget.objects.all())._db, None)
+
+
+@skipUnless('replica' in settings.DATABASES, 'DATABASE_REPLICA_NAME not set')
+@override_settings(DATABASE_READ_REPLICAS=['replica'])
+class ReplicaRouterTest(TestCase):
+    # The test replica is a second, empty database: what is read from it is not on the primary
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.budget = create_budget(self.dept, self.catalogs, title='Primary budget')
+        self.superuser = CustomUser.objects.create_superuser(
+            email='admin@kashet.cl', password='secret', username='admin',
+            first_name='Admin', last_name='Kashet'
+        )
+        self.client.force_login(self.superuser)
+
+    def recent_budgets(self):
+        response = self.client.get(reverse('app:resume_budgets'))
+        self.assertEqual(response.status_code, 200)
+        return [budget.title for budget in response.context['recent_budgets']]
+
+    def test_designated_views_read_from_replica(self):
+        self.assertEqual(self.recent_budgets(), [])
+        response = self.client.get(reverse('app:details_department', args=[self.dept.id]))
+        self.assertEqual(response.status_code, 404)
+        # Not designated, read from the primary
+        response = self.client.get(reverse('app:list_budget'))
+        self.assertEqual([budget.title for budget in response.context['budgets']], ['Primary budget'])
+
+    def test_sticky_primary_after_own_write(self):
+        response = self.client.post(reverse('app:add_budget'), {
+            'title': 'Just created', 'description': '', 'type': self.catalogs['type'].id,
+            'status': self.catalogs['status'].id, 'department': self.dept.id, 'total_mount': 5000,
+            'currency': self.catalogs['currency'].id, 'due_date': '2025-12-31', 'set_date': '2025-01-01',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.recent_budgets(), ['Just created', 'Primary budget'])
+
+        # Window over, back to the replica
+        self.client.cookies[STICKY_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self.recent_budgets(), [])
+
+    def test_read_only_querysets_and_writes(self):
+        self.assertEqual(read_only(Budget.objects.all()).db, 'replica')
+        with replica_reads(sticky=True):
+            self.assertEqual(read_only(Budget.objects.all()).db, 'default')
+        with replica_reads():
+            self.assertEqual(Budget.objects.all().db, 'replica')
+        self.assertEqual(Budget.objects.all().db, 'default')
+
+        router = ReplicaRouter()
+        self.budget._state.db = 'replica'
+        self.assertEqual(router.db_for_write(Budget, instance=self.budget), 'default')
+        self.assertTrue(router.allow_relation(self.budget, self.dept))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTest(NPlusOneTestMixin, TestCase):
+
+    def setUp(self):
+        self.catalogs = create_catalogs()
+        self.dept = Department.objects.create(name='WOM')
+        self.budget = create_budget(self.dept, self.catalogs)
+        self.bills = [create_bill(self.budget, self.catalogs, title=f'Bill {i}') for i in range(2)]
+
+    def attach(self, bill, name, content=b'%PDF same invoice'):
+        return BillFile.objects.create(bill=bill, file=SimpleUploadedFile(name, content, content_type='application/pdf'))
+
+    def test_failed_insert_does_not_keep_the_reference(self):
+        first = self.attach(self.bills[0], 'factura.pdf')
+        duplicate = BillFile(
+            pk=first.pk, bill=self.bills[1],
+            file=SimpleUploadedFile('copia.pdf', b'%PDF same invoice', content_type='application/pdf')
+        )
+        with self.assertRaises(IntegrityError):
+            duplicate.save(force_insert=True)
+        self.assertEqual(FileBlob.objects.get(name=first.file.name).references, 1)
+
+    def test_same_content_is_stored_once(self):
+        first = self.attach(self.bills[0], 'factura.pdf')
+        second = self.attach(self.bills[1], 'invoice.PDF')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertRegex(first.file.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.pdf$')
+        self.assertEqual((first.filename, second.filename), ('factura.pdf', 'invoice.PDF'))
+        self.assertEqual(FileBlob.objects.get(name=first.file.name).references, 2)
+        other = self.attach(self.bills[1], 'factura.pdf', b'%PDF another invoice')
+        self.assertNotEqual(other.file.name, first.file.name)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'blobs', 'tmp')), [])
+
+    def test_blob_removed_with_last_reference(self):
+        first = self.attach(self.bills[0], 'factura.pdf')
+        second = self.attach(self.bills[1], 'factura.pdf')
+        path = first.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(FileBlob.objects.get(name=second.file.name).references, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        # Empty shard folders go too
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        self.assertFalse(FileBlob.objects.exists())
+
+    def test_upload_before_release_commits_keeps_the_file(self):
+        first = self.attach(self.bills[0], 'factura.pdf')
+        path = first.file.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        # The same content arrives before the delete commits
+        second = self.attach(self.bills[1], 'factura.pdf')
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(second.file.name))
+        self.assertEqual(FileBlob.objects.get(name=second.file.name).references, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_attachments_do_not_repeat_queries(self):
+        with self.assertNoNPlusOne():
+            for i in range(6):
+                self.attach(self.bills[0], f'factura {i}.pdf')
+        self.assertEqual(FileBlob.objects.get().references, 6)
+
+    def test_uncounted_files_and_rebuild(self):
+        name = default_storage.save('bills/legacy/old.pdf', SimpleUploadedFile('old.pdf', b'legacy'))
+        rows = BillFile.objects.bulk_create([BillFile(bill=bill, file=name) for bill in self.bills])
+        # As stored before the counter existed
+        FileBlob.objects.all().delete()
+        call_command('rebuild_file_references', stdout=StringIO())
+        self.assertEqual(FileBlob.objects.get(name=name).references, 2)
+
+        FileBlob.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            rows[0].delete()
+        # Still used by the other bill
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            rows[1].delete()
+        self.assertFalse(default_storage.exists(name))
+
+
+
 
 """
 New testing with new fields of Budget and bills:
@@ -7,7 +7,10 @@ urlpatterns = [
     # ---- INDEX ----
     path('', views.resume_budget, name='index'),
     path('resume_budgets/', views.resume_budget, name='resume_budgets'),
+    path('resume_budgets/cache_stats/', views.dashboard_cache_stats, name='dashboard_cache_stats'),
     path('login/', views.login_view, name='login'),
+    path('slow_queries/', views.slow_queries, name='slow_queries'),
+    path('search/', views.search, name='search'),
     path('logout/', views.logout_view, name='logout'),
     # ---- BUDGET ----
     path('list_budget/', views.BudgetListView.as_view(), name='list_budget'),
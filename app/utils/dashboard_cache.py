@@ -0,0 +1,102 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from app.utils import db_router
+
+"""
+Cache of the resume_budget summary keyed by department scope.
+
+Every department has a generation token, plus one for the superuser scope
+("all") and one for the catalogs (types and status). A cached summary key
+embeds the tokens of its scope, so bumping a token from signals.py makes
+exactly the entries of that scope unreachable. They expire on their own.
+
+Tokens are bumped when the write commits: bumped earlier, a concurrent
+request could cache a summary of the data before the commit under the new
+token. The cache is only shared between processes with a shared backend
+(CACHES in settings.py).
+"""
+
+PREFIX = 'dashboard'
+ALL_SCOPE = 'all'
+CATALOG_SCOPE = 'catalog'
+
+
+def _generation_key(scope):
+    return f'{PREFIX}:gen:{scope}'
+
+
+def _stat_key(name):
+    return f'{PREFIX}:stats:{name}'
+
+
+def _count(name):
+    key = _stat_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _generations(scopes):
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [str(found[key]) for key in keys]
+
+
+def scope_for(department_ids=None):
+    """None means every department (superuser)."""
+    if department_ids is None:
+        return [ALL_SCOPE, CATALOG_SCOPE]
+    return [str(dept_id) for dept_id in sorted(set(department_ids))] + [CATALOG_SCOPE]
+
+
+def get_summary(department_ids, build):
+    scopes = scope_for(department_ids)
+    key = '{}:summary:{}:{}'.format(
+        PREFIX, ','.join(scopes), ','.join(_generations(scopes))
+    )
+    summary = cache.get(key)
+    if summary is None:
+        _count('misses')
+        summary = build()
+        timeout = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+        if db_router.reading_from_replica():
+            # Built from a replica that may still lag behind the write that invalidated it
+            timeout = min(timeout, getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 10))
+        cache.set(key, summary, timeout)
+    else:
+        _count('hits')
+    return summary
+
+
+def invalidate(*department_ids, using=None):
+    """Drop the cached summaries of every scope containing these departments, once committed."""
+    scopes = [ALL_SCOPE] + [str(dept_id) for dept_id in department_ids if dept_id is not None]
+
+    def bump():
+        token = time.time_ns()
+        cache.set_many({_generation_key(scope): token for scope in scopes}, None)
+    transaction.on_commit(bump, using=using)
+
+
+def invalidate_catalogs(using=None):
+    transaction.on_commit(lambda: cache.set(_generation_key(CATALOG_SCOPE), time.time_ns(), None), using=using)
+
+
+def stats():
+    values = cache.get_many([_stat_key('hits'), _stat_key('misses')])
+    hits = values.get(_stat_key('hits'), 0)
+    misses = values.get(_stat_key('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0,
+    }
@@ -0,0 +1,120 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+"""
+Keeps ActivityLog and ActivityCounter in their own database (ACTIVITY_LOG_DATABASE) so log bursts
+never hold the SQLite write lock of budgets and bills. Migrate it apart:
+python manage.py migrate --database=logs
+"""
+
+ROUTED_MODELS = {('app', 'activitylog'), ('app', 'activitycounter')}
+
+
+def log_database():
+    alias = getattr(settings, 'ACTIVITY_LOG_DATABASE', DEFAULT_DB_ALIAS)
+    return alias if alias in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+class ActivityLogRouter:
+
+    def _is_routed(self, model):
+        return (model._meta.app_label, model._meta.model_name) in ROUTED_MODELS
+
+    def db_for_read(self, model, **hints):
+        if self._is_routed(model):
+            return log_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Foreign keys can not cross databases
+        if self._is_routed(type(obj1)) != self._is_routed(type(obj2)):
+            return log_database() == DEFAULT_DB_ALIAS
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = log_database()
+        if alias == DEFAULT_DB_ALIAS:
+            return None
+        if (app_label, model_name) in ROUTED_MODELS:
+            return db == alias
+        if db == alias:
+            return False
+        return None
+
+
+"""
+Read replicas (DATABASE_READ_REPLICAS). Only reads inside replica_reads() go
+to a replica: ReplicaMiddleware opens it for the GET requests of
+DATABASE_REPLICA_VIEWS, read_only() pins a single queryset. After a write a
+user stays on the primary for DATABASE_REPLICA_STICKY_SECONDS, long enough
+for the replica to catch up, so their new rows are visible right away.
+"""
+
+_read_alias = ContextVar('kashet_read_alias', default=None)
+_sticky = ContextVar('kashet_sticky_primary', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in getattr(settings, 'DATABASE_READ_REPLICAS', []) if alias in settings.DATABASES]
+
+
+def choose_replica():
+    replicas = replica_aliases()
+    return random.choice(replicas) if replicas else None
+
+
+def reading_from_replica():
+    return _read_alias.get() is not None
+
+
+@contextmanager
+def replica_reads(sticky=False):
+    """Reads of the block go to a replica, or stay on the primary with sticky=True."""
+    alias = None if sticky else choose_replica()
+    alias_token = _read_alias.set(alias)
+    sticky_token = _sticky.set(sticky)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(alias_token)
+        _sticky.reset(sticky_token)
+
+
+def read_only(queryset):
+    """Queryset read from a replica, unless the current user just wrote."""
+    alias = _read_alias.get() or (None if _sticky.get() else choose_replica())
+    return queryset.using(alias) if alias else queryset
+
+
+class ReplicaRouter:
+
+    """Goes after ActivityLogRouter, the log models never reach it."""
+
+    def _databases(self):
+        return {DEFAULT_DB_ALIAS, *replica_aliases()}
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Objects read from a replica are saved on the primary, not where they came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replica_aliases():
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on the primary and its replicas
+        databases = self._databases()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
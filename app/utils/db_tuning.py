@@ -0,0 +1,45 @@
+from django.conf import settings
+
+"""
+PRAGMAs run on every new SQLite connection (connection_created, see app/signals.py).
+With WAL readers no longer wait for the writer, synchronous=NORMAL only syncs on
+checkpoints, busy_timeout makes writers wait for the lock instead of failing
+with "database is locked". Configure with SQLITE_PRAGMAS, {} disables it.
+"""
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000, # ms
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000, # negative is KiB
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_SQLITE_PRAGMAS)
+
+
+def apply_sqlite_pragmas(cursor, pragmas=None):
+    """Runs the PRAGMAs with a DB-API cursor, returns {pragma: value reported by SQLite}."""
+    applied = {}
+    for name, value in (sqlite_pragmas() if pragmas is None else pragmas).items():
+        if not name.replace('_', '').isalnum():
+            raise ValueError(f'Invalid PRAGMA name: {name}')
+        cursor.execute(f'PRAGMA {name} = {value}')
+        row = cursor.fetchone()
+        applied[name] = row[0] if row else value
+    return applied
+
+
+def configure_connection(connection):
+    """connection_created receiver body, only for SQLite."""
+    if connection.vendor != 'sqlite':
+        return
+    # Raw DB-API cursor: not counted in connection.queries nor by the execute wrappers
+    cursor = connection.connection.cursor()
+    try:
+        apply_sqlite_pragmas(cursor)
+    finally:
+        cursor.close()
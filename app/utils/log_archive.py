@@ -0,0 +1,117 @@
+import datetime
+import gzip
+import json
+import os
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+"""
+ActivityLog retention.
+
+Rows older than ACTIVITY_LOG_RETENTION_DAYS are appended to one gzipped JSONL
+file per month (activity-YYYY-MM.jsonl.gz under ACTIVITY_LOG_ARCHIVE_DIR) and
+deleted from the table in chunks, so the hot table only keeps recent activity.
+Every run appends a new gzip member, gzip.open reads them back as one stream.
+python manage.py archive_activity_logs
+python manage.py read_activity_archive 2025-01
+"""
+
+FIELDS = ('id', 'timestamp', 'level', 'action', 'method', 'path', 'ip_address', 'extra_data')
+PREFIX = 'activity-'
+SUFFIX = '.jsonl.gz'
+
+
+def archive_dir():
+    return getattr(settings, 'ACTIVITY_LOG_ARCHIVE_DIR', os.path.join(settings.LOG_DIRS, 'activity_archive'))
+
+
+def archive_path(month):
+    """month: 'YYYY-MM'"""
+    return os.path.join(archive_dir(), f'{PREFIX}{month}{SUFFIX}')
+
+
+def month_key(timestamp):
+    return timezone.localtime(timestamp).strftime('%Y-%m')
+
+
+def available_months():
+    if not os.path.isdir(archive_dir()):
+        return []
+    return sorted(
+        name[len(PREFIX):-len(SUFFIX)] for name in os.listdir(archive_dir())
+        if name.startswith(PREFIX) and name.endswith(SUFFIX)
+    )
+
+
+def cutoff_for(days=None):
+    if days is None:
+        days = getattr(settings, 'ACTIVITY_LOG_RETENTION_DAYS', 90)
+    return timezone.now() - datetime.timedelta(days=days)
+
+
+def _serialize(row):
+    row = dict(row)
+    row['timestamp'] = row['timestamp'].isoformat()
+    return json.dumps(row, ensure_ascii=False, default=str)
+
+
+def _write_months(rows):
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_key(row['timestamp']), []).append(row)
+    os.makedirs(archive_dir(), exist_ok=True)
+    for month, month_rows in by_month.items():
+        with gzip.open(archive_path(month), 'at', encoding='utf-8') as archive:
+            archive.writelines(_serialize(row) + '\n' for row in month_rows)
+    return {month: len(month_rows) for month, month_rows in by_month.items()}
+
+
+def archive_activity_logs(days=None, chunk_size=5000, dry_run=False):
+    """
+    Move rows older than the retention window to the monthly archives.
+    Returns {month: archived rows}. A chunk is written to disk before it is
+    deleted, an interrupted run can only duplicate lines, never lose them.
+    """
+    from app.models import ActivityLog
+
+    pending = ActivityLog.objects.filter(timestamp__lt=cutoff_for(days)).order_by('timestamp', 'id')
+    if dry_run:
+        totals = {}
+        for timestamp in pending.values_list('timestamp', flat=True).iterator(chunk_size=chunk_size):
+            month = month_key(timestamp)
+            totals[month] = totals.get(month, 0) + 1
+        return totals
+
+    totals = {}
+    while True:
+        rows = list(pending.values(*FIELDS)[:chunk_size])
+        if not rows:
+            break
+        for month, count in _write_months(rows).items():
+            totals[month] = totals.get(month, 0) + count
+        with transaction.atomic(using=router.db_for_write(ActivityLog)):
+            ActivityLog.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return totals
+
+
+def read_archive(month, level=None, path=None, search=None, since=None, until=None):
+    """Yield the archived rows (dicts) of one month matching the filters."""
+    file_path = archive_path(month)
+    if not os.path.exists(file_path):
+        return
+    search = search.lower() if search else None
+    with gzip.open(file_path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            row = json.loads(line)
+            if level and row['level'] != level:
+                continue
+            if path and not (row['path'] or '').startswith(path):
+                continue
+            if search and search not in (row['action'] or '').lower():
+                continue
+            if since or until:
+                timestamp = datetime.datetime.fromisoformat(row['timestamp'])
+                if (since and timestamp < since) or (until and timestamp >= until):
+                    continue
+            yield row
@@ -1,4 +1,15 @@
+import atexit
+import copy
+import datetime
+import gzip
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+from queue import Queue
 
 class DatabaseLogHandler(logging.Handler):
 
@@ -10,9 +21,9 @@ class DatabaseLogHandler(logging.Handler):
         try:
             #user = getattr(record, 'user', None)
             from django.utils.timezone import now
-            from app.models import ActivityLog
-            
-            ActivityLog.objects.create(
+            from app.utils.log_writer import activity_log_writer
+
+            activity_log_writer.enqueue(
                 #user = user if user and hasattr(user, 'is_authenticated') and user.is_authenticated else None,
                 level = record.levelname,
                 action = record.levelname,
@@ -21,4 +32,135 @@ class DatabaseLogHandler(logging.Handler):
                 timestamp = now(),
             )
         except Exception as e:
-            print(f"Error : {e}")
\ No newline at end of file
+            print(f"Error : {e}")
+
+
+"""
+Non blocking file logging: request threads only put records in the queue of
+QueueLogHandler, its QueueListener thread (started from AppConfig.ready) writes
+JSON lines with the rotating handlers below, rotated files are gzipped in a
+background thread.
+"""
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+
+    """
+    QueueHandler that never blocks nor prints when its bounded queue is full,
+    records are dropped and counted instead.
+
+    Configured with "()" rather than "class" so dictConfig doesn't apply its
+    own QueueHandler handling (Python 3.12+). handlers lists the targets as
+    cfg://handlers.<name>, dictConfig builds handlers in name order so their
+    names must sort before this one. start_log_listeners() starts the listener.
+    """
+    dropped = 0
+
+    def __init__(self, queue=None, handlers=(), respect_handler_level=False, maxsize=0):
+        super().__init__(queue if queue is not None else Queue(maxsize))
+        # Indexing makes dictConfig resolve the cfg:// references
+        self.targets = [handlers[i] for i in range(len(handlers))]
+        for target in self.targets:
+            if not isinstance(target, logging.Handler):
+                raise ValueError(f'Target handler {target!r} is not configured yet, its name must sort first')
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+
+    def prepare(self, record):
+        # Only primitives cross to the listener thread, the traceback is kept apart for JsonFormatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        if getattr(record, 'user', None) is not None:
+            record.user = str(record.user)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            QueueLogHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+
+    """One JSON object per line."""
+    EXTRA_FIELDS = ('user', 'path', 'method', 'extra_data')
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class BackgroundGzipMixin:
+
+    """Rotated files are named *.gz and compressed outside the logging thread."""
+    _compressing = None
+
+    def namer(self, default_name):
+        return default_name + '.gz'
+
+    def rotator(self, source, dest):
+        if not os.path.exists(source):
+            return
+        plain = dest[:-len('.gz')]
+        os.replace(source, plain)
+        self._compressing = threading.Thread(
+            target=self._compress, args=(plain, dest), name='log-gzip', daemon=True
+        )
+        self._compressing.start()
+
+    @staticmethod
+    def _compress(plain, dest):
+        with open(plain, 'rb') as source, gzip.open(dest, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(plain)
+
+    def doRollover(self):
+        # The previous archive must be complete before the backups are shifted
+        if self._compressing is not None:
+            self._compressing.join()
+        super().doRollover()
+
+
+class GzipRotatingFileHandler(BackgroundGzipMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class GzipTimedRotatingFileHandler(BackgroundGzipMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+def start_log_listeners():
+    """Start once the QueueListener of every QueueLogHandler attached to a logger."""
+    loggers = [logging.getLogger()] + [
+        logger for logger in list(logging.root.manager.loggerDict.values()) if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if not isinstance(handler, QueueLogHandler) or not handler.targets or handler.listener is not None:
+                continue
+            handler.listener = logging.handlers.QueueListener(
+                handler.queue, *handler.targets, respect_handler_level=handler.respect_handler_level
+            )
+            handler.listener.start()
+            atexit.register(handler.listener.stop)
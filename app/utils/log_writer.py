@@ -0,0 +1,188 @@
+import atexit
+import logging
+import queue
+import threading
+from django.conf import settings
+from django.db import connections
+from django.utils.timezone import now
+
+"""
+Buffered writer of ActivityLog rows.
+
+Request threads only put a dict in a bounded queue, a daemon thread
+bulk_creates them when BATCH_SIZE rows are waiting or every FLUSH_INTERVAL
+seconds, and the queue is drained on interpreter exit. When the queue is full
+or a bulk insert fails the rows are dropped and counted, the flusher reports
+the counters. Per minute request counters (ActivityCounter) are summed in
+memory and upserted once per flush, whatever the traffic, a failed upsert
+keeps them for the next one, up to max_pending_counters buckets: past that the
+oldest minutes are dropped and counted, so a database that stays down can't
+fill the memory.
+With ACTIVITY_LOG_ASYNC = False every row is written right away (tests).
+"""
+
+# Not under "app": its db handler would feed this same queue
+logger = logging.getLogger('kashet.activity_log')
+
+
+class ActivityLogWriter:
+
+    def __init__(self, max_size=10000, batch_size=200, flush_interval=1.0, max_pending_counters=50000):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_counters = max_pending_counters
+        self.flushed = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enqueue(self, **fields):
+        fields.setdefault('timestamp', now())
+        if not getattr(settings, 'ACTIVITY_LOG_ASYNC', True):
+            self._write([fields])
+            return
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(fields)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def count_request(self, view_name, method, status, latency):
+        """Add one request (latency in ms) to its minute bucket."""
+        from app.models import ActivityCounter
+
+        key = (ActivityCounter.minute_of(now()), view_name[:255], method, status)
+        with self._lock:
+            count, total = self.counters.get(key, (0, 0.0))
+            self.counters[key] = (count + 1, total + latency)
+        if not getattr(settings, 'ACTIVITY_LOG_ASYNC', True):
+            self.flush_counters()
+            return
+        self._ensure_started()
+
+    def flush_counters(self):
+        from app.models import ActivityCounter
+
+        with self._lock:
+            counters, self.counters = self.counters, {}
+        try:
+            ActivityCounter.upsert(counters)
+        except Exception:
+            logger.exception("ActivityCounter upsert failed, %s buckets kept for the next flush", len(counters))
+            # Put back, adding what was counted in the meantime
+            with self._lock:
+                for key, (count, total) in counters.items():
+                    current_count, current_total = self.counters.get(key, (0, 0.0))
+                    self.counters[key] = (current_count + count, current_total + total)
+                dropped = self._trim_counters()
+            if dropped:
+                logger.warning(
+                    "ActivityCounter: %s pending buckets over %s, %s requests of the oldest minutes dropped",
+                    dropped[0], self.max_pending_counters, dropped[1],
+                )
+
+    def _trim_counters(self):
+        """Drop the oldest buckets over max_pending_counters, with the lock held."""
+        excess = len(self.counters) - self.max_pending_counters
+        if excess <= 0:
+            return None
+        oldest = sorted(self.counters, key=lambda key: key[0])[:excess]
+        requests = sum(self.counters.pop(key)[0] for key in oldest)
+        self.dropped += requests
+        return excess, requests
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='activity-log-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _take_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                batch = self._take_batch(self.flush_interval)
+                if batch:
+                    self._write(batch)
+                self.flush_counters()
+                self._report_overflow()
+            self.flush()
+        finally:
+            connections.close_all()
+
+    def _write(self, rows):
+        from app.models import ActivityLog
+
+        try:
+            ActivityLog.objects.bulk_create([ActivityLog(**row) for row in rows], batch_size=self.batch_size)
+        except Exception:
+            logger.exception("ActivityLog bulk insert failed, %s rows dropped", len(rows))
+            with self._lock:
+                self.dropped += len(rows)
+            return
+        with self._lock:
+            self.flushed += len(rows)
+
+    def _report_overflow(self):
+        with self._lock:
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        if dropped:
+            logger.warning(
+                "ActivityLog: %s rows dropped (%s dropped, %s flushed in total)",
+                dropped, self.dropped, self.flushed,
+            )
+
+    def flush(self):
+        """Write everything waiting in the queue from the calling thread."""
+        while True:
+            batch = self._take_batch(timeout=0)
+            if not batch:
+                break
+            self._write(batch)
+        self.flush_counters()
+
+    def stop(self, timeout=5):
+        """Stop the flusher and drain the queue."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self.flush()
+        self._report_overflow()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self.queue.qsize(),
+                'flushed': self.flushed,
+                'dropped': self.dropped,
+            }
+
+
+activity_log_writer = ActivityLogWriter(
+    max_size=getattr(settings, 'ACTIVITY_LOG_QUEUE_SIZE', 10000),
+    batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 200),
+    flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 1.0),
+    max_pending_counters=getattr(settings, 'ACTIVITY_LOG_MAX_PENDING_COUNTERS', 50000),
+)
+atexit.register(activity_log_writer.stop)
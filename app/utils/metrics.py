@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+from django.template.backends.django import DjangoTemplates
+
+"""
+In process request metrics per view, filled by app.middleware.metrics and
+exported in Prometheus text format by the /metrics view.
+
+Every worker process keeps its own registry; one lock guards the updates,
+a request costs a few dict lookups and additions.
+"""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+# Template time of the request running in each thread, see TimedDjangoTemplates
+_local = threading.local()
+
+
+class Histogram:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+
+    HISTOGRAMS = {
+        'kashet_request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+        'kashet_db_queries_per_request': ('Database queries per request', QUERY_BUCKETS),
+        'kashet_response_size_bytes': ('Response body size', SIZE_BUCKETS),
+    }
+    COUNTERS = {
+        'kashet_requests_total': 'Requests by view, method and status',
+        'kashet_db_query_seconds_total': 'Time spent in database queries',
+        'kashet_template_render_seconds_total': 'Time spent rendering templates',
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {name: {} for name in self.HISTOGRAMS}
+            self.counters = {name: {} for name in self.COUNTERS}
+
+    def _observe(self, name, labels, value):
+        series = self.histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram(self.HISTOGRAMS[name][1])
+        histogram.observe(value)
+
+    def _add(self, name, labels, value):
+        series = self.counters[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def record(self, view, method, status, latency, queries, db_time, template_time, size=None):
+        labels = (('view', view), ('method', method))
+        with self._lock:
+            self._observe('kashet_request_duration_seconds', labels, latency)
+            self._observe('kashet_db_queries_per_request', labels, queries)
+            if size is not None:
+                self._observe('kashet_response_size_bytes', labels, size)
+            self._add('kashet_requests_total', labels + (('status', str(status)),), 1)
+            self._add('kashet_db_query_seconds_total', labels, db_time)
+            self._add('kashet_template_render_seconds_total', labels, template_time)
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {total}')
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            for name, help_text in self.COUNTERS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def start_template_timer():
+    _local.template_time = 0.0
+
+
+def template_time():
+    return getattr(_local, 'template_time', 0.0)
+
+
+class TimedTemplate:
+
+    """Backend template wrapper adding its render time to the current request."""
+
+    def __init__(self, template):
+        self.wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.wrapped.render(context, request)
+        finally:
+            _local.template_time = template_time() + time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+
+    """DjangoTemplates backend whose templates report their render time."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
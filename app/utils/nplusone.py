@@ -0,0 +1,98 @@
+import logging
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+from app.utils.slow_queries import fingerprint, app_frame, SKIP_FILES
+
+"""
+N+1 detection: SELECT fingerprints repeated more than NPLUSONE_THRESHOLD
+times in one request (NPlusOneMiddleware) or one block of a test
+(NPlusOneTestMixin.assertNoNPlusOne) are reported with the template line or
+the app/ frame that ran the first of them.
+NPLUSONE_MODE: 'warn' logs to kashet.nplusone, 'raise' raises NPlusOneError,
+None disables the middleware.
+"""
+
+logger = logging.getLogger('kashet.nplusone')
+SKIP = SKIP_FILES + (os.path.abspath(__file__),)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def template_frame():
+    """Innermost template node being rendered, as 'app/budgets/budget.html:12'."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            context = frame.f_locals.get('context')
+            token = getattr(node, 'token', None)
+            template = getattr(context, 'template', None)
+            if token is not None and template is not None:
+                return f'{template.origin.template_name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryRepetitionTracker:
+
+    """execute_wrapper counting SELECT fingerprints and the origin of their first run."""
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or getattr(settings, 'NPLUSONE_THRESHOLD', 5)
+        self.counts = {}
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip()[:6].upper() == 'SELECT':
+            key = fingerprint(sql)
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            if count == 1:
+                self.origins[key] = template_frame() or app_frame(SKIP)
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """[(fingerprint, count, origin)] over the threshold, most repeated first."""
+        hits = [
+            (key, count, self.origins[key]) for key, count in self.counts.items()
+            if count > self.threshold
+        ]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)
+
+    def report(self, where):
+        return '\n'.join(
+            [f'N+1 queries in {where}:'] +
+            [f'  {count}x at {origin or "unknown"}: {key[:300]}' for key, count, origin in self.repeated()]
+        )
+
+    def check(self, where, mode='raise'):
+        if not self.repeated():
+            return
+        if mode == 'raise':
+            raise NPlusOneError(self.report(where))
+        logger.warning(self.report(where))
+
+
+class NPlusOneTestMixin:
+
+    """
+    TestCase mixin, requests through the test client are already checked by
+    NPlusOneMiddleware (NPLUSONE_MODE = 'raise' under tests), this covers any block:
+
+        with self.assertNoNPlusOne():
+            render_to_string(...)
+    """
+
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=None):
+        tracker = QueryRepetitionTracker(threshold)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(tracker))
+            yield tracker
+        tracker.check(self.id(), 'raise')
@@ -0,0 +1,140 @@
+import base64
+from datetime import datetime
+from django.db.models import Q, Subquery
+from django.http import Http404
+from django.utils.translation import gettext as translate
+
+
+class CursorPage:
+    """Page of a keyset paginated list, it only knows its neighbours."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise Http404(translate("Cursor de pagina invalido."))
+
+
+def partitioned_slice(queryset, field, values, ordering, limit, base=None):
+    """
+    First `limit` rows of queryset ordered by (created_at, id) in a single
+    statement. Each value of `field` contributes the ids of its own first
+    `limit` rows, read as one indexed range, and only those candidates are
+    fetched by primary key and sorted. A plain `field IN (...)` would make
+    SQLite sort the whole scope with a temp B-tree.
+
+    `base` is what the candidates are fetched from: the same model with the
+    select_related, annotations, ... of queryset but none of its filters,
+    which the candidates already passed. Without it they are fetched from
+    queryset, filters included, and SQLite may sort the scope again.
+    """
+    if values is None:
+        return list(queryset.order_by(*ordering)[:limit])
+    if len(values) <= 1:
+        return list(queryset.filter(**{f'{field}__in': values}).order_by(*ordering)[:limit])
+    candidates = Q()
+    for value in values:
+        head = queryset.filter(**{field: value}).order_by(*ordering).values('pk')[:limit]
+        candidates |= Q(pk__in=Subquery(head))
+    rows = queryset if base is None else base
+    return list(rows.filter(candidates).order_by(*ordering)[:limit])
+
+
+class CursorPaginationMixin:
+    """
+    Keyset pagination over (created_at, id) for ListView, newest first.
+
+    ?after=<cursor> reads the page following a row and ?before=<cursor> the one
+    preceding it, so every page costs one indexed range read whatever its
+    depth. The exact total runs a COUNT(*) only when asked with ?count=1,
+    views can override get_total_count with a cheaper source.
+
+    Views scoped to several departments return them from
+    get_cursor_partitions so each one is read through its own index range,
+    and from get_cursor_base_queryset the unfiltered queryset the page rows
+    are fetched from (see partitioned_slice).
+    """
+    ordering = ('-created_at', '-id')
+    cursor_partition_field = 'department'
+
+    def get_cursor_partitions(self):
+        return None
+
+    def get_cursor_base_queryset(self):
+        return None
+
+    def get_total_count(self, queryset):
+        if self.request.GET.get('count') == '1':
+            return queryset.count()
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+
+        partitions = self.get_cursor_partitions()
+        field = self.cursor_partition_field
+        base = self.get_cursor_base_queryset()
+
+        if before:
+            created_at, pk = decode_cursor(before)
+            rows = partitioned_slice(
+                queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)),
+                field, partitions, ('created_at', 'id'), page_size + 1, base=base
+            )
+            has_previous = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next = True
+        else:
+            if after:
+                created_at, pk = decode_cursor(after)
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            rows = partitioned_slice(queryset, field, partitions, self.ordering, page_size + 1, base=base)
+            has_next = len(rows) > page_size
+            rows = rows[:page_size]
+            has_previous = bool(after)
+
+        page = CursorPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if has_next and rows else None,
+            previous_cursor=encode_cursor(rows[0]) if has_previous and rows else None,
+        )
+        return None, page, rows, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Filters kept by the pager links
+        params = self.request.GET.copy()
+        for key in ('after', 'before', 'page'):
+            params.pop(key, None)
+        context['pager_query'] = params.urlencode()
+        context['total_count'] = self.get_total_count(self.object_list)
+        return context
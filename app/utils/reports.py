@@ -0,0 +1,61 @@
+from django.db.models import Sum, Q
+from django.utils import timezone
+from app.models import BillMonthlyRollup, DepartmentBalance
+
+REPORT_PERIODS = {
+    '1': 1,
+    '3': 3,
+    '12': 12,
+}
+
+
+def first_month(months, today=None):
+    """First day of the oldest month in a window of `months` months ending today."""
+    today = today or timezone.localdate()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return today.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def build_bills_report(department_ids, months, department_id=None):
+    """
+    Reports context read from BillMonthlyRollup, the cost depends on the number
+    of buckets in the window and not on the size of the Bill table.
+    department_ids None means every department (superuser).
+    """
+    rollups = BillMonthlyRollup.objects.filter(month__gte=first_month(months))
+    balances = DepartmentBalance.objects.all()
+    if department_ids is not None:
+        rollups = rollups.filter(department_id__in=department_ids)
+        balances = balances.filter(department_id__in=department_ids)
+    if department_id:
+        rollups = rollups.filter(department_id=department_id)
+        balances = balances.filter(department_id=department_id)
+
+    totals = {
+        'amount': Sum('total'),
+        'records': Sum('count'),
+        'pending': Sum('total', filter=Q(status__enable=False)),
+    }
+    by_department = list(
+        rollups.order_by('department__name')
+        .values('department_id', 'department__name')
+        .annotate(**totals)
+    )
+    by_month = list(rollups.order_by('-month').values('month').annotate(**totals))
+    by_category = list(
+        rollups.values('category_id', 'category__name')
+        .annotate(amount=Sum('total'), records=Sum('count'))
+        .order_by('-amount')
+    )
+    summary = rollups.aggregate(**totals)
+    balance = balances.aggregate(budgets=Sum('total_budgets'), bills=Sum('total_bills'))
+
+    return {
+        'by_department': by_department,
+        'by_month': by_month,
+        'by_category': by_category,
+        'report_total': summary['amount'] or 0,
+        'report_count': summary['records'] or 0,
+        'report_pending': summary['pending'] or 0,
+        'remaining_capital': (balance['budgets'] or 0) - (balance['bills'] or 0),
+    }
@@ -0,0 +1,202 @@
+import re
+import unicodedata
+from django.db import connection
+from django.db.models import Q
+
+"""
+Full text search over budgets and bills with a SQLite FTS5 table, or on
+PostgreSQL a table with a weighted tsvector column and a GIN index.
+
+Each row holds the title, description, department and category names of one
+Budget or Bill. The rowid encodes the object (id * 2 for budgets, id * 2 + 1
+for bills) so updates and deletes are primary key operations. The table is
+created on post_migrate and kept in sync from signals.py, rebuild it with:
+python manage.py rebuild_search_index
+"""
+
+TABLE = 'app_search_index'
+KINDS = ('budget', 'bill')
+# bm25 weights: kind, object_id, department_id, title, description, department, category
+WEIGHTS = (0, 0, 0, 10.0, 2.0, 3.0, 3.0)
+TOKEN = re.compile(r'\w+', re.UNICODE)
+BACKENDS = ('sqlite', 'postgresql')
+# PostgreSQL: tsvector weights, ts_rank gives A 1.0, B 0.4, C 0.2
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', %s), 'A') || "
+    "setweight(to_tsvector('simple', %s), 'C') || "
+    "setweight(to_tsvector('simple', %s || ' ' || %s), 'B')"
+)
+
+
+def is_available(using=None):
+    return (using or connection).vendor in BACKENDS
+
+
+def create_index(using=None):
+    using = using or connection
+    if not is_available(using):
+        return
+    with using.cursor() as cursor:
+        if using.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+                "rowid bigint PRIMARY KEY, kind varchar(8) NOT NULL, object_id bigint NOT NULL, "
+                "department_id bigint NOT NULL, title text, description text, department text, category text, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING GIN (document)")
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "kind UNINDEXED, object_id UNINDEXED, department_id UNINDEXED, "
+            "title, description, department, category, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+
+def fold(text):
+    """Lowercase without diacritics, as FTS5 remove_diacritics (PostgreSQL has no unaccent by default)."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def rowid_for(kind, object_id):
+    return object_id * 2 + KINDS.index(kind)
+
+
+def _kind(instance):
+    return 'bill' if instance.ledger_kind == 'bills' else 'budget'
+
+
+def _row(instance, department_name=None, category_name=None):
+    if department_name is None:
+        department_name = instance.department.name
+    category = getattr(instance, 'category', None)
+    if category_name is None:
+        category_name = category.name if category else ''
+    kind = _kind(instance)
+    return (
+        rowid_for(kind, instance.pk), kind, instance.pk, instance.department_id,
+        instance.title, instance.description, department_name, category_name,
+    )
+
+
+def index_objects(instances, **names):
+    if not is_available():
+        return
+    rows = [_row(instance, **names) for instance in instances]
+    if not rows:
+        return
+    columns = 'rowid, kind, object_id, department_id, title, description, department, category'
+    values = ', '.join(['%s'] * 8)
+    if connection.vendor == 'postgresql':
+        columns += ', document'
+        values += f', {PG_DOCUMENT}'
+        rows = [row + tuple(fold(text) for text in row[4:]) for row in rows]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {TABLE} ({columns}) VALUES ({values})", rows)
+
+
+def remove_object(instance):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [rowid_for(_kind(instance), instance.pk)])
+
+
+def reindex_queryset(queryset, chunk_size=2000, **names):
+    """Index every object of a Budget/Bill queryset in chunks, returns the count."""
+    related = ['department', 'category'] if queryset.model.ledger_kind == 'bills' else ['department']
+    total = 0
+    chunk = []
+    for instance in queryset.select_related(*related).iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            index_objects(chunk, **names)
+            total += len(chunk)
+            chunk = []
+    index_objects(chunk, **names)
+    return total + len(chunk)
+
+
+def clear_index():
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+
+def build_match(text):
+    """User text to an FTS5 query, every word must match as a prefix."""
+    tokens = TOKEN.findall(text or '')
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+def build_tsquery(text):
+    """Same as build_match for PostgreSQL to_tsquery."""
+    tokens = TOKEN.findall(fold(text))
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def search(text, department_ids=None, kind=None, limit=20, offset=0):
+    """
+    Ranked (kind, object_id) pairs matching text, best first.
+    department_ids None means every department (superuser).
+    """
+    if department_ids is not None and not department_ids:
+        return []
+    if not is_available():
+        return _fallback_search(text, department_ids, kind, limit, offset)
+    postgresql = connection.vendor == 'postgresql'
+    match = build_tsquery(text) if postgresql else build_match(text)
+    if not match:
+        return []
+
+    if postgresql:
+        where = ["document @@ to_tsquery('simple', %s)"]
+        order = "ts_rank(document, to_tsquery('simple', %s)) DESC, rowid DESC"
+        order_params = [match]
+    else:
+        weights = ', '.join(str(weight) for weight in WEIGHTS)
+        where = [f"{TABLE} MATCH %s"]
+        order = f"bm25({TABLE}, {weights})"
+        order_params = []
+    params = [match]
+    if kind:
+        where.append("kind = %s")
+        params.append(kind)
+    if department_ids is not None:
+        where.append(f"department_id IN ({', '.join(['%s'] * len(department_ids))})")
+        params.extend(department_ids)
+
+    sql = (
+        f"SELECT kind, object_id FROM {TABLE} WHERE {' AND '.join(where)} "
+        f"ORDER BY {order} LIMIT %s OFFSET %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + order_params + [limit, offset])
+        return [(row[0], int(row[1])) for row in cursor.fetchall()]
+
+
+def _fallback_search(text, department_ids, kind, limit, offset):
+    """Plain LIKE search, newest first, for databases without full text search."""
+    from app.models import Budget, Bill
+
+    tokens = TOKEN.findall(text or '')
+    if not tokens:
+        return []
+    condition = Q()
+    for token in tokens:
+        condition &= Q(title__icontains=token) | Q(description__icontains=token)
+    if department_ids is not None:
+        condition &= Q(department__in=department_ids)
+
+    hits = []
+    for name, model in (('budget', Budget), ('bill', Bill)):
+        if kind and kind != name:
+            continue
+        rows = model.objects.filter(condition).order_by('-created_at').values_list('created_at', 'id')
+        hits.extend((created_at, name, pk) for created_at, pk in rows[:offset + limit])
+    hits.sort(reverse=True)
+    return [(name, pk) for _, name, pk in hits[offset:offset + limit]]
@@ -0,0 +1,144 @@
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from django.conf import settings
+
+"""
+Opt-in slow query log (SLOW_QUERY_LOG = True).
+
+SlowQueryMiddleware wraps every connection of the request with
+slow_query_wrapper. Queries slower than SLOW_QUERY_THRESHOLD_MS are written to
+the "kashet.slow_queries" log stream (logs/slow_queries.log) with their SQL,
+parameters shape, duration, view and the first stack frame inside app/, and
+are aggregated by SQL fingerprint for the staff page /slow_queries/.
+The stack is only walked for the slow queries.
+"""
+
+logger = logging.getLogger('kashet.slow_queries')
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames of the instrumentation itself are never the call site
+SKIP_FILES = (os.path.abspath(__file__), os.path.join(APP_DIR, 'middleware'))
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDERS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL without literals, IN lists collapsed, so equal queries group together."""
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = PLACEHOLDERS.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+def params_shape(params, many):
+    if many:
+        params = list(params or [])
+        first = params_shape(params[0], False) if params else '()'
+        return f'{len(params)} x {first}'
+    if params is None:
+        return '()'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+
+
+def app_frame(skip=SKIP_FILES):
+    """First frame from app/ (innermost first) outside skip, as 'app/views.py:73 in resume_budget'."""
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(APP_DIR) and not filename.startswith(skip):
+            path = os.path.relpath(filename, os.path.dirname(APP_DIR))
+            return f'{path}:{frame.lineno} in {frame.name}'
+    return None
+
+
+class SlowQueryStats:
+
+    """Captures of this process aggregated by fingerprint, at most max_fingerprints."""
+
+    def __init__(self, max_fingerprints=500):
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.entries = {}
+            self.dropped = 0
+
+    def add(self, capture):
+        key = capture['fingerprint']
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_fingerprints:
+                    self.dropped += 1
+                    return
+                entry = self.entries[key] = {
+                    'fingerprint': key, 'sql': capture['sql'], 'count': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'views': {}, 'frames': {},
+                }
+            entry['count'] += 1
+            entry['total_ms'] += capture['duration_ms']
+            if capture['duration_ms'] >= entry['max_ms']:
+                entry['max_ms'] = capture['duration_ms']
+                entry['sql'] = capture['sql']
+            for field, name in (('views', capture['view']), ('frames', capture['frame'])):
+                entry[field][name] = entry[field].get(name, 0) + 1
+
+    def summary(self):
+        """Entries sorted by total time, with their average."""
+        with self._lock:
+            entries = [dict(entry, views=dict(entry['views']), frames=dict(entry['frames'])) for entry in self.entries.values()]
+        for entry in entries:
+            entry['avg_ms'] = entry['total_ms'] / entry['count']
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+
+stats = SlowQueryStats()
+
+
+def threshold():
+    return getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100) / 1000
+
+
+def slow_query_wrapper(get_view_name):
+    """execute_wrapper capturing queries over the threshold, get_view_name is called only for those."""
+    limit = threshold()
+
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if duration >= limit:
+                capture(sql, params, many, duration, get_view_name(), context['connection'].alias)
+
+    return wrapper
+
+
+def capture(sql, params, many, duration, view, alias='default'):
+    data = {
+        'sql': sql,
+        'fingerprint': fingerprint(sql),
+        'params': params_shape(params, many),
+        'duration_ms': round(duration * 1000, 3),
+        'view': view,
+        'frame': app_frame(),
+        'database': alias,
+    }
+    stats.add(data)
+    logger.warning(
+        "Slow query %.1f ms in %s at %s: %s", data['duration_ms'], view, data['frame'], data['fingerprint'],
+        extra={"extra_data": data},
+    )
+    return data
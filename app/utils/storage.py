@@ -0,0 +1,82 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.db import router, transaction
+from app.models import FileBlob
+
+"""
+Content addressed storage for BudgetFile and BillFile: an upload is hashed
+(SHA-256) while it is streamed to a temporary file, then kept once under
+blobs/<aa>/<bb>/<hash><ext>. The same invoice attached to many bills is one
+file on disk, FileBlob counts its references and signals.py removes it
+with the last one. Files saved before keep their budgets/<id>/ paths.
+
+The reference of a new upload is counted here, under the FileBlob row lock
+and before deciding whether the content is already stored, so a concurrent
+FileBlob.collect of the same content either runs first or sees it in use.
+BudgetFile and BillFile save in the same transaction, so a failed insert
+rolls the reference back. Saved straight through the storage, outside a
+model, the file keeps its reference until rebuild_file_references.
+"""
+
+EXTENSION = re.compile(r'\.[a-z0-9]{1,10}')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    # signals.py does not count the uploads stored here a second time
+    counts_references = True
+    prefix = 'blobs'
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is the hash of the content, chosen in _save
+        return name
+
+    def blob_name(self, digest, name):
+        extension = os.path.splitext(name)[1].lower()
+        if not EXTENSION.fullmatch(extension):
+            extension = ''
+        return f'{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        directory = self.path(f'{self.prefix}/tmp')
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    target.write(chunk)
+            blob = self.blob_name(digest.hexdigest(), name)
+            path = self.path(blob)
+            with transaction.atomic(using=router.db_for_write(FileBlob)):
+                FileBlob.acquire(blob, os.path.getsize(temporary))
+                if os.path.exists(path):
+                    # Same content already stored
+                    os.remove(temporary)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(temporary, self.file_permissions_mode)
+                    os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return blob
+
+    def delete(self, name):
+        """Removes the file and the folders it leaves empty (hash shards or the old budgets/<id>/)."""
+        super().delete(name)
+        folder = os.path.dirname(name)
+        # The top folder (blobs, budgets, bills) stays
+        while os.path.dirname(folder):
+            try:
+                os.rmdir(self.path(folder))
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
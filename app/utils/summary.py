@@ -0,0 +1,97 @@
+from collections import defaultdict
+from django.db.models import Sum, Count
+from app.models import TypeTransaction, StatusTransaction
+
+
+def _grouped_totals(queryset):
+    """
+    One GROUP BY over (department, type, status) returning the sum and count of
+    every combination. The number of rows depends on the catalog sizes, not on
+    the number of budgets/bills.
+    """
+    return (
+        queryset
+        .order_by()
+        .values('department_id', 'type_id', 'status_id')
+        .annotate(total=Sum('total_mount'), count=Count('id'))
+    )
+
+
+def _fold(rows, key):
+    totals = defaultdict(lambda: {'total': 0, 'count': 0})
+    for row in rows:
+        bucket = totals[row[key]]
+        bucket['total'] += row['total'] or 0
+        bucket['count'] += row['count']
+    return totals
+
+
+def build_budget_summary(departments, budgets, bills):
+    """
+    Build the resume_budget context with a fixed number of queries regardless
+    of how many departments the user can see.
+    """
+    departments = list(departments)
+    budget_rows = list(_grouped_totals(budgets))
+    bill_rows = list(_grouped_totals(bills))
+
+    budgets_by_dept = _fold(budget_rows, 'department_id')
+    bills_by_dept = _fold(bill_rows, 'department_id')
+    budgets_by_type = _fold(budget_rows, 'type_id')
+    bills_by_type = _fold(bill_rows, 'type_id')
+    budgets_by_status = _fold(budget_rows, 'status_id')
+    bills_by_status = _fold(bill_rows, 'status_id')
+
+    total_budgets = sum(row['total'] or 0 for row in budget_rows)
+    total_bills = sum(row['total'] or 0 for row in bill_rows)
+
+    departments_summary = []
+    for dept in departments:
+        dept_budgets = budgets_by_dept[dept.id]
+        dept_bills = bills_by_dept[dept.id]
+        departments_summary.append({
+            'department': dept,
+            'total_budgets': dept_budgets['total'],
+            'total_bills': dept_bills['total'],
+            'balance': dept_budgets['total'] - dept_bills['total'],
+            'budgets_count': dept_budgets['count'],
+            'bills_count': dept_bills['count'],
+        })
+
+    types_summary = []
+    for type_trans in TypeTransaction.objects.all():
+        type_budgets = budgets_by_type[type_trans.id]['total']
+        type_bills = bills_by_type[type_trans.id]['total']
+
+        if type_budgets > 0 or type_bills > 0:
+            types_summary.append({
+                'type': type_trans,
+                'budgets': type_budgets,
+                'bills': type_bills,
+            })
+
+    status_summary = []
+    for status in StatusTransaction.objects.all():
+        status_budgets = budgets_by_status[status.id]
+        status_bills = bills_by_status[status.id]
+
+        if status_budgets['total'] > 0 or status_bills['total'] > 0:
+            status_summary.append({
+                'status': status,
+                'budgets': status_budgets['total'],
+                'bills': status_bills['total'],
+                'budgets_count': status_budgets['count'],
+                'bills_count': status_bills['count'],
+            })
+
+    return {
+        'total_budgets': total_budgets,
+        'total_bills': total_bills,
+        'balance_general': total_budgets - total_bills,
+        'departments_summary': departments_summary,
+        'types_summary': types_summary,
+        'status_summary': status_summary,
+        'budgets_count': sum(row['count'] for row in budget_rows),
+        'bills_count': sum(row['count'] for row in bill_rows),
+        'departments_count': len(departments),
+    }
@@ -1,23 +1,35 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.conf import settings
 from django.urls import reverse, reverse_lazy
 from .models import (
     Budget, BudgetFile, Bill, BillFile,
-    CategoryBill, Department, TypeTransaction, StatusTransaction
+    CategoryBill, Department, DepartmentBalance
 )
-from django.db.models import Sum
+from django.db.models import Sum, Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from .forms import (
     BudgetForm, BudgetFileForm, BillForm, 
     BillFileForm, CategoryBillForm, DepartmentForm,
     CustomLoginForm
 )
+from .utils.summary import build_budget_summary
+from .utils import dashboard_cache
+from .utils import metrics
+from .utils import slow_queries as slow_query_log
+from .utils import search as search_index
+from .utils.reports import build_bills_report, REPORT_PERIODS
+from .utils.pagination import CursorPaginationMixin, partitioned_slice
 from django.views.generic import CreateView, UpdateView, DeleteView, ListView, DetailView
 from django.contrib import messages
 from django.utils.translation import gettext as translate
 from django.utils.translation import gettext_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 import logging
+import hmac
 
 logger = logging.getLogger("app")
 
@@ -38,85 +50,31 @@ def resume_budget(request):
     
     # Determinar qué departamentos puede ver el usuario
     if user.is_superuser:
+        department_ids = None
         departments = Department.objects.all()
         budgets = Budget.objects.all()
         bills = Bill.objects.all()
     else:
-        departments = user.departments.all()
-        budgets = Budget.objects.filter(department__in=departments)
-        bills = Bill.objects.filter(department__in=departments)
-    
-    # Calcular totales generales
-    total_budgets = budgets.aggregate(total=Sum('total_mount'))['total'] or 0
-    total_bills = bills.aggregate(total=Sum('total_mount'))['total'] or 0
-    balance_general = total_budgets - total_bills
-    
-    # Calcular por departamento
-    departments_summary = []
-    for dept in departments:
-        dept_budgets = budgets.filter(department=dept)
-        dept_bills = bills.filter(department=dept)
-        
-        dept_total_budgets = dept_budgets.aggregate(total=Sum('total_mount'))['total'] or 0
-        dept_total_bills = dept_bills.aggregate(total=Sum('total_mount'))['total'] or 0
-        dept_balance = dept_total_budgets - dept_total_bills
-        
-        departments_summary.append({
-            'department': dept,
-            'total_budgets': dept_total_budgets,
-            'total_bills': dept_total_bills,
-            'balance': dept_balance,
-            'budgets_count': dept_budgets.count(),
-            'bills_count': dept_bills.count(),
-        })
-    
-    # Calcular por tipo de transacción
-    types_summary = []
-    for type_trans in TypeTransaction.objects.all():
-        type_budgets = budgets.filter(type=type_trans).aggregate(total=Sum('total_mount'))['total'] or 0
-        type_bills = bills.filter(type=type_trans).aggregate(total=Sum('total_mount'))['total'] or 0
-        
-        if type_budgets > 0 or type_bills > 0:
-            types_summary.append({
-                'type': type_trans,
-                'budgets': type_budgets,
-                'bills': type_bills,
-            })
-    
-    # Calcular por estado
-    status_summary = []
-    for status in StatusTransaction.objects.all():
-        status_budgets = budgets.filter(status=status).aggregate(total=Sum('total_mount'))['total'] or 0
-        status_bills = bills.filter(status=status).aggregate(total=Sum('total_mount'))['total'] or 0
-        status_count_budgets = budgets.filter(status=status).count()
-        status_count_bills = bills.filter(status=status).count()
-        
-        if status_budgets > 0 or status_bills > 0:
-            status_summary.append({
-                'status': status,
-                'budgets': status_budgets,
-                'bills': status_bills,
-                'budgets_count': status_count_budgets,
-                'bills_count': status_count_bills,
-            })
+        department_ids = list(user.departments.values_list('id', flat=True))
+        departments = Department.objects.filter(id__in=department_ids)
+        budgets = Budget.objects.filter(department__in=department_ids)
+        bills = Bill.objects.filter(department__in=department_ids)
     
+    # Totales por departamento, tipo y estado en consultas agrupadas,
+    # compartidos en cache por los usuarios con los mismos departamentos
+    context = dashboard_cache.get_summary(
+        department_ids, lambda: build_budget_summary(departments, budgets, bills)
+    )
+
     # Últimos registros
-    recent_budgets = budgets.order_by('-created_at')[:5]
-    recent_bills = bills.order_by('-created_at')[:5]
-    
-    context = {
-        'total_budgets': total_budgets,
-        'total_bills': total_bills,
-        'balance_general': balance_general,
-        'departments_summary': departments_summary,
-        'types_summary': types_summary,
-        'status_summary': status_summary,
-        'recent_budgets': recent_budgets,
-        'recent_bills': recent_bills,
-        'budgets_count': budgets.count(),
-        'bills_count': bills.count(),
-        'departments_count': departments.count(),
-    }
+    context['recent_budgets'] = partitioned_slice(
+        budgets.select_related('department'), 'department', department_ids, ('-created_at', '-id'), 5,
+        base=Budget.objects.select_related('department')
+    )
+    context['recent_bills'] = partitioned_slice(
+        bills.select_related('department'), 'department', department_ids, ('-created_at', '-id'), 5,
+        base=Bill.objects.select_related('department')
+    )
     
     logger.info(
         f"User {user} viewed budget resume",
@@ -129,6 +87,85 @@ def resume_budget(request):
     
     return render(request, 'app/budgets/budget.html', context)
 
+@staff_member_required
+def dashboard_cache_stats(request):
+    return JsonResponse(dashboard_cache.stats())
+
+# -- METRICS --
+def metrics_allowed(request):
+    """Authorization: Bearer METRICS_TOKEN, a METRICS_ALLOWED_IPS address or a staff session."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme == 'Bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+# Served at /metrics outside i18n_patterns (kashet/urls.py), a scraper gets a 403, not the login page
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def slow_queries(request):
+    context = {
+        'entries': slow_query_log.stats.summary(),
+        'dropped': slow_query_log.stats.dropped,
+        'enabled': settings.SLOW_QUERY_LOG,
+        'threshold': settings.SLOW_QUERY_THRESHOLD_MS,
+    }
+    return render(request, 'app/slow_queries/slow_queries.html', context)
+
+# -- SEARCH --
+SEARCH_PAGE_SIZE = 20
+
+@login_required
+def search(request):
+    user = request.user
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('kind')
+    if kind not in search_index.KINDS:
+        kind = ''
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+
+    department_ids = None if user.is_superuser else list(user.departments.values_list('id', flat=True))
+    hits = search_index.search(
+        query, department_ids, kind or None,
+        limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE
+    )
+    has_next = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+
+    # Objetos de la pagina en dos consultas, respetando el orden del ranking
+    related = ('department', 'currency', 'status')
+    objects = {
+        'budget': Budget.objects.select_related(*related).in_bulk(
+            [pk for hit_kind, pk in hits if hit_kind == 'budget']
+        ),
+        'bill': Bill.objects.select_related(*related).in_bulk(
+            [pk for hit_kind, pk in hits if hit_kind == 'bill']
+        ),
+    }
+    results = [
+        {'kind': hit_kind, 'object': objects[hit_kind][pk]}
+        for hit_kind, pk in hits if pk in objects[hit_kind]
+    ]
+
+    context = {
+        'query': query,
+        'kind': kind,
+        'results': results,
+        'page': page,
+        'has_next': has_next,
+        'has_previous': page > 1,
+        'next_page': page + 1,
+        'previous_page': page - 1,
+    }
+    return render(request, 'app/search/search.html', context)
+
 # -- LOGIN & LOGOUT --
 def login_view(request):
 
@@ -161,21 +198,52 @@ def logout_view(request):
 
 # ---- BUDGET ----
 
-class BudgetListView(LoginRequiredMixin, ListView):
+class DepartmentScopeMixin:
+    """Departments the user can see, None for superusers."""
+
+    def get_cursor_partitions(self):
+        user = self.request.user
+        if user.is_superuser:
+            return None
+        if not hasattr(self, '_department_ids'):
+            self._department_ids = list(user.departments.values_list('id', flat=True))
+        return self._department_ids
+
+def department_balances(user):
+    if user.is_superuser:
+        return DepartmentBalance.objects.all()
+    return DepartmentBalance.objects.filter(department__in=user.departments.all())
+
+class BudgetListView(LoginRequiredMixin, DepartmentScopeMixin, CursorPaginationMixin, ListView):
     model = Budget
     template_name = 'app/budgets/budget_list.html'
     context_object_name = 'budgets'
     paginate_by = 10
 
+    def get_cursor_base_queryset(self):
+        # Relaciones y has_bills cargados en la misma consulta de la pagina
+        return (
+            Budget.objects
+            .select_related('department', 'type', 'status', 'currency')
+            .annotate(bills_exist=Exists(Bill.objects.filter(budget=OuterRef('pk'))))
+            .defer('description')
+        )
+
     def get_queryset(self):
         user = self.request.user
+        queryset = self.get_cursor_base_queryset()
 
-        if user.is_superuser:
-            return Budget.objects.all().order_by('-created_at')
-        else:
-            return Budget.objects.filter(
-                department__in= user.departments.all()
-            ).order_by('-created_at')
+        if not user.is_superuser:
+            queryset = queryset.filter(
+                department__in= self.get_cursor_partitions()
+            )
+        return queryset
+
+    def get_total_count(self, queryset):
+        # El balance de departamentos ya lleva la cuenta de presupuestos
+        return department_balances(self.request.user).aggregate(
+            total=Sum('budgets_count')
+        )['total'] or 0
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -347,7 +415,7 @@ class BudgetUpdateView(LoginRequiredMixin, UpdateView):
                 label = form.fields[field].label if field in form.fields else field
                 errors.append(label)
             logger.warning(
-                f"Error trying update budget '{self.object.title}' in fields: {errors} by {self.request.user if self.request.user else "Anom"}",
+                f"Error trying update budget '{self.object.title}' in fields: {errors} by {self.request.user if self.request.user else 'Anom'}",
                 extra = {
                     "user": self.request.user if self.request.user.is_authenticated else None,
                     "path": self.request.path,
@@ -407,21 +475,25 @@ class BudgetDeleteView(LoginRequiredMixin, DeleteView):
         return super().dispatch(request, *args, **kwargs)
 
 # ---- BILL ----
-class BillListView(LoginRequiredMixin, ListView):
+class BillListView(LoginRequiredMixin, DepartmentScopeMixin, CursorPaginationMixin, ListView):
     model = Bill
     template_name = 'app/bills/bills_list.html'
     context_object_name = 'bills'
     paginate_by = 10
 
+    def get_cursor_base_queryset(self):
+        return Bill.objects.select_related(
+            'budget', 'department', 'type', 'category', 'status', 'currency'
+        ).defer('description', 'budget__description')
+
     def get_queryset(self):
         user = self.request.user
+        queryset = self.get_cursor_base_queryset()
 
-        if user.is_superuser:
-            queryset = Bill.objects.all().order_by('-created_at')
-        else:
-            queryset = Bill.objects.filter(
-                department__in=user.departments.all()
-            ).order_by('-created_at')
+        if not user.is_superuser:
+            queryset = queryset.filter(
+                department__in=self.get_cursor_partitions()
+            )
         
         category_id = self.request.GET.get('category', '0')
         if category_id and category_id != '0':
@@ -430,7 +502,14 @@ class BillListView(LoginRequiredMixin, ListView):
             elif category_id != '':  # Solo filtrar si no es vacío
                 queryset = queryset.filter(category_id=category_id)
         
-        return queryset.order_by('-created_at')
+        return queryset
+
+    def get_total_count(self, queryset):
+        if self.request.GET.get('category', '0') in ('0', ''):
+            return department_balances(self.request.user).aggregate(
+                total=Sum('bills_count')
+            )['total'] or 0
+        return super().get_total_count(queryset)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -602,7 +681,7 @@ class BillUpdateView(LoginRequiredMixin, UpdateView):
                 label = form.fields[field].label if field in form.fields else field
                 errors.append(label)
             logger.warning(
-                f"Error trying update bill '{self.object.title}' in fields: {errors} by {self.request.user if self.request.user else "Anom"}",
+                f"Error trying update bill '{self.object.title}' in fields: {errors} by {self.request.user if self.request.user else 'Anom'}",
                 extra = {
                     "user": self.request.user if self.request.user.is_authenticated else None,
                     "path": self.request.path,
@@ -655,6 +734,16 @@ class BillDeleteView(LoginRequiredMixin, DeleteView):
     
         return super().dispatch(request, *args, **kwargs)
 # ---- BILL CATEGORIES ----
+def count_subquery(model, field):
+    """Correlated COUNT of `model` rows pointing to the outer row through `field`."""
+    return Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+
 class CategoryBillsList(LoginRequiredMixin, ListView):
     template_name = 'app/bills/categories/bills_categories.html'
     model = CategoryBill
@@ -662,7 +751,16 @@ class CategoryBillsList(LoginRequiredMixin, ListView):
     paginate_by = 10
     
     def get_queryset(self):
-        return CategoryBill.objects.all().order_by('name')
+        return (
+            CategoryBill.objects
+            .select_related('parent')
+            .prefetch_related('subcategories')
+            .annotate(
+                bills_total=Coalesce(count_subquery(Bill, 'category'), 0),
+                subcategories_total=Coalesce(count_subquery(CategoryBill, 'parent'), 0),
+            )
+            .order_by('name')
+        )
 
 class CategoryBillCreateView(LoginRequiredMixin, CreateView):
     model = CategoryBill
@@ -704,7 +802,27 @@ class CategoryBillDeleteView(LoginRequiredMixin, DeleteView):
 
 @login_required
 def bills_reports(request):
-    return render(request, 'app/bills/bills_reports.html')
+    user = request.user
+
+    if user.is_superuser:
+        department_ids = None
+        departments = Department.objects.all()
+    else:
+        department_ids = list(user.departments.values_list('id', flat=True))
+        departments = Department.objects.filter(id__in=department_ids)
+
+    period = request.GET.get('months', '1')
+    if period not in REPORT_PERIODS:
+        period = '1'
+    department_id = request.GET.get('department', '')
+    if not department_id.isdigit():
+        department_id = ''
+
+    context = build_bills_report(department_ids, REPORT_PERIODS[period], department_id or None)
+    context['departments'] = departments
+    context['selected_period'] = period
+    context['selected_department'] = department_id
+    return render(request, 'app/bills/bills_reports.html', context)
 
 # ---- DEPARTMENT ----
 
@@ -718,17 +836,20 @@ class DepartmentListView(LoginRequiredMixin, ListView):
         query_set = super().get_queryset()
         user = self.request.user
 
-        if user.is_superuser:
-            return query_set
+        if not user.is_superuser:
+            #return Budget.objects.all().order_by('-created_at')
+            query_set = user.departments.all()
         
-        #return Budget.objects.all().order_by('-created_at')
-        return user.departments.all()
+        return query_set.with_ledger_totals().order_by('id')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        context['total_budgets'] = Budget.objects.count()
-        context['total_bills'] = Bill.objects.count()
+        totals = DepartmentBalance.objects.aggregate(
+            budgets=Sum('budgets_count'), bills=Sum('bills_count')
+        )
+        context['total_budgets'] = totals['budgets'] or 0
+        context['total_bills'] = totals['bills'] or 0
 
         return context
 
@@ -742,8 +863,8 @@ class DepartmentDetailsView(LoginRequiredMixin, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['budgets'] = self.object.budgets.all().order_by('-created_at')[:5]
-        context['bills'] = self.object.bills.all().order_by('-created_at')[:5]
+        context['budgets'] = self.object.budgets.select_related('currency').order_by('-created_at')[:5]
+        context['bills'] = self.object.bills.select_related('currency').order_by('-created_at')[:5]
         return context
     
 class DepartmentCreateView(LoginRequiredMixin, CreateView):
@@ -20,6 +20,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from django.utils.translation import gettext_lazy as translate
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,6 +56,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
             
     # other middleware classes
+    'app.middleware.metrics.MetricsMiddleware', # First, measures the whole stack
+    'app.middleware.slow_queries.SlowQueryMiddleware', # Only with SLOW_QUERY_LOG = True
+    'app.middleware.nplusone.NPlusOneMiddleware', # Only with NPLUSONE_MODE
     'htmlmin.middleware.HtmlMinifyMiddleware',
     'htmlmin.middleware.MarkRequestMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -64,6 +69,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'app.middleware.replica.ReplicaMiddleware', # Only with DATABASE_READ_REPLICAS
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'app.middleware.activity_log.ActivityLogMiddleware',
 ]
@@ -72,7 +78,8 @@ ROOT_URLCONF = 'kashet.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.utils.metrics.TimedDjangoTemplates', # DjangoTemplates reporting render time to /metrics
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -92,13 +99,137 @@ WSGI_APPLICATION = 'kashet.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+TESTING = sys.argv[1:2] == ['test']
+
+# DATABASE_ENGINE=postgresql (pip install "psycopg[binary,pool]") uses
+# DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST and
+# DATABASE_PORT, the logs go to DATABASE_LOGS_NAME if set, else to default.
+# Tests run on SQLite unless TEST_DATABASE_ENGINE (or DATABASE_ENGINE) names another engine.
+
+def postgres_database(name):
+    pool = os.environ.get('DATABASE_POOL', '1') == '1'
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': name,
+        'USER': os.environ.get('DATABASE_USER', 'kashet'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        # The pool keeps the connections, CONN_MAX_AGE must stay 0 with it
+        'CONN_MAX_AGE': 0 if pool else DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+                'timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+            },
+        } if pool else {},
+    }
+
+DATABASE_ENGINE = (
+    (os.environ.get('TEST_DATABASE_ENGINE') if TESTING else None) or os.environ.get('DATABASE_ENGINE') or 'sqlite'
+)
+
+# Persistent connections, closed after CONN_MAX_AGE seconds or when unusable.
+# IMMEDIATE takes the write lock at BEGIN, so busy_timeout applies instead of
+# failing when a read transaction tries to upgrade to write.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+SQLITE_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+}
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': postgres_database(os.environ.get('DATABASE_NAME', 'kashet')),
+    }
+    if os.environ.get('DATABASE_LOGS_NAME'):
+        # ActivityLog only: python manage.py migrate --database=logs
+        DATABASES['logs'] = postgres_database(os.environ['DATABASE_LOGS_NAME'])
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': SQLITE_OPTIONS,
+        },
+        # ActivityLog only: python manage.py migrate --database=logs
+        'logs': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_LOGS_NAME', BASE_DIR / 'logs.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': SQLITE_OPTIONS,
+        },
     }
+else:
+    raise ValueError(f"DATABASE_ENGINE must be 'sqlite' or 'postgresql', not '{DATABASE_ENGINE}'")
+
+# Read replica, see ReplicaRouter in app/utils/db_router.py. DATABASE_REPLICA_NAME
+# is the SQLite copy (refreshed with litestream, sqlite3 .backup, ...) or the
+# PostgreSQL database at DATABASE_REPLICA_HOST. Tests only get an (empty)
+# replica with DATABASE_REPLICA_NAME set, ReplicaRouterTest is skipped otherwise.
+DATABASE_REPLICA_NAME = os.environ.get('DATABASE_REPLICA_NAME')
+if DATABASE_REPLICA_NAME:
+    if DATABASE_ENGINE == 'postgresql':
+        DATABASES['replica'] = postgres_database(DATABASE_REPLICA_NAME)
+        DATABASES['replica']['HOST'] = os.environ.get('DATABASE_REPLICA_HOST', DATABASES['replica']['HOST'])
+        DATABASES['replica']['TEST'] = {'NAME': f"test_{DATABASES['replica']['NAME']}_replica"}
+    else:
+        DATABASES['replica'] = dict(DATABASES['default'], NAME=DATABASE_REPLICA_NAME)
+DATABASE_READ_REPLICAS = ['replica'] if DATABASE_REPLICA_NAME and not TESTING else []
+# GET requests of these views read from the replica
+DATABASE_REPLICA_VIEWS = (
+    'app.views.resume_budget',
+    'app.views.bills_reports',
+    'app.views.DepartmentDetailsView',
+)
+# Reads stay on the primary this long after a user's own write
+DATABASE_REPLICA_STICKY_SECONDS = 10
+
+# PRAGMAs run on every new SQLite connection (app/utils/db_tuning.py), {} to disable
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000, # ms
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000, # KiB
+    'temp_store': 'MEMORY',
 }
 
+DATABASE_ROUTERS = ['app.utils.db_router.ActivityLogRouter', 'app.utils.db_router.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# LocMemCache lives in each process: with several workers the resume_budget
+# summaries are cached per worker and the invalidations of signals.py only
+# reach the worker that made the write, the others serve theirs until
+# DASHBOARD_CACHE_TIMEOUT. CACHE_REDIS_URL (pip install redis) shares them,
+# e.g. redis://localhost:6379/1
+
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'kashet',
+        }
+    }
+
+# Seconds a resume_budget summary stays cached, signals invalidate it before on changes
+DASHBOARD_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -156,9 +287,20 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads stored once per content under media/blobs/, see app/utils/storage.py
+STORAGES = {
+    'default': {
+        'BACKEND': 'app.utils.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # LOGS
 
-LOG_DIRS = os.path.join(BASE_DIR, "logs")
+# Tests write their logs (slow queries at SLOW_QUERY_THRESHOLD_MS=0, ...) to a throwaway dir
+LOG_DIRS = tempfile.mkdtemp(prefix="kashet-test-logs-") if TESTING else os.path.join(BASE_DIR, "logs")
 os.makedirs(LOG_DIRS, exist_ok=True)
 
 LOGGING = {
@@ -170,13 +312,38 @@ LOGGING = {
             "style": "{",
         },
         "simple": {"format": "{levelname}: {message}", "style": "{"},
+        "json": {"()": "app.utils.log_handlers.JsonFormatter"},
     },
     "handlers":{
+        # Request threads only enqueue, the listener thread writes to file and console.
+        # "()" and cfg:// work on every Python, see QueueLogHandler
+        "queue": {
+            "()": "app.utils.log_handlers.QueueLogHandler",
+            "maxsize": 10000,
+            "handlers": ["cfg://handlers.file", "cfg://handlers.console"],
+            "respect_handler_level": True,
+        },
         "file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "class": "app.utils.log_handlers.GzipRotatingFileHandler", # or GzipTimedRotatingFileHandler with "when": "midnight"
             "filename": os.path.join(LOG_DIRS, "system.log"),
-            "formatter": "verbose",
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 10,
+            "encoding": "utf-8",
+            "formatter": "json",
+        },
+        "slow_queries_queue": {
+            "()": "app.utils.log_handlers.QueueLogHandler",
+            "maxsize": 10000,
+            "handlers": ["cfg://handlers.slow_queries_file"],
+        },
+        "slow_queries_file": {
+            "class": "app.utils.log_handlers.GzipRotatingFileHandler",
+            "filename": os.path.join(LOG_DIRS, "slow_queries.log"),
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "encoding": "utf-8",
+            "formatter": "json",
         },
         "db": {
             "level": "WARNING", # Just warning or errors save into the database
@@ -189,18 +356,63 @@ LOGGING = {
     },
     "loggers":{
         "django": {
-            "handlers": ["file", "console"],
+            "handlers": ["queue"],
             "level": "INFO",
             "propagate": True,
         },
         "app": {
-            "handlers": ["file", "db", "console"],
+            "handlers": ["queue", "db"],
             "level": "INFO",
             "propagate": False,
         },
+        "kashet": {
+            "handlers": ["queue"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "kashet.slow_queries": {
+            "handlers": ["slow_queries_queue"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     },
 }
 
+# ACTIVITY LOG WRITER
+# Rows are buffered and bulk inserted from a background thread, see app/utils/log_writer.py
+
+ACTIVITY_LOG_ASYNC = not TESTING
+ACTIVITY_LOG_QUEUE_SIZE = 10000
+ACTIVITY_LOG_BATCH_SIZE = 200
+ACTIVITY_LOG_FLUSH_INTERVAL = 1.0 # seconds
+ACTIVITY_LOG_MAX_PENDING_COUNTERS = 50000 # ActivityCounter buckets kept while the upsert fails, the oldest minutes go first
+ACTIVITY_LOG_SAMPLE_RATE = 1.0 # Share of POST/PUT/DELETE requests that keep a raw ActivityLog row, all of them feed ActivityCounter
+# Tests keep the logs in the default test database
+ACTIVITY_LOG_DATABASE = 'default' if TESTING else 'logs'
+
+# Older rows are moved to monthly gzipped JSONL files: python manage.py archive_activity_logs
+ACTIVITY_LOG_RETENTION_DAYS = 90
+ACTIVITY_LOG_ARCHIVE_DIR = os.path.join(LOG_DIRS, "activity_archive")
+
+# SLOW QUERIES
+# Queries over the threshold go to logs/slow_queries.log and /slow_queries/
+
+SLOW_QUERY_LOG = False
+SLOW_QUERY_THRESHOLD_MS = 100
+
+# METRICS
+# /metrics answers scrapers sending "Authorization: Bearer <METRICS_TOKEN>" or
+# connecting from METRICS_ALLOWED_IPS (comma separated), and staff sessions
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# N+1 QUERIES
+# Same SELECT more than NPLUSONE_THRESHOLD times in a request: warn in DEBUG, fail under tests
+
+NPLUSONE_MODE = 'raise' if TESTING else ('warn' if DEBUG else None)
+NPLUSONE_THRESHOLD = 5
+
 # CUSTOM AUTH MODEL
 
 AUTH_USER_MODEL = 'app.CustomUser'
@@ -19,10 +19,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
+from app import views as app_views
 
 
 urlpatterns = [
     path('i18n/', include('django.conf.urls.i18n')),
+    # Prometheus scrape endpoint, not translated
+    path('metrics', app_views.metrics_view, name='metrics'),
 ]
 
 urlpatterns += i18n_patterns(